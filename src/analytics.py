@@ -0,0 +1,270 @@
+# analytics.py
+# Аналитика по всем периодам: оценки загружаются один раз в плотную матрицу
+# (опросы x компетенции) и дальше все статистики считаются векторно в NumPy.
+import sqlite3
+from collections import namedtuple
+
+import numpy as np
+
+TrendRow = namedtuple("TrendRow", "employee_id period average previous change")
+PercentileRow = namedtuple("PercentileRow", "employee_id category_id average percentile")
+Distribution = namedtuple("Distribution", "count mean std quartiles bins counts")
+GapRow = namedtuple("GapRow", "competency_id category_id average gap below_target")
+
+
+def _sql(conn, sql):
+    # Функции работают и с psycopg2, и с sqlite3 (локальное хранилище)
+    return sql.replace("%s", "?") if isinstance(conn, sqlite3.Connection) else sql
+
+
+def _placeholders(values):
+    # IN (...) вместо = ANY(%s): массивы есть только в PostgreSQL
+    return "(" + ", ".join(["%s"] * len(values)) + ")"
+
+
+class ScoreMatrix:
+    """Оценки всех опросов: scores[i, j] - оценка опроса i по компетенции j (NaN, если её нет).
+    Для строк хранятся id опроса, индекс сотрудника и индекс периода, для столбцов - категория."""
+
+    CHUNK_ROWS = 50000
+    # Если изменённых опросов больше, дешевле перечитать все
+    MAX_REFRESH_SURVEYS = 5000
+
+    def __init__(self):
+        self.survey_ids = np.empty(0, dtype=np.int64)
+        self.survey_employee = np.empty(0, dtype=np.int64)
+        self.survey_period = np.empty(0, dtype=np.int64)
+        self.employee_ids = np.empty(0, dtype=np.int64)
+        self.periods = []
+        self.competency_ids = np.empty(0, dtype=np.int64)
+        self.competency_category = np.empty(0, dtype=np.int64)
+        self.category_ids = np.empty(0, dtype=np.int64)
+        self.scores = np.empty((0, 0))
+
+    @classmethod
+    def load(cls, conn):
+        matrix = cls()
+        matrix._set_competencies(matrix._read_competencies(conn))
+        matrix._load_surveys(conn)
+        return matrix
+
+    def refresh(self, conn, survey_ids=None):
+        """Новая матрица, в которой заново прочитаны опросы survey_ids: добавленные, изменённые и удалённые
+        после загрузки (id из уведомлений ChangeListener); None - перечитать всё. Сама матрица не меняется,
+        поэтому другой поток может читать её, пока строится новая."""
+        if survey_ids is None:
+            return self.load(conn)
+        survey_ids = set(survey_ids)
+        competencies = self._read_competencies(conn)
+        added = np.setdiff1d(competencies[:, 0], self.competency_ids)
+        if len(added):
+            # Компетенция получила категорию: её старые оценки ещё не загружены
+            cursor = conn.cursor()
+            cursor.execute(_sql(conn, f"SELECT DISTINCT survey_id FROM survey_scores "
+                                      f"WHERE competency_id IN {_placeholders(added)};"), [int(i) for i in added])
+            survey_ids.update(row[0] for row in cursor.fetchall())
+        if len(survey_ids) > self.MAX_REFRESH_SURVEYS:
+            return self.load(conn)
+
+        matrix = type(self)()
+        keep = ~np.isin(self.survey_ids, list(survey_ids))
+        matrix.survey_ids = self.survey_ids[keep]
+        matrix.survey_employee = self.survey_employee[keep]
+        matrix.survey_period = self.survey_period[keep]
+        matrix.employee_ids = self.employee_ids
+        matrix.periods = list(self.periods)
+        matrix.competency_ids = self.competency_ids
+        matrix.scores = self.scores[keep]
+        matrix._prune()
+        matrix._set_competencies(competencies)
+        if survey_ids:
+            matrix._load_surveys(conn, sorted(survey_ids))
+        return matrix
+
+    def _read_competencies(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(_sql(conn, "SELECT id, category_id FROM competencies WHERE category_id IS NOT NULL "
+                                  "ORDER BY id;"))
+        return np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+
+    def _load_surveys(self, conn, survey_ids=None):
+        # Дописывает строки опросов survey_ids (все опросы, если None); удалённых в базе уже нет
+        where = "" if survey_ids is None else f"WHERE id IN {_placeholders(survey_ids)}"
+        cursor = conn.cursor()
+        cursor.execute(_sql(conn, f"SELECT id, employee_id, period FROM surveys {where} ORDER BY id;"),
+                       survey_ids or ())
+        surveys = cursor.fetchall()
+        if not surveys:
+            return
+        new_ids = np.array([row[0] for row in surveys], dtype=np.int64)
+        offset = len(self.survey_ids)
+        self._append_surveys(new_ids, [row[1] for row in surveys], [row[2] for row in surveys])
+        if not len(self.competency_ids):
+            return
+
+        where = "" if survey_ids is None else f"WHERE survey_id IN {_placeholders(survey_ids)}"
+        cursor.execute(_sql(conn, f"SELECT survey_id, competency_id, score FROM survey_scores {where};"),
+                       survey_ids or ())
+        while True:
+            chunk = cursor.fetchmany(self.CHUNK_ROWS)
+            if not chunk:
+                break
+            chunk = np.array(chunk, dtype=np.float64)
+            survey_ids_chunk = chunk[:, 0].astype(np.int64)
+            competency_ids = chunk[:, 1].astype(np.int64)
+            rows = np.minimum(np.searchsorted(new_ids, survey_ids_chunk), len(new_ids) - 1)
+            cols = np.minimum(np.searchsorted(self.competency_ids, competency_ids), len(self.competency_ids) - 1)
+            # Пропускаем оценки компетенций без категории и опросов, записанных после выборки
+            known = (new_ids[rows] == survey_ids_chunk) & (self.competency_ids[cols] == competency_ids)
+            self.scores[offset + rows[known], cols[known]] = chunk[known, 2]
+
+    def _prune(self):
+        # Сотрудники и периоды, у которых не осталось опросов (удалённый квартал), убираются
+        employees = np.unique(self.survey_employee)
+        self.employee_ids = self.employee_ids[employees]
+        self.survey_employee = np.searchsorted(employees, self.survey_employee)
+        periods = np.unique(self.survey_period)
+        self.periods = [self.periods[i] for i in periods]
+        self.survey_period = np.searchsorted(periods, self.survey_period)
+
+    def _set_competencies(self, competencies):
+        ids, categories = competencies[:, 0], competencies[:, 1]
+        if not np.array_equal(ids, self.competency_ids):
+            # Состав компетенций изменился: переносим уже загруженные столбцы по id
+            scores = np.full((len(self.survey_ids), len(ids)), np.nan)
+            _, old_cols, new_cols = np.intersect1d(self.competency_ids, ids, return_indices=True)
+            scores[:, new_cols] = self.scores[:, old_cols]
+            self.scores = scores
+            self.competency_ids = ids
+        self.competency_category = categories
+        self.category_ids = np.unique(categories)
+
+    def _append_surveys(self, ids, employees, periods):
+        employees = np.array(employees, dtype=np.int64)
+        employee_ids = np.union1d(self.employee_ids, employees)
+        if len(employee_ids) != len(self.employee_ids):
+            self.survey_employee = np.searchsorted(employee_ids, self.employee_ids[self.survey_employee])
+            self.employee_ids = employee_ids
+        # Периоды упорядочены по возрастанию ("2024-Q4" < "2025-Q1"), индексы старых опросов пересчитываются
+        all_periods = sorted(set(self.periods) | set(periods))
+        if all_periods != self.periods:
+            position = {period: i for i, period in enumerate(all_periods)}
+            remap = np.array([position[period] for period in self.periods], dtype=np.int64)
+            self.survey_period = remap[self.survey_period]
+            self.periods = all_periods
+        position = {period: i for i, period in enumerate(self.periods)}
+
+        self.survey_ids = np.concatenate([self.survey_ids, ids])
+        self.survey_employee = np.concatenate([self.survey_employee, np.searchsorted(self.employee_ids, employees)])
+        self.survey_period = np.concatenate([self.survey_period,
+                                             np.array([position[period] for period in periods], dtype=np.int64)])
+        self.scores = np.vstack([self.scores, np.full((len(ids), len(self.competency_ids)), np.nan)])
+
+    # Агрегаты
+
+    def _rows(self, period=None):
+        if period is None:
+            return np.ones(len(self.survey_ids), dtype=bool)
+        if period not in self.periods:
+            return np.zeros(len(self.survey_ids), dtype=bool)
+        return self.survey_period == self.periods.index(period)
+
+    def _sums_counts(self, columns=None):
+        # Суммы и количества оценок каждого опроса по выбранным столбцам
+        scores = self.scores if columns is None else self.scores[:, columns]
+        present = ~np.isnan(scores)
+        return np.where(present, scores, 0.0).sum(axis=1), present.sum(axis=1)
+
+    def category_averages(self):
+        """Матрица опросы x категории (NaN, если оценок категории в опросе нет)"""
+        one_hot = (self.competency_category[:, None] == self.category_ids[None, :]).astype(np.float64)
+        present = ~np.isnan(self.scores)
+        sums = np.where(present, self.scores, 0.0) @ one_hot
+        counts = present.astype(np.float64) @ one_hot
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+    def _group_mean(self, group_rows, group_cols, sums, counts, shape):
+        total = np.zeros(shape)
+        number = np.zeros(shape)
+        np.add.at(total, (group_rows, group_cols), sums)
+        np.add.at(number, (group_rows, group_cols), counts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / number
+
+    def employee_period_averages(self, category_id=None):
+        """Матрица сотрудники x периоды: средняя оценка (по категории, если указана)"""
+        columns = None if category_id is None else self.competency_category == category_id
+        sums, counts = self._sums_counts(columns)
+        return self._group_mean(self.survey_employee, self.survey_period, sums, counts,
+                                (len(self.employee_ids), len(self.periods)))
+
+    def trends(self, category_id=None):
+        """Изменение средней оценки сотрудника по сравнению с его предыдущим оценённым периодом"""
+        averages = self.employee_period_averages(category_id)
+        rated = ~np.isnan(averages)
+        # Индекс последнего оценённого периода до текущего (или -1)
+        last = np.maximum.accumulate(np.where(rated, np.arange(len(self.periods)), -1), axis=1)
+        previous_index = np.full_like(last, -1)
+        previous_index[:, 1:] = last[:, :-1]
+        previous = np.take_along_axis(averages, np.maximum(previous_index, 0), axis=1)
+        previous[previous_index < 0] = np.nan
+        change = averages - previous
+        return [TrendRow(int(self.employee_ids[e]), self.periods[p], float(averages[e, p]),
+                         None if np.isnan(previous[e, p]) else float(previous[e, p]),
+                         None if np.isnan(change[e, p]) else float(change[e, p]))
+                for e, p in zip(*np.nonzero(rated))]
+
+    def percentile_ranks(self, period=None):
+        """Процентильный ранг средней оценки сотрудника внутри каждой категории (0-100)"""
+        mask = self._rows(period)
+        categories = self.category_averages()[mask]
+        present = ~np.isnan(categories)
+        shape = (len(self.employee_ids), len(self.category_ids))
+        total = np.zeros(shape)
+        number = np.zeros(shape)
+        np.add.at(total, self.survey_employee[mask], np.where(present, categories, 0.0))
+        np.add.at(number, self.survey_employee[mask], present)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = total / number
+
+        rows = []
+        for c, category_id in enumerate(self.category_ids):
+            rated = np.flatnonzero(~np.isnan(averages[:, c]))
+            values = averages[rated, c]
+            ordered = np.sort(values)
+            # Ранг с учётом равных значений: (строго меньше + не больше) / 2
+            below = np.searchsorted(ordered, values, side="left")
+            not_above = np.searchsorted(ordered, values, side="right")
+            percentile = (below + not_above) / 2 / max(len(values), 1) * 100
+            rows.extend(PercentileRow(int(self.employee_ids[e]), int(category_id), float(v), float(p))
+                        for e, v, p in zip(rated, values, percentile))
+        return rows
+
+    def distribution(self, category_id=None, period=None, bins=None):
+        """Распределение всех оценок команды (по категории и периоду, если заданы).
+        По умолчанию корзины шириной 0.5 с центрами 1, 1.5, ..., 5."""
+        bins = np.arange(0.75, 5.5, 0.5) if bins is None else bins
+        scores = self.scores[self._rows(period)]
+        if category_id is not None:
+            scores = scores[:, self.competency_category == category_id]
+        values = scores[~np.isnan(scores)]
+        counts, edges = np.histogram(values, bins=bins)
+        if not len(values):
+            return Distribution(0, None, None, None, edges.tolist(), counts.tolist())
+        quartiles = np.percentile(values, [25, 50, 75])
+        return Distribution(len(values), float(values.mean()), float(values.std()),
+                            quartiles.tolist(), edges.tolist(), counts.tolist())
+
+    def gap_analysis(self, target=4.0, period=None):
+        """Разрыв между целевым уровнем и средней оценкой по каждой компетенции, от большего к меньшему"""
+        scores = self.scores[self._rows(period)]
+        present = ~np.isnan(scores)
+        counts = present.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.where(present, scores, 0.0).sum(axis=0) / counts
+            below = (present & (scores < target)).sum(axis=0) / counts
+        order = np.argsort(-(target - averages))
+        return [GapRow(int(self.competency_ids[j]), int(self.competency_category[j]), float(averages[j]),
+                       float(target - averages[j]), float(below[j]))
+                for j in order if counts[j]]
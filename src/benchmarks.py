@@ -0,0 +1,677 @@
+# benchmarks.py
+# Замеры производительности функций работы с базой данных.
+# Каждый замер выполняется во временной схеме, рабочие таблицы не затрагиваются.
+#
+# Запуск:  python benchmarks.py [имя_замера ...] [--json results.json] [--local-postgres]
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import psycopg2
+
+from kurwithGUI import (
+    init_db,
+    add_employee,
+    get_employees,
+    search_employees,
+    PrefixCache,
+    add_category,
+    add_competency,
+    get_competencies_by_category,
+    add_survey,
+    add_survey_score,
+    add_survey_scores,
+    get_competencies_by_categories,
+    prepared_statements,
+    submit_survey,
+    catalog_cache,
+    PostgresStoragePool,
+    DeferredPool,
+    WriteBehind,
+    init_db_cached,
+    load_db_params,
+    get_survey_scores,
+    get_survey_averages,
+    get_survey_results,
+    get_surveys_between,
+    get_period_summary,
+    get_period_partitions,
+    drop_period,
+    generate_reports,
+    get_report_employees,
+    period_start,
+    PeriodRange,
+    ARCHIVE_SCHEMA,
+    check_survey_totals,
+    query_stats,
+    InstrumentedCursor
+)
+
+
+# Результаты всех замеров текущего запуска, записываются в JSON по --json
+RESULTS = []
+
+
+def connect(params=None):
+    return psycopg2.connect(**(params or load_db_params()))
+
+
+@contextlib.contextmanager
+def local_postgres():
+    """Временный кластер PostgreSQL на свободном порту; программы ищутся в PG_BIN или PATH"""
+    path = os.environ.get("PG_BIN") or None
+    initdb, pg_ctl = shutil.which("initdb", path=path), shutil.which("pg_ctl", path=path)
+    if not initdb or not pg_ctl:
+        raise SystemExit("Не найдены initdb/pg_ctl: укажите каталог программ PostgreSQL в PG_BIN")
+    datadir = tempfile.mkdtemp(prefix="kurs_bench_pg_")
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    subprocess.run([initdb, "-D", datadir, "-U", "bench", "--auth=trust", "-E", "UTF8"],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([pg_ctl, "-D", datadir, "-l", os.path.join(datadir, "server.log"), "-w",
+                    "-o", f"-p {port} -k {datadir} -c listen_addresses=''", "start"],
+                   check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield dict(host=datadir, port=port, database="postgres", user="bench")
+    finally:
+        subprocess.run([pg_ctl, "-D", datadir, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(datadir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def scratch_schema(conn):
+    """Временная схема: таблицы создаются в ней и удаляются после замера"""
+    schema = f"bench_{os.getpid()}"
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema};")
+        cursor.execute(f"SET search_path TO {schema};")
+    conn.commit()
+    init_db(conn)
+    catalog_cache.invalidate()
+    try:
+        yield schema
+    finally:
+        catalog_cache.invalidate()
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+            cursor.execute("SET search_path TO DEFAULT;")
+        conn.commit()
+
+
+class CommitCounter:
+    """Обёртка над соединением, считающая вызовы commit()"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def scratch_params(conn):
+    # Параметры подключения для других соединений и процессов: та же база и временная схема замера
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW search_path;")
+        schema = cursor.fetchone()[0]
+    conn.commit()
+    return dict(conn.info.dsn_parameters, password=conn.info.password, options=f"-c search_path={schema}")
+
+
+def reset_tables(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("TRUNCATE survey_scores, surveys, competencies, categories, employees RESTART IDENTITY CASCADE;")
+    conn.commit()
+    catalog_cache.invalidate()
+
+
+def generate_dataset(conn, employees=100, categories=5, competencies=50, surveys=1000):
+    """Синтетические данные, вставляемые на стороне сервера через generate_series.
+    Опросы распределяются по сотрудникам по кругу, каждый следующий круг - новый квартал."""
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO employees (name) SELECT 'Employee ' || i FROM generate_series(1, %s) i;",
+                       (employees,))
+        cursor.execute("INSERT INTO categories (name) SELECT 'Category ' || i FROM generate_series(1, %s) i;",
+                       (categories,))
+        cursor.execute("""
+        INSERT INTO competencies (name, category_id)
+        SELECT 'Competency ' || i, (SELECT min(id) FROM categories) + i %% %s
+        FROM generate_series(1, %s) i;
+        """, (categories, competencies))
+        cursor.execute("""
+        INSERT INTO surveys (employee_id, period_start)
+        SELECT (SELECT min(id) FROM employees) + i %% %s,
+               make_date(2000 + i / %s / 4, 1 + i / %s %% 4 * 3, 1)
+        FROM generate_series(0, %s - 1) i;
+        """, (employees, employees, employees, surveys))
+        cursor.execute("""
+        INSERT INTO survey_scores (survey_id, competency_id, score, period_start)
+        SELECT s.id, c.id, 1 + (s.id + c.id) % 5, s.period_start
+        FROM surveys s CROSS JOIN competencies c;
+        """)
+    conn.commit()
+
+
+def measure(func, *args, **kwargs):
+    """Время выполнения (с) и пиковая память Python (МБ).
+    Память меряется отдельным прогоном, чтобы tracemalloc не искажал время."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def latencies(func, calls):
+    """Время каждого из calls вызовов func(i), с"""
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+
+def report(name, **values):
+    RESULTS.append(dict(name=name, **values))
+    fields = ", ".join(f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+                       for key, value in values.items())
+    print(f"{name}: {fields}")
+
+
+def report_latencies(name, samples, rows, peak_mb=None):
+    values = dict(calls=len(samples),
+                  p50_ms=percentile(samples, 50) * 1000,
+                  p95_ms=percentile(samples, 95) * 1000,
+                  p99_ms=percentile(samples, 99) * 1000,
+                  mean_ms=statistics.mean(samples) * 1000,
+                  rows_per_sec=rows / sum(samples))
+    if peak_mb is not None:
+        values["peak_mb"] = peak_mb
+    report(name, **values)
+
+
+def bench_submit_survey(conn, surveys=20, competencies=60):
+    """Запись опроса: по одному commit на оценку против одной транзакции"""
+    employee_id = add_employee(conn, "Benchmark")
+    cat_id = add_category(conn, "Benchmark")
+    comp_ids = [add_competency(conn, f"Competency {i}", cat_id) for i in range(competencies)]
+    scores = {comp_id: 1 + i % 5 for i, comp_id in enumerate(comp_ids)}
+
+    counter = CommitCounter(conn)
+    start = time.perf_counter()
+    for _ in range(surveys):
+        survey_id = add_survey(counter, employee_id, "2025-Q1")
+        for comp_id, score in scores.items():
+            add_survey_score(counter, survey_id, comp_id, score)
+    elapsed = time.perf_counter() - start
+    report("per-score commits", commits_per_survey=counter.commits // surveys,
+           ms_per_survey=elapsed / surveys * 1000)
+
+    counter = CommitCounter(conn)
+    start = time.perf_counter()
+    for _ in range(surveys):
+        submit_survey(counter, employee_id, "2025-Q1", scores)
+    elapsed = time.perf_counter() - start
+    report("submit_survey", commits_per_survey=counter.commits // surveys,
+           ms_per_survey=elapsed / surveys * 1000)
+
+
+def legacy_survey_results(conn):
+    """Прежняя реализация: группировка всех строк в Python и сборка строки через +="""
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT s.id, e.name, s.period, cat.name, comp.name, ss.score
+    FROM surveys s
+    JOIN employees e ON s.employee_id = e.id
+    JOIN survey_scores ss ON ss.survey_id = s.id
+    JOIN competencies comp ON ss.competency_id = comp.id
+    JOIN categories cat ON comp.category_id = cat.id
+    ORDER BY s.id;
+    """)
+    surveys = {}
+    for survey_id, employee_name, period, cat_name, comp_name, score in cursor.fetchall():
+        surveys.setdefault(survey_id, (employee_name, period, []))[2].append((cat_name, comp_name, score))
+    results = ""
+    for survey_id, (employee_name, period, scores) in surveys.items():
+        results += f"\nОпрос ID: {survey_id} | Сотрудник: {employee_name} | Период: {period}\n"
+        cat_totals = {}
+        cat_counts = {}
+        for cat_name, comp_name, score in scores:
+            results += f"  {cat_name} - {comp_name}: {score}\n"
+            cat_totals[cat_name] = cat_totals.get(cat_name, 0) + score
+            cat_counts[cat_name] = cat_counts.get(cat_name, 0) + 1
+        results += "Средние оценки по категориям:\n"
+        for cat, total in cat_totals.items():
+            results += f"  {cat}: {total / cat_counts[cat]:.2f}\n"
+        results += f"Общая оценка: {sum(cat_totals.values()) / sum(cat_counts.values()):.2f}\n"
+    return results
+
+
+def bench_survey_results(conn, surveys=10000, competencies=50):
+    """Отчёт по опросам: агрегация в Python против агрегации в PostgreSQL"""
+    generate_dataset(conn, employees=500, categories=5, competencies=competencies, surveys=surveys)
+    for name, func in [("legacy get_survey_results", legacy_survey_results),
+                       ("get_survey_results", get_survey_results),
+                       ("get_survey_averages", get_survey_averages)]:
+        result, elapsed, peak = measure(func, conn)
+        report(name, seconds=elapsed, peak_mb=peak, items=len(result))
+
+
+def raw_survey_averages(conn):
+    """Средние по категориям из сырых оценок, как до появления survey_category_totals"""
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT survey_id, employee_name, period, category,
+           total / cnt AS average,
+           SUM(total) OVER w / SUM(cnt) OVER w AS overall
+    FROM (
+        SELECT s.id AS survey_id, e.name AS employee_name, s.period, cat.name AS category,
+               SUM(ss.score)::float8 AS total, COUNT(*) AS cnt
+        FROM surveys s
+        JOIN employees e ON s.employee_id = e.id
+        JOIN survey_scores ss ON ss.survey_id = s.id
+        JOIN competencies comp ON ss.competency_id = comp.id
+        JOIN categories cat ON comp.category_id = cat.id
+        GROUP BY s.id, e.name, s.period, cat.name
+    ) per_category
+    WINDOW w AS (PARTITION BY survey_id)
+    ORDER BY survey_id, category;
+    """)
+    return cursor.fetchall()
+
+
+def bench_survey_totals(conn, surveys=10000, competencies=50, lookups=200):
+    """Отчёты по агрегатной таблице survey_category_totals против пересчёта из сырых оценок"""
+    generate_dataset(conn, employees=500, categories=5, competencies=competencies, surveys=surveys)
+    for name, func in [("averages from raw scores", raw_survey_averages),
+                       ("get_survey_averages (totals table)", get_survey_averages),
+                       ("get_survey_results", get_survey_results),
+                       ("check_survey_totals", check_survey_totals)]:
+        result, elapsed, peak = measure(func, conn)
+        report(name, seconds=elapsed, peak_mb=peak, items=len(result))
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM surveys ORDER BY random() LIMIT %s;", (lookups,))
+        survey_ids = [row[0] for row in cursor.fetchall()]
+    start = time.perf_counter()
+    for survey_id in survey_ids:
+        get_survey_averages(conn, survey_id=survey_id)
+    report("single survey lookup", ms=(time.perf_counter() - start) / len(survey_ids) * 1000)
+
+
+# Наборы данных для bench_data_layer: опросов у каждого сотрудника столько же, сколько кварталов
+SCALES = {
+    "small": dict(employees=100, categories=5, competencies=50, surveys_per_employee=4),
+    "medium": dict(employees=1000, categories=10, competencies=100, surveys_per_employee=8),
+    "large": dict(employees=10000, categories=10, competencies=100, surveys_per_employee=12),
+}
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return peak
+
+
+def bench_data_layer(conn, scales=("small", "medium")):
+    """Задержки (перцентили), строк/с и пиковая память основных функций на нескольких объёмах данных"""
+    for scale in scales:
+        config = SCALES[scale]
+        reset_tables(conn)
+        surveys = config["employees"] * config["surveys_per_employee"]
+        start = time.perf_counter()
+        generate_dataset(conn, config["employees"], config["categories"], config["competencies"], surveys)
+        elapsed = time.perf_counter() - start
+        score_rows = surveys * config["competencies"]
+        report(f"{scale}/generate_dataset", seconds=elapsed, rows_per_sec=score_rows / elapsed, **config)
+
+        samples = latencies(lambda i: add_employee(conn, f"Bench {i}"), 200)
+        report_latencies(f"{scale}/add_employee", samples, len(samples))
+
+        competency_ids = [row[0] for row in get_competencies_by_category(conn, 1)]
+        survey_ids = [add_survey(conn, 1, "2099-Q1") for _ in range(500 // len(competency_ids) + 1)]
+        samples = latencies(lambda i: add_survey_score(conn, survey_ids[i // len(competency_ids)],
+                                                       competency_ids[i % len(competency_ids)], 3), 500)
+        report_latencies(f"{scale}/add_survey_score", samples, len(samples))
+
+        rows = len(get_employees(conn))
+        samples = latencies(lambda i: get_employees(conn), 20)
+        report_latencies(f"{scale}/get_employees", samples, rows * len(samples), peak_memory(get_employees, conn))
+
+        rows = len(get_competencies_by_category(conn, 1))
+        samples = latencies(lambda i: get_competencies_by_category(conn, 1 + i % config["categories"]), 200)
+        report_latencies(f"{scale}/get_competencies_by_category", samples, rows * len(samples),
+                         peak_memory(get_competencies_by_category, conn, 1))
+
+        samples = latencies(lambda i: get_survey_results(conn), 3)
+        report_latencies(f"{scale}/get_survey_results", samples, score_rows * len(samples),
+                         peak_memory(get_survey_results, conn))
+
+
+def bench_instrumentation(conn, calls=2000):
+    """Накладные расходы инструментирования на коротком запросе"""
+    generate_dataset(conn, employees=10, categories=5, competencies=50, surveys=10)
+    raw = get_competencies_by_category.__wrapped__
+    variants = [("without instrumentation", raw, None, False),
+                ("instrumentation disabled", get_competencies_by_category, InstrumentedCursor, False),
+                ("instrumentation enabled", get_competencies_by_category, InstrumentedCursor, True)]
+    for name, func, cursor_factory, enabled in variants:
+        conn.cursor_factory = cursor_factory
+        query_stats.enabled = enabled
+        try:
+            samples = latencies(lambda i: func(conn, 1 + i % 5), calls)
+        finally:
+            conn.cursor_factory = None
+            query_stats.enabled = False
+        report_latencies(name, samples, calls)
+    query_stats.reset()
+
+
+def bench_analytics(conn, employees=1000, competencies=100, surveys=8000):
+    """Загрузка матрицы оценок, догрузка новых опросов и векторные статистики"""
+    from analytics import ScoreMatrix
+
+    generate_dataset(conn, employees, 10, competencies, surveys)
+    matrix, elapsed, peak = measure(ScoreMatrix.load, conn)
+    report("load", seconds=elapsed, peak_mb=peak, matrix_mb=matrix.scores.nbytes / 2 ** 20,
+           rows_per_sec=surveys * competencies / elapsed)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT min(id) FROM employees;")
+        employee_id = cursor.fetchone()[0]
+        cursor.execute("SELECT id FROM competencies;")
+        scores = {row[0]: 3 for row in cursor.fetchall()}
+    survey_ids = [submit_survey(conn, employee_id, "2099-Q1", scores) for _ in range(100)]
+    start = time.perf_counter()
+    matrix = matrix.refresh(conn, survey_ids)
+    report("refresh (+100 surveys)", seconds=time.perf_counter() - start)
+    for name, func in [("trends", matrix.trends), ("percentile_ranks", matrix.percentile_ranks),
+                       ("distribution", matrix.distribution), ("gap_analysis", matrix.gap_analysis)]:
+        report_latencies(name, latencies(lambda i: func(), 5), 5 * len(matrix.survey_ids))
+
+
+def bench_prepared(conn, scores=2000, lookups=2000, categories=20, competencies=100):
+    """Подготовленные запросы против текста SQL в каждом вызове: вставка оценок и выборка каталога"""
+    generate_dataset(conn, employees=10, categories=categories, competencies=competencies, surveys=0)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM competencies ORDER BY id;")
+        competency_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id FROM categories ORDER BY id;")
+        category_ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+
+    def score_rows():
+        # Каждый вариант пишет в пустые таблицы, чтобы рост индексов не влиял на сравнение
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE surveys CASCADE;")
+        conn.commit()
+        survey_ids = [add_survey(conn, 1, "2099-Q1") for _ in range(scores // len(competency_ids))]
+        return [(survey_id, comp_id, 3) for survey_id in survey_ids for comp_id in competency_ids]
+
+    for name, enabled in [("plain SQL", False), ("prepared", True)]:
+        prepared_statements.enabled = enabled
+        try:
+            rows = score_rows()
+            samples = latencies(lambda i: add_survey_score(conn, *rows[i]), len(rows))
+            report_latencies(f"add_survey_score, {name}", samples, len(rows))
+            samples = latencies(lambda i: get_competencies_by_category(conn, category_ids[i % categories]), lookups)
+            report_latencies(f"get_competencies_by_category, {name}", samples, lookups)
+        finally:
+            prepared_statements.enabled = True
+    rows = score_rows()
+    samples = latencies(lambda i: add_survey_scores(conn, rows), 1)
+    report_latencies("add_survey_scores (batch)", samples, len(rows))
+    samples = latencies(lambda i: get_competencies_by_categories(conn, category_ids), lookups // categories)
+    report_latencies("get_competencies_by_categories (batch)", samples, lookups)
+
+
+def bench_search(conn, employees=50000, lookups=500):
+    """Выбор сотрудника: загрузка всего списка против поиска по префиксу с кэшем недавних префиксов"""
+    generate_dataset(conn, employees=employees, categories=1, competencies=1, surveys=0)
+    samples = latencies(lambda i: get_employees(conn), 5)
+    report_latencies("get_employees (весь список)", samples, employees * len(samples))
+
+    # Ввод имени по одному символу: "e", "em", ..., "employee 12345"
+    prefixes = [f"employee {i * 7919 % employees + 1}"[:length]
+                for i in range(lookups // 10) for length in range(1, 11)][:lookups]
+    found = [0]
+
+    def search(i):
+        found[0] += len(search_employees(conn, prefixes[i]))
+
+    samples = latencies(search, len(prefixes))
+    report_latencies("search_employees", samples, found[0])
+
+    cache = PrefixCache()
+
+    def cached_search(i):
+        rows = cache.get(prefixes[i], 20)
+        if rows is None:
+            rows = search_employees(conn, prefixes[i])
+            cache.put(prefixes[i], 20, rows)
+        found[0] += len(rows)
+
+    found[0] = 0
+    samples = latencies(cached_search, len(prefixes))
+    report_latencies("search_employees + PrefixCache", samples, found[0])
+
+
+def period_scores(conn, start, end, pruned=True):
+    """Оценки за диапазон кварталов. pruned=False - без условия на ss.period_start и соединения по нему,
+    как до секционирования: читаются все секции survey_scores"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT s.id, s.period, ss.competency_id, ss.score
+    FROM surveys s
+    JOIN survey_scores ss ON ss.survey_id = s.id {"AND ss.period_start = s.period_start" if pruned else ""}
+    WHERE s.period_start BETWEEN %(start)s AND %(end)s
+    {"AND ss.period_start BETWEEN %(start)s AND %(end)s" if pruned else ""};
+    """, dict(start=period_start(start), end=period_start(end)))
+    return cursor.fetchall()
+
+
+def bench_periods(conn, employees=500, competencies=50, surveys=10000, calls=5):
+    """Секции survey_scores по кварталам: запрос за последние кварталы и удаление старого квартала"""
+    generate_dataset(conn, employees=employees, categories=5, competencies=competencies, surveys=surveys)
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE surveys; ANALYZE survey_scores;")
+    conn.commit()
+    periods = [row.period for row in get_period_summary(conn)]
+    recent = PeriodRange(periods[-2], periods[-1])
+    report("dataset", quarters=len(periods), partitions=len(get_period_partitions(conn)))
+
+    rows = len(period_scores(conn, *recent))
+    for name, pruned in [("оценки 2 последних кварталов, все секции", False),
+                         ("оценки 2 последних кварталов, только их секции", True)]:
+        samples = latencies(lambda i: period_scores(conn, *recent, pruned=pruned), calls)
+        report_latencies(name, samples, rows * calls)
+    samples = latencies(lambda i: get_survey_scores(conn, period=recent), calls)
+    report_latencies("get_survey_scores, 2 последних квартала", samples, rows * calls)
+    samples = latencies(lambda i: get_surveys_between(conn, *recent), calls)
+    report_latencies("get_surveys_between", samples, calls)
+
+    # Удаление квартала: построчный DELETE оценок (с пересчётом итогов) против удаления секции
+    with conn.cursor() as cursor:
+        start = time.perf_counter()
+        cursor.execute("DELETE FROM survey_scores WHERE period_start = %s;", (period_start(periods[1]),))
+        report("DELETE оценок квартала", seconds=time.perf_counter() - start, rows=cursor.rowcount)
+    conn.rollback()
+    for name, period, archive in [("drop_period", periods[1], False), ("drop_period archive=True", periods[0], True)]:
+        start = time.perf_counter()
+        deleted = drop_period(conn, period, archive)
+        report(name, seconds=time.perf_counter() - start, surveys=deleted)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA {ARCHIVE_SCHEMA} CASCADE;")
+    conn.commit()
+
+
+def bench_reports(conn, employees=2000, competencies=50, surveys=8000, workers=(1, 2, 4)):
+    """Пакетные отчёты: по запросу на сотрудника в одном процессе против порций в пуле процессов"""
+    generate_dataset(conn, employees=employees, categories=5, competencies=competencies, surveys=surveys)
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE surveys; ANALYZE survey_scores;")
+    conn.commit()
+    # Процессы пула подключаются к временной схеме замера
+    params = scratch_params(conn)
+    employee_ids = get_report_employees(conn)
+    report("dataset", employees=len(employee_ids), surveys=surveys, cpus=os.cpu_count())
+    out_dir = tempfile.mkdtemp(prefix="kurs_bench_reports_")
+    try:
+        start = time.perf_counter()
+        for employee_id in employee_ids:
+            get_survey_results(conn, employee_id)
+        seconds = time.perf_counter() - start
+        report("get_survey_results по сотруднику, без записи", seconds=seconds,
+               reports_per_s=len(employee_ids) / seconds)
+        for count in workers:
+            result = generate_reports(conn, params, out_dir, workers=count)
+            busy = max(worker.seconds for worker in result.workers)
+            report(f"generate_reports, процессов: {count}", seconds=result.seconds,
+                   reports_per_s=result.employees / result.seconds, slowest_worker_s=busy)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def bench_write_behind(conn, writes=2000):
+    """Запись из интерфейса: commit на каждую операцию против очереди с журналом и записью пачками"""
+    samples = latencies(lambda i: add_employee(conn, f"Direct {i}"), writes)
+    report_latencies("add_employee, сразу в базу", samples, writes)
+
+    journal_dir = tempfile.mkdtemp(prefix="kurs_bench_journal_")
+    writer = WriteBehind(os.path.join(journal_dir, "journal.jsonl"), scratch_params(conn)).start()
+    try:
+        start = time.perf_counter()
+        samples = latencies(lambda i: writer.submit("add_employee", f"Queued {i}"), writes)
+        report_latencies("WriteBehind.submit (ответ интерфейсу)", samples, writes)
+        writer.flush()
+        stats = writer.stats()
+        report("WriteBehind, очередь записана в базу", seconds=time.perf_counter() - start, writes=stats.written,
+               batches=stats.batches, flush_p50_ms=stats.flush_p50_ms, flush_max_ms=stats.flush_max_ms)
+    finally:
+        writer.stop()
+        shutil.rmtree(journal_dir, ignore_errors=True)
+
+
+# Цель для холодного старта: интерпретатор и импорт приложения до показа окна, мс
+STARTUP_TARGET_MS = 300
+
+
+def bench_startup(conn, runs=5):
+    """Холодный старт: время до показа окна и до готовности подключения с кэшем схемы и без него"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import kurwithGUI"], cwd=here, check=True)
+        samples.append(time.perf_counter() - start)
+    p50_ms = percentile(samples, 50) * 1000
+    report("import (new process)", p50_ms=p50_ms, target_ms=STARTUP_TARGET_MS, ok=p50_ms <= STARTUP_TARGET_MS)
+
+    # Пул подключается к временной схеме замера, как приложение при запуске
+    params = scratch_params(conn)
+    cache_path = os.path.join(tempfile.mkdtemp(prefix="kurs_bench_"), "schema.json")
+    try:
+        for name, use_cache in [("connection ready, schema checked", False),
+                                ("connection ready, schema cached", True)]:
+            def start_pool(i):
+                if not use_cache and os.path.exists(cache_path):
+                    os.remove(cache_path)
+                pool = DeferredPool(lambda: PostgresStoragePool(1, 5, **params),
+                                    setup=lambda storage: init_db_cached(storage, cache_path)).start()
+                pool.putconn(pool.getconn())
+                pool.closeall()
+
+            start_pool(0)
+            report_latencies(name, latencies(start_pool, runs), runs)
+    finally:
+        shutil.rmtree(os.path.dirname(cache_path), ignore_errors=True)
+
+
+BENCHMARKS = {
+    "submit_survey": bench_submit_survey,
+    "survey_results": bench_survey_results,
+    "survey_totals": bench_survey_totals,
+    "data_layer": bench_data_layer,
+    "instrumentation": bench_instrumentation,
+    "analytics": bench_analytics,
+    "prepared": bench_prepared,
+    "startup": bench_startup,
+    "search": bench_search,
+    "periods": bench_periods,
+    "reports": bench_reports,
+    "write_behind": bench_write_behind,
+}
+
+
+def run_metadata(conn):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(commit=commit,
+                started_at=datetime.datetime.now().isoformat(timespec="seconds"),
+                python=platform.python_version(),
+                server_version=conn.server_version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности работы с базой данных")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help="какие замеры запустить (по умолчанию все): " + ", ".join(BENCHMARKS))
+    parser.add_argument("--json", metavar="FILE", help="записать результаты в JSON-файл")
+    parser.add_argument("--scale", action="append", choices=list(SCALES),
+                        help="объёмы данных для data_layer (можно указать несколько)")
+    parser.add_argument("--local-postgres", action="store_true",
+                        help="запустить временный PostgreSQL на время замеров")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("неизвестный замер: " + ", ".join(unknown))
+
+    with contextlib.ExitStack() as stack:
+        params = stack.enter_context(local_postgres()) if args.local_postgres else None
+        conn = connect(params)
+        stack.callback(conn.close)
+        metadata = run_metadata(conn)
+        for name in args.names or BENCHMARKS:
+            print(f"== {name}")
+            kwargs = {"scales": args.scale} if name == "data_layer" and args.scale else {}
+            with scratch_schema(conn):
+                BENCHMARKS[name](conn, **kwargs)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(metadata, results=RESULTS), f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,172 +1,2866 @@
 import tkinter as tk
-from tkinter import messagebox, ttk
+from tkinter import filedialog, messagebox, ttk
 import psycopg2
+from psycopg2.errors import FeatureNotSupported, InvalidSqlStatementName
+from psycopg2.extensions import encodings
+from psycopg2.pool import ThreadedConnectionPool
+import atexit
+import csv
+import datetime
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import select
+import sqlite3
 import sys
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from itertools import groupby, islice
+from operator import itemgetter, methodcaller
+
+
+# Инструментирование: время, число вызовов и строк по функциям, журнал медленных запросов.
+# Когда сбор выключен, декоратор и курсор делают только одну проверку флага.
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    # Границы корзин гистограммы задержек, мс
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+    def __init__(self, enabled=False, slow_threshold_ms=200, slow_log_size=100):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self._functions = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _entry(self, name):
+        entry = self._functions.get(name)
+        if entry is None:
+            entry = self._functions[name] = dict(calls=0, errors=0, queries=0, rows=0, total_ms=0.0, max_ms=0.0,
+                                                 histogram=[0] * len(self.BUCKETS_MS))
+        return entry
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_function(self):
+        stack = self._stack()
+        return stack[-1] if stack else "(вне функций)"
+
+    def record_call(self, name, elapsed_ms, failed):
+        with self._lock:
+            entry = self._entry(name)
+            entry["calls"] += 1
+            entry["errors"] += failed
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["histogram"][bisect_left(self.BUCKETS_MS, elapsed_ms)] += 1
+
+    def record_query(self, cursor, query, params, elapsed_ms):
+        name = self.current_function()
+        rows = max(cursor.rowcount, 0)
+        with self._lock:
+            entry = self._entry(name)
+            entry["queries"] += 1
+            entry["rows"] += rows
+        if elapsed_ms >= self.slow_threshold_ms:
+            text = query.decode() if isinstance(query, bytes) else str(query)
+            plan = explain_query(cursor.connection, text, params)
+            self._slow.append(dict(at=time.strftime("%Y-%m-%d %H:%M:%S"), function=name, ms=elapsed_ms,
+                                   rows=rows, query=text.strip(), params=repr(params), plan=plan))
+            logger.warning("Медленный запрос в %s: %.1f мс, параметры %r\n%s\n%s",
+                           name, elapsed_ms, params, text.strip(), plan or "")
+
+    def snapshot(self):
+        """Статистика в виде словаря, пригодного для JSON"""
+        with self._lock:
+            functions = {}
+            for name, entry in sorted(self._functions.items()):
+                functions[name] = dict(entry, histogram=dict(zip(map(str, self.BUCKETS_MS), entry["histogram"])),
+                                       avg_ms=entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0,
+                                       p95_ms=self._percentile(entry["histogram"], 95))
+            return dict(enabled=self.enabled, slow_threshold_ms=self.slow_threshold_ms,
+                        functions=functions, slow_queries=list(self._slow))
+
+    def _percentile(self, histogram, q):
+        # Верхняя граница корзины, в которую попадает перцентиль
+        total = sum(histogram)
+        if not total:
+            return 0.0
+        seen = 0
+        for bound, count in zip(self.BUCKETS_MS, histogram):
+            seen += count
+            if seen * 100 >= total * q:
+                return bound
+        return self.BUCKETS_MS[-1]
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._functions.clear()
+            self._slow.clear()
+
+
+query_stats = QueryStats(enabled=os.environ.get("KURS_INSTRUMENT") == "1",
+                         slow_threshold_ms=float(os.environ.get("KURS_SLOW_QUERY_MS", 200)))
+
+
+def explain_query(conn, query, params):
+    # План для журнала медленных запросов; не должен ломать основную транзакцию
+    if not query.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "EXECUTE")):
+        return None
+    cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cursor.execute("SAVEPOINT explain_query;")
+        cursor.execute("EXPLAIN " + query, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+        cursor.execute("RELEASE SAVEPOINT explain_query;")
+        return plan
+    except psycopg2.Error:
+        try:
+            cursor.execute("ROLLBACK TO SAVEPOINT explain_query;")
+        except psycopg2.Error:
+            pass
+        return None
+
+
+def instrumented(func):
+    """Учитывает вызовы функции и относит к ней запросы, выполненные внутри"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not query_stats.enabled:
+            return func(*args, **kwargs)
+        stack = query_stats._stack()
+        stack.append(name)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            stack.pop()
+            query_stats.record_call(name, (time.perf_counter() - start) * 1000, failed)
+
+    return wrapper
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, замеряющий каждый запрос; подключается через cursor_factory"""
+
+    def execute(self, query, vars=None):
+        if not query_stats.enabled:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            query_stats.record_query(self, query, vars, (time.perf_counter() - start) * 1000)
+
+    def copy_expert(self, sql, file, size=8192):
+        if not query_stats.enabled:
+            return super().copy_expert(sql, file, size)
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            query_stats.record_query(self, sql, None, (time.perf_counter() - start) * 1000)
 
 
 # Функции для работы с базой данных PostgreSQL
 
+# Триггеры survey_scores, которые поддерживают survey_category_totals (функции - в миграции 3)
+SURVEY_TOTALS_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS survey_totals_insert ON survey_scores;",
+    """
+    CREATE TRIGGER survey_totals_insert AFTER INSERT ON survey_scores
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION survey_totals_on_insert();
+    """,
+    "DROP TRIGGER IF EXISTS survey_totals_delete ON survey_scores;",
+    """
+    CREATE TRIGGER survey_totals_delete AFTER DELETE ON survey_scores
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION survey_totals_on_delete();
+    """,
+    "DROP TRIGGER IF EXISTS survey_totals_update ON survey_scores;",
+    """
+    CREATE TRIGGER survey_totals_update AFTER UPDATE ON survey_scores
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION survey_totals_on_update();
+    """,
+]
+
+
+def notify_triggers(table, column):
+    # Триггеры notify_change (функция - в миграции 4); column - id, которые попадут в уведомление
+    return [
+        statement
+        for op, referencing in [("insert", "REFERENCING NEW TABLE AS new_rows"),
+                                ("update", "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                                ("delete", "REFERENCING OLD TABLE AS old_rows"),
+                                ("truncate", "")]
+        for statement in [
+            f"DROP TRIGGER IF EXISTS {table}_notify_{op} ON {table};",
+            f"CREATE TRIGGER {table}_notify_{op} AFTER {op.upper()} ON {table} {referencing} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION notify_change('{column}');",
+        ]
+    ]
+
+
+# Миграции схемы: номер версии и список DDL-команд, применяются строго по порядку
+SCHEMA_MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS employees (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS competencies (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
+            UNIQUE(name, category_id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS surveys (
+            id SERIAL PRIMARY KEY,
+            employee_id INTEGER NOT NULL REFERENCES employees(id) ON DELETE CASCADE,
+            period TEXT NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS survey_scores (
+            id SERIAL PRIMARY KEY,
+            survey_id INTEGER NOT NULL REFERENCES surveys(id) ON DELETE CASCADE,
+            competency_id INTEGER NOT NULL REFERENCES competencies(id) ON DELETE CASCADE,
+            score REAL NOT NULL
+        );
+        """,
+    ]),
+    (2, [
+        # Перед уникальным индексом убираем повторные оценки одной компетенции в опросе (остаётся первая).
+        # Удалённые строки не теряются: они переносятся в survey_scores_duplicates для ручной проверки
+        """
+        CREATE TABLE IF NOT EXISTS survey_scores_duplicates AS
+        SELECT *, now() AS removed_at FROM survey_scores WITH NO DATA;
+        """,
+        """
+        WITH removed AS (
+            DELETE FROM survey_scores a USING survey_scores b
+            WHERE a.survey_id = b.survey_id AND a.competency_id = b.competency_id AND a.id > b.id
+            RETURNING a.*
+        )
+        INSERT INTO survey_scores_duplicates SELECT *, now() FROM removed;
+        """,
+        # Уникальный индекс покрывает и поиск оценок по survey_id
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS survey_scores_survey_competency_key
+        ON survey_scores (survey_id, competency_id);
+        """,
+        "CREATE INDEX IF NOT EXISTS survey_scores_competency_id_idx ON survey_scores (competency_id);",
+        "CREATE INDEX IF NOT EXISTS surveys_employee_id_idx ON surveys (employee_id);",
+        "CREATE INDEX IF NOT EXISTS surveys_period_idx ON surveys (period);",
+        "CREATE INDEX IF NOT EXISTS competencies_category_id_idx ON competencies (category_id);",
+    ]),
+    (3, [
+        # Суммы и количества оценок по (опрос, категория) для отчётов без пересчёта сырых строк
+        """
+        CREATE TABLE IF NOT EXISTS survey_category_totals (
+            survey_id INTEGER NOT NULL REFERENCES surveys(id) ON DELETE CASCADE,
+            category_id INTEGER NOT NULL REFERENCES categories(id) ON DELETE CASCADE,
+            total DOUBLE PRECISION NOT NULL,
+            cnt INTEGER NOT NULL,
+            PRIMARY KEY (survey_id, category_id)
+        );
+        """,
+        """
+        CREATE OR REPLACE FUNCTION refresh_survey_totals(survey_ids INTEGER[]) RETURNS void
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM survey_category_totals WHERE survey_id = ANY(survey_ids);
+            INSERT INTO survey_category_totals (survey_id, category_id, total, cnt)
+            SELECT ss.survey_id, comp.category_id, SUM(ss.score), COUNT(*)
+            FROM survey_scores ss
+            JOIN competencies comp ON comp.id = ss.competency_id
+            WHERE ss.survey_id = ANY(survey_ids) AND comp.category_id IS NOT NULL
+            GROUP BY ss.survey_id, comp.category_id;
+        END
+        $$;
+        """,
+        # Вставка обновляет суммы инкрементально, одним запросом на весь оператор
+        """
+        CREATE OR REPLACE FUNCTION survey_totals_on_insert() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO survey_category_totals (survey_id, category_id, total, cnt)
+            SELECT n.survey_id, comp.category_id, SUM(n.score), COUNT(*)
+            FROM new_rows n
+            JOIN competencies comp ON comp.id = n.competency_id
+            WHERE comp.category_id IS NOT NULL
+            GROUP BY n.survey_id, comp.category_id
+            ON CONFLICT (survey_id, category_id) DO UPDATE
+            SET total = survey_category_totals.total + EXCLUDED.total,
+                cnt = survey_category_totals.cnt + EXCLUDED.cnt;
+            RETURN NULL;
+        END
+        $$;
+        """,
+        # Удаление и изменение редки (в т.ч. каскад от компетенций), затронутые опросы пересчитываются
+        """
+        CREATE OR REPLACE FUNCTION survey_totals_on_delete() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM refresh_survey_totals(ARRAY(SELECT DISTINCT survey_id FROM old_rows));
+            RETURN NULL;
+        END
+        $$;
+        """,
+        """
+        CREATE OR REPLACE FUNCTION survey_totals_on_update() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM refresh_survey_totals(ARRAY(SELECT survey_id FROM old_rows
+                                                UNION SELECT survey_id FROM new_rows));
+            RETURN NULL;
+        END
+        $$;
+        """,
+    ] + SURVEY_TOTALS_TRIGGERS + [
+        "SELECT refresh_survey_totals(ARRAY(SELECT id FROM surveys));",
+    ]),
+    (4, [
+        # Уведомления об изменениях для открытых окон других клиентов (см. ChangeListener):
+        # один NOTIFY на оператор с id изменённых строк, для оценок - с id опросов.
+        # Большие изменения (импорт, TRUNCATE) передаются без списка id.
+        """
+        CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            ids INTEGER[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                EXECUTE format('SELECT array_agg(DISTINCT %I ORDER BY %I) FROM new_rows', TG_ARGV[0], TG_ARGV[0])
+                INTO ids;
+            ELSIF TG_OP = 'DELETE' THEN
+                EXECUTE format('SELECT array_agg(DISTINCT %I ORDER BY %I) FROM old_rows', TG_ARGV[0], TG_ARGV[0])
+                INTO ids;
+            ELSIF TG_OP = 'UPDATE' THEN
+                EXECUTE format('SELECT array_agg(id ORDER BY id) FROM (SELECT %I AS id FROM old_rows '
+                               'UNION SELECT %I FROM new_rows) changed', TG_ARGV[0], TG_ARGV[0])
+                INTO ids;
+            END IF;
+            IF TG_OP <> 'TRUNCATE' AND ids IS NULL THEN
+                RETURN NULL;
+            END IF;
+            PERFORM pg_notify('kurs_changes', json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP,
+                'ids', CASE WHEN cardinality(ids) <= 500 THEN ids END)::text);
+            RETURN NULL;
+        END
+        $$;
+        """,
+    ] + [
+        statement
+        for table, column in [("employees", "id"), ("categories", "id"), ("competencies", "id"),
+                              ("surveys", "id"), ("survey_scores", "survey_id")]
+        for statement in notify_triggers(table, column)
+    ]),
+    (5, [
+        # Поиск сотрудников по началу имени без учёта регистра (search_employees): text_pattern_ops
+        # сравнивает строки побайтно, поэтому диапазон префикса и порядок выдачи берутся из индекса
+        "CREATE INDEX IF NOT EXISTS employees_name_prefix_idx ON employees (lower(name) text_pattern_ops, id);",
+    ]),
+    (6, [
+        # Период опроса хранится датой начала квартала; текст "2025-Q1" вычисляется из неё.
+        # Раньше период вводился свободным текстом: распознаются и варианты "2025 q1", "2025/1", "Q1 2025"
+        "ALTER TABLE surveys ADD COLUMN period_start DATE;",
+        """
+        UPDATE surveys s
+        SET period_start = make_date(p.year, p.quarter * 3 - 2, 1)
+        FROM (
+            SELECT id, COALESCE(a[1], b[2])::int AS year, COALESCE(a[2], b[1])::int AS quarter
+            FROM surveys,
+                 regexp_match(upper(trim(period)), '^([0-9]{4})[-/. ]*Q?([1-4])$') a,
+                 regexp_match(upper(trim(period)), '^Q([1-4])[-/. ]*([0-9]{4})$') b
+        ) p
+        WHERE p.id = s.id AND p.year IS NOT NULL;
+        """,
+        # Опросы с нераспознанным периодом вместе с оценками переносятся в surveys_invalid_period
+        # и survey_scores_invalid_period: обновление схемы не останавливается, данные можно восстановить
+        """
+        CREATE TABLE IF NOT EXISTS surveys_invalid_period AS
+        SELECT id, employee_id, period, now() AS removed_at FROM surveys WITH NO DATA;
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS survey_scores_invalid_period AS
+        SELECT *, now() AS removed_at FROM survey_scores WITH NO DATA;
+        """,
+        """
+        INSERT INTO survey_scores_invalid_period
+        SELECT ss.*, now() FROM survey_scores ss JOIN surveys s ON s.id = ss.survey_id
+        WHERE s.period_start IS NULL;
+        """,
+        """
+        WITH removed AS (
+            DELETE FROM surveys WHERE period_start IS NULL RETURNING id, employee_id, period
+        )
+        INSERT INTO surveys_invalid_period SELECT *, now() FROM removed;
+        """,
+        """
+        ALTER TABLE surveys
+            ALTER COLUMN period_start SET NOT NULL,
+            ADD CONSTRAINT surveys_period_start_check CHECK (date_trunc('quarter', period_start) = period_start),
+            DROP COLUMN period;
+        """,
+        """
+        ALTER TABLE surveys ADD COLUMN period TEXT GENERATED ALWAYS AS
+            (extract(year FROM period_start)::int::text || '-Q' || extract(quarter FROM period_start)::int::text)
+            STORED;
+        """,
+        # Индекс обслуживает фильтр по кварталу или диапазону и сортировку по периоду;
+        # уникальность (id, period_start) нужна для внешнего ключа из survey_scores
+        "CREATE INDEX surveys_period_start_idx ON surveys (period_start, id);",
+        "ALTER TABLE surveys ADD CONSTRAINT surveys_id_period_start_key UNIQUE (id, period_start);",
+        # survey_scores секционируется по кварталам: старый квартал удаляется или отсоединяется
+        # в архив целиком (drop_period), а запросы с условием на период читают только свои секции.
+        # Период оценки всегда совпадает с периодом опроса (внешний ключ по паре столбцов).
+        "ALTER TABLE survey_scores RENAME TO survey_scores_unpartitioned;",
+        "DROP INDEX survey_scores_survey_competency_key, survey_scores_competency_id_idx;",
+        """
+        CREATE TABLE survey_scores (
+            survey_id INTEGER NOT NULL,
+            competency_id INTEGER NOT NULL REFERENCES competencies(id) ON DELETE CASCADE,
+            score REAL NOT NULL,
+            period_start DATE NOT NULL,
+            CONSTRAINT survey_scores_survey_competency_key PRIMARY KEY (survey_id, competency_id, period_start),
+            FOREIGN KEY (survey_id, period_start) REFERENCES surveys (id, period_start)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        ) PARTITION BY RANGE (period_start);
+        """,
+        "CREATE INDEX survey_scores_competency_id_idx ON survey_scores (competency_id);",
+        # Секция квартала создаётся вместе с первым опросом за него, поэтому секции по умолчанию нет.
+        # Пока транзакция, создавшая секцию, не завершена, survey_scores заблокирована для других.
+        # Два клиента с одним новым кварталом: второй дождётся первого и получит duplicate_table.
+        """
+        CREATE OR REPLACE FUNCTION create_survey_scores_partition(quarter DATE) RETURNS void
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            name TEXT := format('survey_scores_%s_q%s', extract(year FROM quarter), extract(quarter FROM quarter));
+        BEGIN
+            IF to_regclass(name) IS NOT NULL THEN
+                RETURN;
+            END IF;
+            BEGIN
+                EXECUTE format('CREATE TABLE %I PARTITION OF survey_scores FOR VALUES FROM (%L) TO (%L)',
+                               name, quarter, quarter + interval '3 months');
+            EXCEPTION WHEN duplicate_table THEN
+                NULL;
+            END;
+        END
+        $$;
+        """,
+        """
+        CREATE OR REPLACE FUNCTION surveys_create_partitions() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM create_survey_scores_partition(quarter)
+            FROM (SELECT DISTINCT period_start AS quarter FROM new_rows) quarters;
+            RETURN NULL;
+        END
+        $$;
+        """,
+        "DROP TRIGGER IF EXISTS surveys_partitions_insert ON surveys;",
+        """
+        CREATE TRIGGER surveys_partitions_insert AFTER INSERT ON surveys
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION surveys_create_partitions();
+        """,
+        "DROP TRIGGER IF EXISTS surveys_partitions_update ON surveys;",
+        """
+        CREATE TRIGGER surveys_partitions_update AFTER UPDATE ON surveys
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION surveys_create_partitions();
+        """,
+        "SELECT create_survey_scores_partition(period_start) FROM (SELECT DISTINCT period_start FROM surveys) q;",
+        # Итоги по категориям уже посчитаны, поэтому оценки переносятся до создания триггеров
+        """
+        INSERT INTO survey_scores (survey_id, competency_id, score, period_start)
+        SELECT ss.survey_id, ss.competency_id, ss.score, s.period_start
+        FROM survey_scores_unpartitioned ss
+        JOIN surveys s ON s.id = ss.survey_id;
+        """,
+        "DROP TABLE survey_scores_unpartitioned;",
+    ] + SURVEY_TOTALS_TRIGGERS + notify_triggers("survey_scores", "survey_id")),
+    (7, [
+        # Ключи идемпотентности отложенной записи (WriteBehind): ключ сохраняется в одной транзакции
+        # с самой операцией, поэтому повтор пачки после обрыва соединения ничего не дублирует
+        """
+        CREATE TABLE IF NOT EXISTS applied_writes (
+            key UUID PRIMARY KEY,
+            result INTEGER,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ]),
+    (8, [
+        # Перенос компетенции в другую категорию меняет итоги всех опросов с её оценками.
+        # Триггер с таблицами переходов не может ограничиться столбцом (UPDATE OF category_id),
+        # поэтому изменённые строки отбираются сравнением старого и нового category_id
+        """
+        CREATE OR REPLACE FUNCTION survey_totals_on_competency_update() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM refresh_survey_totals(ARRAY(
+                SELECT DISTINCT ss.survey_id
+                FROM survey_scores ss
+                WHERE ss.competency_id = ANY(ARRAY(
+                    SELECT n.id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE n.category_id IS DISTINCT FROM o.category_id))));
+            RETURN NULL;
+        END
+        $$;
+        """,
+        "DROP TRIGGER IF EXISTS survey_totals_competency_update ON competencies;",
+        """
+        CREATE TRIGGER survey_totals_competency_update AFTER UPDATE ON competencies
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION survey_totals_on_competency_update();
+        """,
+        # Итоги, устаревшие из-за переносов до этой миграции
+        "SELECT refresh_survey_totals(ARRAY(SELECT id FROM surveys));",
+    ]),
+    (9, [
+        # Ключ нужен, только пока операцию могут отправить повторно; старые ключи удаляет
+        # prune_applied_writes() по created_at (срок хранения - WRITE_KEY_RETENTION)
+        "ALTER TABLE applied_writes RENAME COLUMN applied_at TO created_at;",
+        "CREATE INDEX IF NOT EXISTS applied_writes_created_at_idx ON applied_writes (created_at);",
+    ]),
+    (10, [
+        # ON UPDATE CASCADE переносит оценки опроса с новым кварталом раньше, чем срабатывает триггер
+        # AFTER UPDATE, поэтому секцию нового квартала нужно создать до изменения строки
+        "DROP TRIGGER IF EXISTS surveys_partitions_update ON surveys;",
+        """
+        CREATE OR REPLACE FUNCTION surveys_create_partition_before_update() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM create_survey_scores_partition(NEW.period_start);
+            RETURN NEW;
+        END
+        $$;
+        """,
+        """
+        CREATE TRIGGER surveys_partitions_update BEFORE UPDATE OF period_start ON surveys
+        FOR EACH ROW WHEN (NEW.period_start IS DISTINCT FROM OLD.period_start)
+        EXECUTE FUNCTION surveys_create_partition_before_update();
+        """,
+    ]),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+# Ключ advisory-блокировки, чтобы несколько клиентов не мигрировали схему одновременно
+SCHEMA_LOCK_KEY = 7411
+
+
+def get_schema_version(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cursor.fetchone()[0]
+
+
+@instrumented
+def migrate(conn):
+    # Если схема актуальна, DDL не выполняется совсем
+    if get_schema_version(conn) == SCHEMA_VERSION:
+        conn.commit()
+        return []
+    cursor = conn.cursor()
+    applied = []
+    try:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s);", (SCHEMA_LOCK_KEY,))
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+        """)
+        current = get_schema_version(conn)
+        for version, statements in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_version (version) VALUES (%s);", (version,))
+            applied.append(version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return applied
+
+
 def init_db(conn):
+    if migrate(conn):
+        # Таблицы изменились: запросы, подготовленные на этом соединении, готовим заново
+        prepared_statements.reset(conn)
+
+
+# Подготовленные запросы для частых вставок и выборок: PREPARE выполняется один раз на соединение,
+# дальше на сервер уходят только EXECUTE и параметры. Имя -> (типы параметров, текст с $1, $2, ...).
+PREPARED_STATEMENTS = {
+    "add_employee": ("text", "INSERT INTO employees (name) VALUES ($1) RETURNING id"),
+    "add_employees": ("text[]", "INSERT INTO employees (name) SELECT unnest($1::text[]) RETURNING id"),
+    "add_survey": ("integer, date", "INSERT INTO surveys (employee_id, period_start) VALUES ($1, $2) RETURNING id"),
+    # Период оценки (ключ секции survey_scores) берётся из опроса; для несуществующего опроса он NULL,
+    # и вставка завершается ошибкой, как раньше по внешнему ключу
+    "add_survey_score": ("integer, integer, real",
+                         "INSERT INTO survey_scores (survey_id, competency_id, score, period_start) "
+                         "VALUES ($1, $2, $3, (SELECT period_start FROM surveys WHERE id = $1))"),
+    "add_survey_scores": ("integer[], integer[], real[]",
+                          "INSERT INTO survey_scores (survey_id, competency_id, score, period_start) "
+                          "SELECT u.survey_id, u.competency_id, u.score, s.period_start "
+                          "FROM unnest($1::integer[], $2::integer[], $3::real[]) "
+                          "AS u (survey_id, competency_id, score) "
+                          "LEFT JOIN surveys s ON s.id = u.survey_id"),
+    "search_employees": ("text, text, integer",
+                         "SELECT id, name FROM employees WHERE lower(name) ~>=~ $1 AND lower(name) ~<~ $2 "
+                         "ORDER BY lower(name) USING ~<~, id LIMIT $3"),
+    "first_employees": ("integer", "SELECT id, name FROM employees ORDER BY lower(name) USING ~<~, id LIMIT $1"),
+    "competencies_by_category": ("integer", "SELECT id, name FROM competencies WHERE category_id = $1"),
+    "competencies_by_categories": ("integer[]", "SELECT category_id, id, name FROM competencies "
+                                                "WHERE category_id = ANY($1::integer[]) ORDER BY category_id, id"),
+}
+
+
+class PreparedStatements:
+    """Учёт подготовленных запросов по соединениям. Новое соединение (в том числе после переподключения)
+    - новый объект, и запросы на нём готовятся при первом использовании. Если сервер запрос забыл
+    (DEALLOCATE) или тот устарел (смена типа результата после миграции), все запросы соединения
+    готовятся заново, а вызов повторяется - если транзакция ещё не начата; иначе ошибка передаётся
+    дальше, и заново запросы подготовит следующий вызов.
+    enabled=False (или KURS_PREPARED=0, например за pgbouncer) - обычные запросы без PREPARE."""
+
+    PREFIX = "kurs_"
+    RETRY_ERRORS = (InvalidSqlStatementName, FeatureNotSupported)
+
+    def __init__(self, statements, enabled=True):
+        self.statements = statements
+        self.enabled = enabled
+        self._prepared = weakref.WeakKeyDictionary()
+        self._stale = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def execute(self, conn, name, params):
+        """Выполняет запрос name с параметрами params, возвращает курсор"""
+        types, sql = self.statements[name]
+        cursor = conn.cursor()
+        if not self.enabled:
+            # Параметр может встречаться в запросе несколько раз: $N -> %(pN)s
+            cursor.execute(re.sub(r"\$(\d+)", r"%(p\1)s", sql), {f"p{i}": value for i, value in enumerate(params, 1)})
+            return cursor
+        idle = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            self._execute(cursor, conn, name, types, sql, params)
+        except self.RETRY_ERRORS:
+            self.reset(conn)
+            if not idle:
+                raise
+            conn.rollback()
+            self._execute(cursor, conn, name, types, sql, params)
+        return cursor
+
+    def _execute(self, cursor, conn, name, types, sql, params):
+        with self._lock:
+            stale = conn in self._stale
+            prepared = self._prepared.get(conn)
+        if prepared is None:
+            # Первый вызов на этом объекте соединения. Сеанс мог уже использоваться через другую обёртку
+            # того же соединения psycopg2, поэтому подготовленное берётся у сервера: иначе PREPARE
+            # завершился бы ошибкой DuplicatePreparedStatement
+            cursor.execute("SELECT name FROM pg_prepared_statements WHERE starts_with(name, %s);", (self.PREFIX,))
+            names = {row[0][len(self.PREFIX):] for row in cursor.fetchall()}
+            with self._lock:
+                prepared = self._prepared.setdefault(conn, names)
+        if stale:
+            cursor.execute("DEALLOCATE ALL;")
+            with self._lock:
+                self._stale.discard(conn)
+                prepared.clear()
+        if name not in prepared:
+            cursor.execute(f"PREPARE {self.PREFIX}{name} ({types}) AS {sql};")
+            with self._lock:
+                prepared.add(name)
+        cursor.execute(f"EXECUTE {self.PREFIX}{name} ({', '.join(['%s'] * len(params))});", params)
+
+    def reset(self, conn):
+        # Запросы соединения будут удалены на сервере и подготовлены заново при следующем вызове
+        with self._lock:
+            self._stale.add(conn)
+
+
+prepared_statements = PreparedStatements(PREPARED_STATEMENTS, enabled=os.environ.get("KURS_PREPARED", "1") != "0")
+
+
+@instrumented
+def add_employee(conn, name):
+    cursor = prepared_statements.execute(conn, "add_employee", (name,))
+    emp_id = cursor.fetchone()[0]
+    conn.commit()
+    return emp_id
+
+
+@instrumented
+def add_employees(conn, names):
+    # Пакетный вариант: один запрос на весь список, id в порядке имён
+    cursor = prepared_statements.execute(conn, "add_employees", (list(names),))
+    ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return ids
+
+
+@instrumented
+def get_employees(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name FROM employees;")
+    return cursor.fetchall()
+
+
+def prefix_range(prefix):
+    """Границы [low, high) строк, начинающихся с prefix, в порядке кодов символов (без учёта регистра).
+    high - None, если верхней границы нет."""
+    low = prefix.lower()
+    high = low
+    while high and ord(high[-1]) == sys.maxunicode:
+        high = high[:-1]
+    return low, (high[:-1] + chr(ord(high[-1]) + 1)) if high else None
+
+
+@instrumented
+def search_employees(conn, prefix, limit=20):
+    # Сотрудники, чьё имя начинается с prefix (без учёта регистра), по имени и id; индекс employees_name_prefix_idx
+    low, high = prefix_range(prefix.strip())
+    if not low:
+        return prepared_statements.execute(conn, "first_employees", (limit,)).fetchall()
+    if high is None:
+        # Префикс только из символов U+10FFFF - в именах такого не бывает
+        return []
+    return prepared_statements.execute(conn, "search_employees", (low, high, limit)).fetchall()
+
+
+def resolve_employee(conn, name):
+    """id сотрудника по имени или его началу; ValueError, если совпадений нет или их несколько"""
+    matches = search_employees(conn, name, 10)
+    exact = [row for row in matches if row[1].lower() == name.strip().lower()]
+    if len(exact) == 1 or len(matches) == 1:
+        return (exact or matches)[0][0]
+    if not matches:
+        raise ValueError(f"Сотрудник не найден: {name}")
+    raise ValueError(f"Под «{name}» подходят несколько сотрудников: "
+                     + ", ".join(f"{emp_name} (ID: {emp_id})" for emp_id, emp_name in matches))
+
+
+class PrefixCache:
+    """Результаты поиска по недавним префиксам (LRU). Если для более короткого префикса база вернула
+    меньше limit строк, это все совпадения: более длинный префикс отбирается из них без запроса."""
+
+    def __init__(self, size=64):
+        self.size = size
+        self._entries = OrderedDict()  # {(префикс в нижнем регистре, limit): [(id, name), ...]}
+
+    def get(self, prefix, limit):
+        key = prefix.strip().lower()
+        for length in range(len(key), -1, -1):
+            rows = self._entries.get((key[:length], limit))
+            if rows is None:
+                continue
+            self._entries.move_to_end((key[:length], limit))
+            if length == len(key):
+                return rows
+            if len(rows) < limit:
+                return [row for row in rows if row[1].lower().startswith(key)]
+        return None
+
+    def put(self, prefix, limit, rows):
+        self._entries[(prefix.strip().lower(), limit)] = rows
+        self._entries.move_to_end((prefix.strip().lower(), limit))
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+@instrumented
+def add_category(conn, name):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO categories (name) VALUES (%s) RETURNING id;", (name,))
+        cat_id = cursor.fetchone()[0]
+        conn.commit()
+        catalog_cache.category_added(conn, cat_id, name)
+        return cat_id
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return None
+
+
+@instrumented
+def get_categories(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name FROM categories;")
+    return cursor.fetchall()
+
+
+@instrumented
+def add_competency(conn, name, category_id):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO competencies (name, category_id) VALUES (%s, %s) RETURNING id;",
+                       (name, category_id))
+        comp_id = cursor.fetchone()[0]
+        conn.commit()
+        catalog_cache.competency_added(conn, comp_id, name, category_id)
+        return comp_id
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        return None
+
+
+@instrumented
+def get_competencies_by_category(conn, category_id):
+    return prepared_statements.execute(conn, "competencies_by_category", (category_id,)).fetchall()
+
+
+@instrumented
+def get_competencies_by_categories(conn, category_ids):
+    # Пакетный вариант: {category_id: [(id, name), ...]} для всех запрошенных категорий одним запросом
+    competencies = {category_id: [] for category_id in category_ids}
+    cursor = prepared_statements.execute(conn, "competencies_by_categories", (list(competencies),))
+    for category_id, comp_id, name in cursor:
+        competencies[category_id].append((comp_id, name))
+    return competencies
+
+
+CATALOG_SQL = """
+SELECT cat.id, cat.name, comp.id, comp.name
+FROM categories cat
+LEFT JOIN competencies comp ON comp.category_id = cat.id
+ORDER BY cat.id, comp.id;
+"""
+
+
+def _catalog_from_rows(rows):
+    # Дерево категория -> компетенции: [((id, name), [(id, name), ...]), ...]
+    catalog = []
+    for cat_id, cat_name, comp_id, comp_name in rows:
+        if not catalog or catalog[-1][0][0] != cat_id:
+            catalog.append(((cat_id, cat_name), []))
+        if comp_id is not None:
+            catalog[-1][1].append((comp_id, comp_name))
+    return catalog
+
+
+@instrumented
+def load_catalog(conn):
+    # Весь каталог одним запросом
+    cursor = conn.cursor()
+    cursor.execute(CATALOG_SQL)
+    return _catalog_from_rows(cursor.fetchall())
+
+
+class CatalogCache:
+    """Кэш каталога в памяти процесса, отдельно для каждой базы (по DSN соединения).
+    add_category и add_competency дописывают в него новые записи; ttl (в секундах)
+    ограничивает время жизни, чтобы видеть изменения других клиентов."""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._entries = {}  # {dsn: (время загрузки, каталог)}
+        self._lock = threading.Lock()
+
+    def get(self, conn):
+        with self._lock:
+            entry = self._entries.get(conn.dsn)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                return [(cat, list(comps)) for cat, comps in entry[1]]
+        catalog = load_catalog(conn)
+        with self._lock:
+            self._entries[conn.dsn] = (time.monotonic(), catalog)
+        return [(cat, list(comps)) for cat, comps in catalog]
+
+    def invalidate(self, conn=None):
+        with self._lock:
+            if conn is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(conn.dsn, None)
+
+    def category_added(self, conn, cat_id, name):
+        with self._lock:
+            entry = self._entries.get(conn.dsn)
+            if entry is not None:
+                entry[1].append(((cat_id, name), []))
+
+    def competency_added(self, conn, comp_id, name, category_id):
+        with self._lock:
+            entry = self._entries.get(conn.dsn)
+            if entry is None:
+                return
+            for cat, comps in entry[1]:
+                if cat[0] == category_id:
+                    comps.append((comp_id, name))
+                    return
+            # Категория добавлена другим клиентом и ещё не известна кэшу
+            del self._entries[conn.dsn]
+
+    def apply_changes(self, conn, changes):
+        """Применяет уведомления об изменении категорий и компетенций (см. ChangeListener):
+        из базы перечитываются только изменённые строки. Изменения без списка id сбрасывают кэш."""
+        with self._lock:
+            if conn.dsn not in self._entries:
+                return
+        if any(change.ids is None for change in changes):
+            self.invalidate(conn)
+            return
+        ids = {"categories": set(), "competencies": set()}
+        for change in changes:
+            if change.table in ids:
+                ids[change.table].update(change.ids)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM categories WHERE id = ANY(%s);", (list(ids["categories"]),))
+        categories = cursor.fetchall()
+        cursor.execute("SELECT id, name, category_id FROM competencies WHERE id = ANY(%s);",
+                       (list(ids["competencies"]),))
+        competencies = cursor.fetchall()
+
+        with self._lock:
+            entry = self._entries.get(conn.dsn)
+            if entry is None:
+                return
+            # Изменённые строки удаляются и добавляются заново в том виде, в каком они сейчас в базе
+            names = {cat_id: name for (cat_id, name), _ in entry[1] if cat_id not in ids["categories"]}
+            names.update(categories)
+            comps = {cat_id: [comp for comp in cat_comps if comp[0] not in ids["competencies"]]
+                     for (cat_id, _), cat_comps in entry[1]}
+            for comp_id, name, category_id in competencies:
+                if category_id is None:
+                    continue
+                if category_id not in names:
+                    del self._entries[conn.dsn]
+                    return
+                comps.setdefault(category_id, []).append((comp_id, name))
+            self._entries[conn.dsn] = (entry[0], [((cat_id, names[cat_id]), sorted(comps.get(cat_id, [])))
+                                                  for cat_id in sorted(names)])
+
+
+# Время жизни каталога в кэше, секунд: изменения, о которых не пришло уведомление (нет ChangeListener,
+# SQLite, потерянное соединение), видны не позже чем через столько
+CATALOG_TTL = float(os.environ.get("KURS_CATALOG_TTL", 300))
+catalog_cache = CatalogCache(ttl=CATALOG_TTL)
+
+
+def get_catalog(conn):
+    return catalog_cache.get(conn)
+
+
+# Периоды опросов: квартал "2025-Q1" хранится в PostgreSQL датой его начала (surveys.period_start),
+# текстовый столбец period вычисляется из неё. Фильтр по периоду - один квартал или PeriodRange.
+PERIOD_RE = re.compile(r"(\d{4})-Q([1-4])", re.IGNORECASE)
+PeriodRange = namedtuple("PeriodRange", "start end")
+
+
+def period_start(period):
+    """Дата начала квартала: "2025-Q1" -> date(2025, 1, 1); ValueError, если формат другой"""
+    match = PERIOD_RE.fullmatch(period.strip()) if isinstance(period, str) else None
+    if not match:
+        raise ValueError(f"Период должен быть в формате ГГГГ-QN, например 2025-Q1: {period}")
+    return datetime.date(int(match[1]), int(match[2]) * 3 - 2, 1)
+
+
+def format_period(start):
+    return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+
+
+def parse_period_filter(text):
+    """Фильтр из строки: "2025-Q1" - один квартал, "2023-Q2:2025-Q1" - PeriodRange включительно,
+    границу диапазона можно опустить ("2024-Q1:")"""
+    if ":" not in text:
+        return format_period(period_start(text))
+    start, end = (part.strip() for part in text.split(":", 1))
+    return PeriodRange(format_period(period_start(start)) if start else None,
+                       format_period(period_start(end)) if end else None)
+
+
+def _period_conditions(period, columns=("s.period_start",)):
+    # Условия на каждый из столбцов columns; даты передаются строками ISO, их понимает и SQLite
+    if isinstance(period, str):
+        bounds = [("=", period)]
+    else:
+        bounds = [(op, value) for op, value in zip((">=", "<="), period) if value is not None]
+    conditions = []
+    params = []
+    for column in columns:
+        for op, value in bounds:
+            conditions.append(f"{column} {op} %s")
+            params.append(period_start(value).isoformat())
+    return conditions, params
+
+
+@instrumented
+def add_survey(conn, employee_id, period):
+    cursor = prepared_statements.execute(conn, "add_survey", (employee_id, period_start(period)))
+    survey_id = cursor.fetchone()[0]
+    conn.commit()
+    return survey_id
+
+
+@instrumented
+def add_survey_score(conn, survey_id, competency_id, score):
+    prepared_statements.execute(conn, "add_survey_score", (survey_id, competency_id, score))
+    conn.commit()
+
+
+@instrumented
+def add_survey_scores(conn, rows):
+    # Пакетный вариант: rows - [(survey_id, competency_id, score), ...], одна транзакция и один запрос
+    columns = [list(column) for column in zip(*rows)] or [[], [], []]
+    try:
+        cursor = prepared_statements.execute(conn, "add_survey_scores", columns)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return cursor.rowcount
+
+
+def validate_scores(scores):
+    # Проверяем все оценки до записи, чтобы не оставлять в базе половину опроса
+    items = scores.items() if isinstance(scores, dict) else scores
+    validated = []
+    for competency_id, score in items:
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            raise ValueError("Введите числовое значение для оценки.")
+        if not 1 <= score <= 5:
+            raise ValueError("Оценка должна быть от 1 до 5.")
+        validated.append((competency_id, score))
+    return validated
+
+
+@instrumented
+def submit_survey(conn, employee_id, period, scores):
+    # Опрос и все его оценки записываются одной транзакцией: два подготовленных запроса,
+    # оценки передаются массивами
+    rows = validate_scores(scores)
+    start = period_start(period)
+    try:
+        survey_id = prepared_statements.execute(conn, "add_survey", (employee_id, start)).fetchone()[0]
+        if rows:
+            prepared_statements.execute(conn, "add_survey_scores",
+                                        ([survey_id] * len(rows), [comp_id for comp_id, _ in rows],
+                                         [score for _, score in rows]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return survey_id
+
+
+# Записи результатов опросов
+ScoreRow = namedtuple("ScoreRow", "survey_id employee_name period category competency score")
+CategoryAverage = namedtuple("CategoryAverage", "survey_id employee_name period category average overall")
+
+
+def _survey_filters(employee_id=None, period=None, category_id=None, survey_id=None,
+                    period_columns=("s.period_start",), employee_ids=None):
+    # period_columns: для запросов к survey_scores условие на период повторяется для ss.period_start,
+    # чтобы читались только секции нужных кварталов; employee_ids - опросы нескольких сотрудников
+    conditions = []
+    params = []
+    if survey_id is not None:
+        conditions.append("s.id = %s")
+        params.append(survey_id)
+    if employee_id is not None:
+        conditions.append("s.employee_id = %s")
+        params.append(employee_id)
+    if employee_ids is not None:
+        conditions.append("s.employee_id = ANY(%s)")
+        params.append(list(employee_ids))
+    if period is not None:
+        period_conditions, period_params = _period_conditions(period, period_columns)
+        conditions.extend(period_conditions)
+        params.extend(period_params)
+    if category_id is not None:
+        conditions.append("cat.id = %s")
+        params.append(category_id)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+# Оценки опроса ищутся только в секции его квартала (соединение по period_start), а фильтр
+# по диапазону периодов повторяется для ss.period_start, чтобы остальные секции не читались
+SCORES_PERIOD_COLUMNS = ("s.period_start", "ss.period_start")
+
+SURVEY_SCORES_SQL = """
+SELECT s.id AS survey_id, e.name AS employee_name, s.period, cat.name AS category,
+       comp.name AS competency, ss.score
+FROM surveys s
+JOIN employees e ON s.employee_id = e.id
+JOIN survey_scores ss ON ss.survey_id = s.id AND ss.period_start = s.period_start
+JOIN competencies comp ON ss.competency_id = comp.id
+JOIN categories cat ON comp.category_id = cat.id
+{where}
+ORDER BY s.id, cat.name, comp.name
+"""
+
+# Средние по категориям и общая оценка берутся из survey_category_totals.
+# При фильтре по категории общая оценка считается только по выбранным категориям.
+SURVEY_AVERAGES_SQL = """
+SELECT s.id AS survey_id, e.name AS employee_name, s.period, cat.name AS category,
+       t.total / t.cnt AS average,
+       SUM(t.total) OVER w / SUM(t.cnt) OVER w AS overall
+FROM surveys s
+JOIN employees e ON s.employee_id = e.id
+JOIN survey_category_totals t ON t.survey_id = s.id
+JOIN categories cat ON t.category_id = cat.id
+{where}
+WINDOW w AS (PARTITION BY s.id)
+ORDER BY s.id, cat.name
+"""
+
+
+# Оценки для отчётов: строка на опрос с массивами id компетенций и оценок. Имена категорий и компетенций
+# не повторяются в каждой строке оценки, а берутся из COMPETENCY_ORDER_SQL (см. _iter_score_tuples)
+SURVEY_SCORE_ARRAYS_SQL = """
+SELECT s.id, e.name, s.period, array_agg(ss.competency_id), array_agg(ss.score)
+FROM surveys s
+JOIN employees e ON s.employee_id = e.id
+JOIN survey_scores ss ON ss.survey_id = s.id AND ss.period_start = s.period_start
+JOIN competencies comp ON ss.competency_id = comp.id
+JOIN categories cat ON comp.category_id = cat.id
+{where}
+GROUP BY s.id, e.name, s.period
+ORDER BY s.id
+"""
+
+# Компетенции в порядке строк отчёта: по категории, затем по имени (сопоставление базы)
+COMPETENCY_ORDER_SQL = """
+SELECT comp.id, cat.name, comp.name
+FROM competencies comp
+JOIN categories cat ON comp.category_id = cat.id
+ORDER BY cat.name, comp.name
+"""
+
+
+def _iter_query(conn, sql, params, itersize=2000):
+    # Серверный курсор: строки приходят пачками и не держатся в памяти целиком.
+    # Результат всегда читается до конца, поэтому план выбирается по полной выборке, а не по первым
+    # строкам (по умолчанию cursor_tuple_fraction = 0.1 - вложенные циклы вместо hash join)
+    conn.cursor().execute("SET LOCAL cursor_tuple_fraction = 1.0;")
+    with conn.cursor(name="survey_stream") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(sql, params)
+        yield from cursor
+
+
+def _competency_order(conn):
+    # {id компетенции: (позиция в отчёте, категория, компетенция)}
+    cursor = conn.cursor()
+    cursor.execute(COMPETENCY_ORDER_SQL)
+    return {comp_id: (position, category, competency)
+            for position, (comp_id, category, competency) in enumerate(cursor.fetchall())}
+
+
+def _iter_score_tuples(conn, where, params, itersize=2000):
+    # Строки ScoreRow кортежами, в порядке SURVEY_SCORES_SQL: по опросу, затем по категории и компетенции.
+    # Опрос приходит одной строкой, оценки внутри него упорядочиваются по справочнику компетенций
+    order = _competency_order(conn)
+    for survey_id, employee_name, period, comp_ids, scores in _iter_query(
+            conn, SURVEY_SCORE_ARRAYS_SQL.format(where=where), params, itersize):
+        if not all(comp_id in order for comp_id in comp_ids):
+            # Компетенцию добавили после чтения справочника; удалённую после начала выборки - пропускаем
+            order = _competency_order(conn)
+        for (_, category, competency), score in sorted((order[comp_id], score)
+                                                       for comp_id, score in zip(comp_ids, scores)
+                                                       if comp_id in order):
+            yield survey_id, employee_name, period, category, competency, score
+
+
+def iter_survey_scores(conn, employee_id=None, period=None, category_id=None, survey_id=None, itersize=2000):
+    where, params = _survey_filters(employee_id, period, category_id, survey_id, SCORES_PERIOD_COLUMNS)
+    return map(ScoreRow._make, _iter_score_tuples(conn, where, params, itersize))
+
+
+def get_survey_scores(conn, employee_id=None, period=None, category_id=None, survey_id=None):
+    return list(iter_survey_scores(conn, employee_id, period, category_id, survey_id))
+
+
+@instrumented
+def get_survey_averages(conn, employee_id=None, period=None, category_id=None, survey_id=None):
+    where, params = _survey_filters(employee_id, period, category_id, survey_id)
+    cursor = conn.cursor()
+    cursor.execute(SURVEY_AVERAGES_SQL.format(where=where), params)
+    return [CategoryAverage(*row) for row in cursor.fetchall()]
+
+
+@instrumented
+def get_survey_overall(conn, survey_ids):
+    # Общая оценка нескольких опросов: {id опроса: средняя оценка}
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT survey_id, SUM(total) / SUM(cnt)
+    FROM survey_category_totals
+    WHERE survey_id = ANY(%s)
+    GROUP BY survey_id;
+    """, (list(survey_ids),))
+    return dict(cursor.fetchall())
+
+
+# Проверка согласованности survey_category_totals с сырыми оценками
+TotalsMismatch = namedtuple("TotalsMismatch",
+                            "survey_id category_id stored_total stored_count actual_total actual_count")
+
+
+@instrumented
+def check_survey_totals(conn, repair=False):
+    cursor = conn.cursor()
+    cursor.execute("""
+    WITH actual AS (
+        SELECT ss.survey_id, comp.category_id, SUM(ss.score)::float8 AS total, COUNT(*) AS cnt
+        FROM survey_scores ss
+        JOIN competencies comp ON comp.id = ss.competency_id
+        WHERE comp.category_id IS NOT NULL
+        GROUP BY ss.survey_id, comp.category_id
+    )
+    SELECT COALESCE(t.survey_id, a.survey_id), COALESCE(t.category_id, a.category_id),
+           t.total, t.cnt, a.total, a.cnt
+    FROM survey_category_totals t
+    FULL JOIN actual a ON a.survey_id = t.survey_id AND a.category_id = t.category_id
+    WHERE t.cnt IS DISTINCT FROM a.cnt OR abs(t.total - a.total) > 1e-6
+       OR (t.total IS NULL) <> (a.total IS NULL)
+    ORDER BY 1, 2;
+    """)
+    mismatches = [TotalsMismatch(*row) for row in cursor.fetchall()]
+    if repair and mismatches:
+        cursor.execute("SELECT refresh_survey_totals(%s);",
+                       (sorted({m.survey_id for m in mismatches}),))
+    conn.commit()
+    return mismatches
+
+
+def render_survey_results(scores, averages):
+    # Оба набора отсортированы по id опроса, поэтому собираем текст за один проход
+    if not averages:
+        return "Нет данных об опросах."
+    by_survey = {}
+    for avg in averages:
+        by_survey.setdefault(avg.survey_id, []).append(avg)
+    parts = []
+    # Строки разбираются как кортежи: на сотнях тысяч оценок доступ по именам полей заметно медленнее
+    for survey_id, rows in groupby(scores, key=itemgetter(0)):
+        _, employee_name, period, category, competency, score = next(rows)
+        parts.append(f"\nОпрос ID: {survey_id} | Сотрудник: {employee_name} | Период: {period}\n")
+        parts.append(f"  {category} - {competency}: {score}\n")
+        parts.extend([f"  {category} - {competency}: {score}\n" for _, _, _, category, competency, score in rows])
+        parts.append("Средние оценки по категориям:\n")
+        survey_averages = by_survey.get(survey_id, [])
+        for avg in survey_averages:
+            parts.append(f"  {avg.category}: {avg.average:.2f}\n")
+        overall = survey_averages[0].overall if survey_averages else 0
+        parts.append(f"Общая оценка: {overall:.2f}\n")
+    return "".join(parts)
+
+
+@instrumented
+def get_survey_results(conn, employee_id=None, period=None, category_id=None, survey_id=None):
+    averages = get_survey_averages(conn, employee_id, period, category_id, survey_id)
+    where, params = _survey_filters(employee_id, period, category_id, survey_id, SCORES_PERIOD_COLUMNS)
+    return render_survey_results(_iter_score_tuples(conn, where, params), averages)
+
+
+# Постраничный просмотр опросов: keyset-пагинация по (ключ сортировки, id опроса)
+SurveyRow = namedtuple("SurveyRow", "survey_id employee_name period overall")
+# Имена сравниваются побайтно (COLLATE "C"), как строки в Python: окно результатов вставляет
+# изменённые строки в открытую страницу по survey_page_key, и порядок должен совпадать с базой
+SURVEY_SORT_KEYS = {
+    "id": ("s.id", "survey_id"),
+    "employee": ('e.name COLLATE "C"', "employee_name"),
+    "period": ("s.period_start", "period"),
+}
+
+
+def survey_page_key(row, sort="id"):
+    value = getattr(row, SURVEY_SORT_KEYS[sort][1])
+    # Сортировка по периоду идёт по дате начала квартала (индекс surveys_period_start_idx)
+    return (period_start(value).isoformat() if sort == "period" else value), row.survey_id
+
+
+@instrumented
+def get_survey_page(conn, sort="id", after=None, limit=50, employee_name=None, period=None, survey_ids=None):
+    # after - ключ последней строки предыдущей страницы (см. survey_page_key);
+    # survey_ids - только эти опросы (перечитать изменившиеся строки открытой страницы)
+    column = SURVEY_SORT_KEYS[sort][0]
+    conditions = []
+    params = []
+    if survey_ids is not None:
+        conditions.append("s.id = ANY(%s)")
+        params.append(list(survey_ids))
+    if employee_name:
+        conditions.append("e.name ILIKE %s")
+        params.append(f"%{employee_name}%")
+    if period:
+        period_conditions, period_params = _period_conditions(period)
+        conditions.extend(period_conditions)
+        params.extend(period_params)
+    if after is not None:
+        conditions.append(f"({column}, s.id) > (%s, %s)")
+        params.extend(after)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT s.id, e.name, s.period,
+           (SELECT SUM(t.total) / SUM(t.cnt) FROM survey_category_totals t WHERE t.survey_id = s.id) AS overall
+    FROM surveys s
+    JOIN employees e ON s.employee_id = e.id
+    {where}
+    ORDER BY {column}, s.id
+    LIMIT %s;
+    """, params + [limit])
+    return [SurveyRow(*row) for row in cursor.fetchall()]
+
+
+# Запросы по диапазону кварталов: условие на surveys.period_start идёт по индексу
+PeriodSummary = namedtuple("PeriodSummary", "period surveys employees average")
+
+
+@instrumented
+def get_surveys_between(conn, start=None, end=None, employee_id=None):
+    # Опросы с квартала start по end включительно (None - без границы), по периоду и id
+    where, params = _survey_filters(employee_id, PeriodRange(start, end))
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT s.id, e.name, s.period,
+           (SELECT SUM(t.total) / SUM(t.cnt) FROM survey_category_totals t WHERE t.survey_id = s.id) AS overall
+    FROM surveys s
+    JOIN employees e ON s.employee_id = e.id
+    {where}
+    ORDER BY s.period_start, s.id;
+    """, params)
+    return [SurveyRow(*row) for row in cursor.fetchall()]
+
+
+@instrumented
+def get_period_summary(conn, start=None, end=None, category_id=None):
+    # По кварталу: число опросов, число сотрудников и средняя оценка (по категории, если указана)
+    where, params = _survey_filters(None, PeriodRange(start, end))
+    join = "LEFT JOIN survey_category_totals t ON t.survey_id = s.id"
+    if category_id is not None:
+        join += " AND t.category_id = %s"
+        params = [category_id] + params
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT s.period, COUNT(DISTINCT s.id), COUNT(DISTINCT s.employee_id), SUM(t.total) / SUM(t.cnt)
+    FROM surveys s
+    {join}
+    {where}
+    GROUP BY s.period_start, s.period
+    ORDER BY s.period_start;
+    """, params)
+    return [PeriodSummary(*row) for row in cursor.fetchall()]
+
+
+# Секции survey_scores по кварталам (только PostgreSQL)
+PeriodPartition = namedtuple("PeriodPartition", "period table estimated_rows size_bytes")
+ARCHIVE_SCHEMA = "archive"
+
+
+def partition_name(start):
+    return f"survey_scores_{start.year}_q{(start.month - 1) // 3 + 1}"
+
+
+@instrumented
+def get_period_partitions(conn):
+    # Число строк - оценка планировщика (обновляется ANALYZE/autovacuum), секции не читаются
     cursor = conn.cursor()
     cursor.execute("""
+    SELECT c.relname, substring(pg_get_expr(c.relpartbound, c.oid) FROM '[0-9]{4}-[0-9]{2}-[0-9]{2}')::date,
+           GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'survey_scores'::regclass
+    ORDER BY 2;
+    """)
+    partitions = [PeriodPartition(format_period(start), table, rows, size)
+                  for table, start, rows, size in cursor.fetchall()]
+    conn.commit()
+    return partitions
+
+
+@instrumented
+def drop_period(conn, period, archive=False):
+    """Удаляет опросы квартала, возвращает их число. Оценки квартала удаляются целиком вместе с его секцией,
+    без построчного DELETE. archive=True - секция отсоединяется и вместе с копией опросов квартала
+    переносится в схему archive (archive.survey_scores_2023_q1 и archive.surveys_2023_q1).
+    Если квартал уже архивировали, строки дописываются в существующие архивные таблицы."""
+    start = period_start(period)
+    table = partition_name(start)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+        if cursor.fetchone()[0]:
+            if archive:
+                archived = f"{ARCHIVE_SCHEMA}.{table}"
+                archived_surveys = f'{ARCHIVE_SCHEMA}.{table.replace("survey_scores", "surveys")}'
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA};")
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (archived,))
+                rearchive = cursor.fetchone()[0]
+                surveys_sql = """
+                SELECT s.id, s.employee_id, e.name AS employee_name, s.period
+                FROM surveys s JOIN employees e ON e.id = s.employee_id
+                WHERE s.period_start = %s
+                """
+                # Квартал могли уже архивировать, а потом снова внести в него опросы - тогда дописываем
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {archived_surveys} AS {surveys_sql} WITH NO DATA;",
+                               (start,))
+                cursor.execute(f"INSERT INTO {archived_surveys} {surveys_sql};", (start,))
+                cursor.execute(f"ALTER TABLE survey_scores DETACH PARTITION {table};")
+                # Архив не должен зависеть от рабочих таблиц, иначе удаление опросов ниже его очистит
+                cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f';",
+                               (table,))
+                for (constraint,) in cursor.fetchall():
+                    cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}";')
+                if rearchive:
+                    cursor.execute(f"INSERT INTO {archived} (survey_id, competency_id, score, period_start) "
+                                   f"SELECT survey_id, competency_id, score, period_start FROM {table};")
+                    cursor.execute(f"DROP TABLE {table};")
+                else:
+                    cursor.execute(f"ALTER TABLE {table} SET SCHEMA {ARCHIVE_SCHEMA};")
+            else:
+                cursor.execute(f"DROP TABLE {table};")
+        cursor.execute("DELETE FROM surveys WHERE period_start = %s;", (start,))
+        deleted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
+
+
+# Выгрузка результатов опросов в CSV (COPY TO STDOUT) и JSON Lines (серверный курсор)
+EXPORT_KINDS = {
+    "scores": (SURVEY_SCORES_SQL, ScoreRow, SCORES_PERIOD_COLUMNS),
+    "averages": (SURVEY_AVERAGES_SQL, CategoryAverage, ("s.period_start",)),
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+@instrumented
+def export_survey_data(conn, out, kind="scores", fmt="csv", employee_id=None, period=None, itersize=2000):
+    # out - текстовый файл; строки пишутся по мере получения, память не зависит от объёма данных
+    sql, record, period_columns = EXPORT_KINDS[kind]
+    where, params = _survey_filters(employee_id, period, period_columns=period_columns)
+    query = sql.format(where=where)
+    if fmt == "csv":
+        cursor = conn.cursor()
+        query = cursor.mogrify(query, params).decode(encodings[conn.encoding])
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true);", out)
+    elif fmt == "jsonl":
+        for row in _iter_query(conn, query, params, itersize):
+            out.write(json.dumps(record(*row)._asdict(), ensure_ascii=False) + "\n")
+    else:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    conn.commit()
+
+
+# Пакетные отчёты по сотрудникам: сотрудники делятся на порции, каждую порцию обрабатывает
+# процесс из пула со своим подключением и пишет по файлу на сотрудника. Текст отчёта - тот же,
+# что в окне результатов (render_survey_results).
+REPORT_FORMATS = ("txt", "html")
+REPORT_HTML = """<!DOCTYPE html>
+<html lang="ru">
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<h1>{title}</h1>
+<pre>{body}</pre>
+</body>
+</html>
+"""
+# Итог порции (pid процесса, число сотрудников и опросов, время работы) и итог по процессу
+ReportChunk = namedtuple("ReportChunk", "pid employees surveys seconds")
+ReportWorker = namedtuple("ReportWorker", "pid chunks employees seconds")
+ReportBatch = namedtuple("ReportBatch", "employees surveys seconds workers")
+
+# Подключение процесса пула отчётов (см. _init_report_worker)
+_report_conn = None
+
+
+def period_label(period):
+    if period is None:
+        return "все периоды"
+    if isinstance(period, str):
+        return period
+    return f"{period.start or '...'} - {period.end or '...'}"
+
+
+def report_filename(employee_id, name, fmt="txt"):
+    # Имя сотрудника оставляем читаемым, id делает имя файла уникальным
+    slug = re.sub(r"[^\w-]+", "_", name).strip("_")[:60]
+    return f"{employee_id}_{slug}.{fmt}" if slug else f"{employee_id}.{fmt}"
+
+
+def render_report(name, period, text, fmt="txt"):
+    title = f"Оценка компетенций: {name}, {period_label(period)}"
+    if fmt == "html":
+        import html
+        return REPORT_HTML.format(title=html.escape(title), body=html.escape(text))
+    return f"{title}\n{text}"
+
+
+def _init_report_worker(params):
+    global _report_conn
+    _report_conn = psycopg2.connect(cursor_factory=InstrumentedCursor, **params)
+    _report_conn.set_session(readonly=True)
+    atexit.register(_report_conn.close)
+
+
+def _write_report_chunk(employee_ids, out_dir, period=None, fmt="txt"):
+    """Отчёты порции сотрудников: три запроса на порцию, строки раскладываются по сотрудникам в памяти"""
+    start = time.perf_counter()
+    conn = _report_conn
+    where, params = _survey_filters(period=period, employee_ids=employee_ids)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT s.id, s.employee_id, e.name FROM surveys s JOIN employees e ON e.id = s.employee_id "
+                   f"{where};", params)
+    survey_employee = {}
+    names = {}
+    for survey_id, employee_id, name in cursor.fetchall():
+        survey_employee[survey_id] = employee_id
+        names[employee_id] = name
+    averages = {}
+    cursor.execute(SURVEY_AVERAGES_SQL.format(where=where), params)
+    for row in cursor.fetchall():
+        averages.setdefault(survey_employee[row[0]], []).append(CategoryAverage(*row))
+    scores = {}
+    where, params = _survey_filters(period=period, period_columns=SCORES_PERIOD_COLUMNS, employee_ids=employee_ids)
+    for row in _iter_score_tuples(conn, where, params):
+        scores.setdefault(survey_employee[row[0]], []).append(row)
+    conn.rollback()
+
+    for employee_id, name in names.items():
+        text = render_survey_results(scores.get(employee_id, []), averages.get(employee_id, []))
+        path = os.path.join(out_dir, report_filename(employee_id, name, fmt))
+        # Файл появляется целиком: при сбое не остаётся наполовину записанных отчётов
+        with open(path + ".tmp", "w", encoding="utf-8") as out:
+            out.write(render_report(name, period, text, fmt))
+        os.replace(path + ".tmp", path)
+    return ReportChunk(os.getpid(), len(names), len(survey_employee), time.perf_counter() - start)
+
+
+@instrumented
+def get_report_employees(conn, period=None):
+    # Сотрудники, у которых есть опросы за период, по возрастанию id
+    where, params = _survey_filters(period=period)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT DISTINCT s.employee_id FROM surveys s {where} ORDER BY 1;", params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def generate_reports(conn, params, out_dir, period=None, workers=None, chunk_size=200, fmt="txt", progress=None):
+    """Пишет в out_dir отчёт по каждому сотруднику с опросами за период.
+    params - параметры подключения процессов пула, progress(готово, всего) вызывается после каждой порции."""
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат отчёта: {fmt}")
+    # Пул процессов нужен только пакетным отчётам, при запуске интерфейса не загружается
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.perf_counter()
+    employee_ids = get_report_employees(conn, period)
+    conn.commit()
+    os.makedirs(out_dir, exist_ok=True)
+    chunks = [employee_ids[i:i + chunk_size] for i in range(0, len(employee_ids), chunk_size)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks)))
+    done = surveys = 0
+    stats = {}
+    # spawn, а не fork: у процесса интерфейса есть потоки и открытые подключения
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_report_worker, initargs=(params,)) as executor:
+        futures = [executor.submit(_write_report_chunk, chunk, out_dir, period, fmt) for chunk in chunks]
+        try:
+            for future in as_completed(futures):
+                chunk = future.result()
+                done += chunk.employees
+                surveys += chunk.surveys
+                worker = stats.get(chunk.pid, ReportWorker(chunk.pid, 0, 0, 0.0))
+                stats[chunk.pid] = ReportWorker(chunk.pid, worker.chunks + 1, worker.employees + chunk.employees,
+                                                worker.seconds + chunk.seconds)
+                if progress:
+                    progress(done, len(employee_ids))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return ReportBatch(done, surveys, time.perf_counter() - start, sorted(stats.values()))
+
+
+# Загрузка данных из CSV через COPY FROM STDIN во временные таблицы
+
+class ProgressReader:
+    """Файловый объект для COPY: читает исходный файл порциями и сообщает о прогрессе"""
+
+    def __init__(self, file, label, total=None, out=sys.stderr):
+        self.file = file
+        self.label = label
+        self.total = total
+        self.out = out
+        self.done = 0
+        self._reported = -1
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.done += len(data)
+        if self.total:
+            percent = min(100, self.done * 100 // self.total)
+            if percent != self._reported:
+                self._reported = percent
+                print(f"\r{self.label}: {percent}%", end="\n" if percent == 100 else "", file=self.out, flush=True)
+        return data
+
+
+ScoreImportResult = namedtuple("ScoreImportResult", "surveys scores skipped")
+
+
+def _copy_csv(cursor, table, columns, file):
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER true);", file)
+
+
+@instrumented
+def import_employees_csv(conn, file):
+    # CSV: name. Сотрудники, которые уже есть в базе, повторно не добавляются.
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE import_employees (name TEXT) ON COMMIT DROP;")
+        _copy_csv(cursor, "import_employees", ["name"], file)
+        cursor.execute("""
+        INSERT INTO employees (name)
+        SELECT DISTINCT trim(i.name) FROM import_employees i
+        WHERE trim(i.name) <> ''
+          AND NOT EXISTS (SELECT 1 FROM employees e WHERE e.name = trim(i.name));
+        """)
+        added = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return added
+
+
+@instrumented
+def import_catalog_csv(conn, file):
+    # CSV: category,competency. Возвращает число добавленных категорий и компетенций.
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE import_catalog (category TEXT, competency TEXT) ON COMMIT DROP;")
+        _copy_csv(cursor, "import_catalog", ["category", "competency"], file)
+        cursor.execute("""
+        INSERT INTO categories (name)
+        SELECT DISTINCT trim(category) FROM import_catalog WHERE trim(category) <> ''
+        ON CONFLICT (name) DO NOTHING;
+        """)
+        categories_added = cursor.rowcount
+        cursor.execute("""
+        INSERT INTO competencies (name, category_id)
+        SELECT DISTINCT trim(i.competency), cat.id
+        FROM import_catalog i
+        JOIN categories cat ON cat.name = trim(i.category)
+        WHERE trim(i.competency) <> ''
+        ON CONFLICT (name, category_id) DO NOTHING;
+        """)
+        competencies_added = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    catalog_cache.invalidate(conn)
+    return categories_added, competencies_added
+
+
+@instrumented
+def import_scores_csv(conn, file, skip_invalid=False):
+    # CSV: employee,period,category,competency,score. Строки одного сотрудника и периода
+    # образуют один опрос. Имена сопоставляются с id и проверяются одним запросом на весь файл;
+    # при ошибках импорт отменяется, если не задан skip_invalid.
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        CREATE TEMP TABLE import_scores (
+            line SERIAL,
+            employee TEXT, period TEXT, category TEXT, competency TEXT, score TEXT
+        ) ON COMMIT DROP;
+        """)
+        _copy_csv(cursor, "import_scores", ["employee", "period", "category", "competency", "score"], file)
+        cursor.execute("""
+        CREATE TEMP TABLE import_resolved ON COMMIT DROP AS
+        SELECT i.line, e.id AS employee_id, comp.id AS competency_id,
+               CASE WHEN upper(trim(i.period)) ~ '^[0-9]{4}-Q[1-4]$'
+                    THEN make_date(left(trim(i.period), 4)::int, right(trim(i.period), 1)::int * 3 - 2, 1)
+               END AS period_start,
+               CASE WHEN coalesce(i.score, '') ~ '^\\s*[0-9]+([.,][0-9]+)?\\s*$'
+                    THEN replace(trim(i.score), ',', '.')::real END AS score,
+               CASE
+                   WHEN e.n IS NULL THEN 'неизвестный сотрудник'
+                   WHEN e.n > 1 THEN 'несколько сотрудников с таким именем'
+                   WHEN coalesce(trim(i.period), '') = '' THEN 'не указан период'
+                   WHEN NOT upper(trim(i.period)) ~ '^[0-9]{4}-Q[1-4]$' THEN 'период не в формате ГГГГ-QN'
+                   WHEN comp.id IS NULL THEN 'неизвестная компетенция'
+                   WHEN NOT coalesce(i.score, '') ~ '^\\s*[0-9]+([.,][0-9]+)?\\s*$' THEN 'оценка не число'
+                   WHEN NOT replace(trim(i.score), ',', '.')::real BETWEEN 1 AND 5 THEN 'оценка вне диапазона 1-5'
+                   WHEN count(*) OVER (PARTITION BY e.id, upper(trim(i.period)), comp.id) > 1
+                       THEN 'повтор компетенции в опросе'
+               END AS error
+        FROM import_scores i
+        LEFT JOIN (SELECT name, min(id) AS id, count(*) AS n FROM employees GROUP BY name) e
+               ON e.name = trim(i.employee)
+        LEFT JOIN categories cat ON cat.name = trim(i.category)
+        LEFT JOIN competencies comp ON comp.category_id = cat.id AND comp.name = trim(i.competency);
+        """)
+        cursor.execute("SELECT count(*) FROM import_resolved WHERE error IS NOT NULL;")
+        invalid = cursor.fetchone()[0]
+        if invalid and not skip_invalid:
+            cursor.execute("""
+            SELECT line, error FROM import_resolved WHERE error IS NOT NULL ORDER BY line LIMIT 10;
+            """)
+            # Номер строки в файле с учётом заголовка
+            examples = "; ".join(f"строка {line + 1}: {error}" for line, error in cursor.fetchall())
+            raise ValueError(f"Ошибок в файле оценок: {invalid}. {examples}")
+        cursor.execute("""
+        CREATE TEMP TABLE import_surveys ON COMMIT DROP AS
+        WITH created AS (
+            INSERT INTO surveys (employee_id, period_start)
+            SELECT DISTINCT employee_id, period_start FROM import_resolved WHERE error IS NULL
+            RETURNING id, employee_id, period_start
+        )
+        SELECT * FROM created;
+        """)
+        surveys = cursor.rowcount
+        cursor.execute("""
+        INSERT INTO survey_scores (survey_id, competency_id, score, period_start)
+        SELECT s.id, r.competency_id, r.score, s.period_start
+        FROM import_resolved r
+        JOIN import_surveys s ON s.employee_id = r.employee_id AND s.period_start = r.period_start
+        WHERE r.error IS NULL;
+        """)
+        scores = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return ScoreImportResult(surveys, scores, invalid)
+
+
+# Хранилища: общий интерфейс поверх PostgreSQL и SQLite (файл или :memory:)
+
+class Storage:
+    """Операции с данными без явного соединения. Набор методов повторяет функции выше:
+    init_db, add_employee, add_employees, get_employees, search_employees, add_category, get_categories, add_competency,
+    get_competencies_by_category, get_competencies_by_categories, get_catalog, add_survey,
+    add_survey_score, add_survey_scores, submit_survey,
+    iter_survey_scores, get_survey_scores, get_survey_averages, get_survey_overall,
+    get_survey_results, get_survey_page, get_surveys_between, get_period_summary.
+    Как и соединение psycopg2, хранилище умеет
+    rollback(), cancel() и close(), поэтому его можно отдавать в DBExecutor."""
+
+    def schema_cache_key(self):
+        # Ключ базы для кэша версии схемы (init_db_cached); None - проверять схему при каждом запуске
+        return None
+
+    def get_survey_scores(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        return list(self.iter_survey_scores(employee_id, period, category_id, survey_id))
+
+    def get_survey_results(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        averages = self.get_survey_averages(employee_id, period, category_id, survey_id)
+        scores = self.iter_survey_scores(employee_id, period, category_id, survey_id)
+        return render_survey_results(scores, averages)
+
+
+class PostgresStorage(Storage):
+    def __init__(self, conn):
+        self.conn = conn
+
+    @property
+    def closed(self):
+        return self.conn.closed
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def cancel(self):
+        self.conn.cancel()
+
+    def close(self):
+        self.conn.close()
+
+    def init_db(self):
+        init_db(self.conn)
+
+    def schema_cache_key(self):
+        params = self.conn.get_dsn_parameters()
+        key = f"{params.get('user')}@{params.get('host')}:{params.get('port')}/{params.get('dbname')}"
+        return f"{key} {params['options']}" if params.get("options") else key
+
+    def add_employee(self, name):
+        return add_employee(self.conn, name)
+
+    def add_employees(self, names):
+        return add_employees(self.conn, names)
+
+    def get_employees(self):
+        return get_employees(self.conn)
+
+    def search_employees(self, prefix, limit=20):
+        return search_employees(self.conn, prefix, limit)
+
+    def add_category(self, name):
+        return add_category(self.conn, name)
+
+    def get_categories(self):
+        return get_categories(self.conn)
+
+    def add_competency(self, name, category_id):
+        return add_competency(self.conn, name, category_id)
+
+    def get_competencies_by_category(self, category_id):
+        return get_competencies_by_category(self.conn, category_id)
+
+    def get_competencies_by_categories(self, category_ids):
+        return get_competencies_by_categories(self.conn, category_ids)
+
+    def get_catalog(self):
+        return get_catalog(self.conn)
+
+    def add_survey(self, employee_id, period):
+        return add_survey(self.conn, employee_id, period)
+
+    def add_survey_score(self, survey_id, competency_id, score):
+        add_survey_score(self.conn, survey_id, competency_id, score)
+
+    def add_survey_scores(self, rows):
+        return add_survey_scores(self.conn, rows)
+
+    def submit_survey(self, employee_id, period, scores):
+        return submit_survey(self.conn, employee_id, period, scores)
+
+    def iter_survey_scores(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        return iter_survey_scores(self.conn, employee_id, period, category_id, survey_id)
+
+    def get_survey_results(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        return get_survey_results(self.conn, employee_id, period, category_id, survey_id)
+
+    def get_survey_averages(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        return get_survey_averages(self.conn, employee_id, period, category_id, survey_id)
+
+    def get_survey_overall(self, survey_ids):
+        return get_survey_overall(self.conn, survey_ids)
+
+    def get_survey_page(self, sort="id", after=None, limit=50, employee_name=None, period=None, survey_ids=None):
+        return get_survey_page(self.conn, sort, after, limit, employee_name, period, survey_ids)
+
+    def get_surveys_between(self, start=None, end=None, employee_id=None):
+        return get_surveys_between(self.conn, start, end, employee_id)
+
+    def get_period_summary(self, start=None, end=None, category_id=None):
+        return get_period_summary(self.conn, start, end, category_id)
+
+
+class SQLiteStorage(Storage):
+    """Локальное хранилище для работы без сервера и быстрых тестов.
+    Опросы помечаются synced после переноса в PostgreSQL (см. sync_offline_surveys)."""
+
+    SCHEMA = """
     CREATE TABLE IF NOT EXISTS employees (
-        id SERIAL PRIMARY KEY,
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL
     );
-    """)
-    cursor.execute("""
     CREATE TABLE IF NOT EXISTS categories (
-        id SERIAL PRIMARY KEY,
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL UNIQUE
     );
-    """)
-    cursor.execute("""
     CREATE TABLE IF NOT EXISTS competencies (
-        id SERIAL PRIMARY KEY,
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         category_id INTEGER REFERENCES categories(id) ON DELETE CASCADE,
         UNIQUE(name, category_id)
     );
-    """)
-    cursor.execute("""
     CREATE TABLE IF NOT EXISTS surveys (
-        id SERIAL PRIMARY KEY,
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         employee_id INTEGER NOT NULL REFERENCES employees(id) ON DELETE CASCADE,
-        period TEXT NOT NULL
+        period TEXT NOT NULL,
+        synced INTEGER NOT NULL DEFAULT 0,
+        period_start TEXT GENERATED ALWAYS AS ({period_start}) VIRTUAL
     );
-    """)
-    cursor.execute("""
     CREATE TABLE IF NOT EXISTS survey_scores (
-        id SERIAL PRIMARY KEY,
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
         survey_id INTEGER NOT NULL REFERENCES surveys(id) ON DELETE CASCADE,
         competency_id INTEGER NOT NULL REFERENCES competencies(id) ON DELETE CASCADE,
-        score REAL NOT NULL
+        score REAL NOT NULL,
+        UNIQUE(survey_id, competency_id)
     );
-    """)
-    conn.commit()
+    CREATE INDEX IF NOT EXISTS survey_scores_competency_id_idx ON survey_scores (competency_id);
+    CREATE INDEX IF NOT EXISTS surveys_employee_id_idx ON surveys (employee_id);
+    CREATE INDEX IF NOT EXISTS competencies_category_id_idx ON competencies (category_id);
+    """
+    # Период хранится текстом "2025-Q1"; дата начала квартала (ISO-строка) вычисляется из него,
+    # чтобы фильтры и сортировка по периоду были общими с PostgreSQL
+    PERIOD_START_SQL = ("substr(period, 1, 4) || '-' || "
+                        "CASE substr(period, 7, 1) WHEN '1' THEN '01' WHEN '2' THEN '04' WHEN '3' THEN '07' "
+                        "ELSE '10' END || '-01'")
 
+    # В SQLite у оценок нет period_start (таблица не секционирована)
+    SCORES_SQL = """
+    SELECT s.id AS survey_id, e.name AS employee_name, s.period, cat.name AS category,
+           comp.name AS competency, ss.score
+    FROM surveys s
+    JOIN employees e ON s.employee_id = e.id
+    JOIN survey_scores ss ON ss.survey_id = s.id
+    JOIN competencies comp ON ss.competency_id = comp.id
+    JOIN categories cat ON comp.category_id = cat.id
+    {where}
+    ORDER BY s.id, cat.name, comp.name
+    """
 
-def add_employee(conn, name):
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO employees (name) VALUES (%s) RETURNING id;", (name,))
-    emp_id = cursor.fetchone()[0]
-    conn.commit()
-    return emp_id
+    # В SQLite нет survey_category_totals, средние считаются по сырым оценкам
+    AVERAGES_SQL = """
+    SELECT survey_id, employee_name, period, category,
+           total / cnt AS average,
+           SUM(total) OVER w / SUM(cnt) OVER w AS overall
+    FROM (
+        SELECT s.id AS survey_id, e.name AS employee_name, s.period, cat.name AS category,
+               SUM(ss.score) AS total, COUNT(*) AS cnt
+        FROM surveys s
+        JOIN employees e ON s.employee_id = e.id
+        JOIN survey_scores ss ON ss.survey_id = s.id
+        JOIN competencies comp ON ss.competency_id = comp.id
+        JOIN categories cat ON comp.category_id = cat.id
+        {where}
+        GROUP BY s.id, e.name, s.period, cat.name
+    ) per_category
+    WINDOW w AS (PARTITION BY survey_id)
+    ORDER BY survey_id, category
+    """
 
+    def __init__(self, path=":memory:"):
+        # Соединение используется потоками DBExecutor по очереди (см. SQLiteStoragePool)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON;")
+        # lower() в SQLite меняет регистр только латиницы
+        self.conn.create_function("py_lower", 1, str.lower, deterministic=True)
+        self.closed = False
 
-def get_employees(conn):
+    def rollback(self):
+        self.conn.rollback()
+
+    def cancel(self):
+        self.conn.interrupt()
+
+    def close(self):
+        self.conn.close()
+        self.closed = True
+
+    def _query(self, sql, params=()):
+        # Запросы PostgreSQL-функций переиспользуются, меняется только стиль параметров
+        return self.conn.execute(sql.replace("%s", "?"), params).fetchall()
+
+    def init_db(self):
+        self.conn.executescript(self.SCHEMA.format(period_start=self.PERIOD_START_SQL))
+        # Файл, созданный до появления period_start: столбец добавляется, старый индекс по тексту не нужен
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_xinfo(surveys);")]
+        if "period_start" not in columns:
+            self.conn.execute(f"ALTER TABLE surveys ADD COLUMN period_start TEXT "
+                              f"GENERATED ALWAYS AS ({self.PERIOD_START_SQL}) VIRTUAL;")
+        self.conn.executescript("""
+        DROP INDEX IF EXISTS surveys_period_idx;
+        CREATE INDEX IF NOT EXISTS surveys_period_start_idx ON surveys (period_start, id);
+        """)
+
+    def add_employee(self, name):
+        with self.conn:
+            return self.conn.execute("INSERT INTO employees (name) VALUES (?);", (name,)).lastrowid
+
+    def add_employees(self, names):
+        with self.conn:
+            return [self.conn.execute("INSERT INTO employees (name) VALUES (?);", (name,)).lastrowid
+                    for name in names]
+
+    def get_employees(self):
+        return self._query("SELECT id, name FROM employees;")
+
+    def search_employees(self, prefix, limit=20):
+        # Порядок как в PostgreSQL: по кодам символов имени в нижнем регистре, затем по id
+        low, high = prefix_range(prefix.strip())
+        return self._query("SELECT id, name FROM employees "
+                           "WHERE py_lower(name) >= ? AND (? IS NULL OR py_lower(name) < ?) "
+                           "ORDER BY py_lower(name), id LIMIT ?;", (low, high, high, limit))
+
+    def add_category(self, name):
+        try:
+            with self.conn:
+                return self.conn.execute("INSERT INTO categories (name) VALUES (?);", (name,)).lastrowid
+        except sqlite3.IntegrityError:
+            return None
+
+    def get_categories(self):
+        return self._query("SELECT id, name FROM categories;")
+
+    def add_competency(self, name, category_id):
+        try:
+            with self.conn:
+                return self.conn.execute("INSERT INTO competencies (name, category_id) VALUES (?, ?);",
+                                         (name, category_id)).lastrowid
+        except sqlite3.IntegrityError:
+            return None
+
+    def get_competencies_by_category(self, category_id):
+        return self._query("SELECT id, name FROM competencies WHERE category_id=?;", (category_id,))
+
+    def get_competencies_by_categories(self, category_ids):
+        competencies = {category_id: [] for category_id in category_ids}
+        placeholders = ", ".join("?" * len(competencies))
+        rows = self._query(f"SELECT category_id, id, name FROM competencies WHERE category_id IN ({placeholders}) "
+                           f"ORDER BY category_id, id;", list(competencies))
+        for category_id, comp_id, name in rows:
+            competencies[category_id].append((comp_id, name))
+        return competencies
+
+    def get_catalog(self):
+        return _catalog_from_rows(self._query(CATALOG_SQL))
+
+    def add_survey(self, employee_id, period):
+        period = format_period(period_start(period))
+        with self.conn:
+            return self.conn.execute("INSERT INTO surveys (employee_id, period) VALUES (?, ?);",
+                                     (employee_id, period)).lastrowid
+
+    def add_survey_score(self, survey_id, competency_id, score):
+        with self.conn:
+            self.conn.execute("INSERT INTO survey_scores (survey_id, competency_id, score) VALUES (?, ?, ?);",
+                              (survey_id, competency_id, score))
+
+    def add_survey_scores(self, rows):
+        with self.conn:
+            return self.conn.executemany("INSERT INTO survey_scores (survey_id, competency_id, score) "
+                                         "VALUES (?, ?, ?);", rows).rowcount
+
+    def submit_survey(self, employee_id, period, scores):
+        rows = validate_scores(scores)
+        period = format_period(period_start(period))
+        with self.conn:
+            survey_id = self.conn.execute("INSERT INTO surveys (employee_id, period) VALUES (?, ?);",
+                                          (employee_id, period)).lastrowid
+            self.conn.executemany("INSERT INTO survey_scores (survey_id, competency_id, score) VALUES (?, ?, ?);",
+                                  [(survey_id, comp_id, score) for comp_id, score in rows])
+        return survey_id
+
+    def iter_survey_scores(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        where, params = _survey_filters(employee_id, period, category_id, survey_id)
+        return [ScoreRow(*row) for row in self._query(self.SCORES_SQL.format(where=where), params)]
+
+    def get_survey_averages(self, employee_id=None, period=None, category_id=None, survey_id=None):
+        where, params = _survey_filters(employee_id, period, category_id, survey_id)
+        return [CategoryAverage(*row) for row in self._query(self.AVERAGES_SQL.format(where=where), params)]
+
+    def get_survey_overall(self, survey_ids):
+        survey_ids = list(survey_ids)
+        if not survey_ids:
+            return {}
+        placeholders = ", ".join("?" * len(survey_ids))
+        return dict(self._query(f"SELECT survey_id, AVG(score) FROM survey_scores "
+                                f"WHERE survey_id IN ({placeholders}) GROUP BY survey_id;", survey_ids))
+
+    def get_survey_page(self, sort="id", after=None, limit=50, employee_name=None, period=None, survey_ids=None):
+        # В SQLite строки и так сравниваются побайтно (BINARY), а сопоставления "C" нет
+        column = {"employee": "e.name"}.get(sort, SURVEY_SORT_KEYS[sort][0])
+        conditions = []
+        params = []
+        if survey_ids is not None:
+            survey_ids = list(survey_ids)
+            conditions.append(f"s.id IN ({', '.join(['%s'] * len(survey_ids))})")
+            params.extend(survey_ids)
+        if employee_name:
+            conditions.append("e.name LIKE %s")
+            params.append(f"%{employee_name}%")
+        if period:
+            period_conditions, period_params = _period_conditions(period)
+            conditions.extend(period_conditions)
+            params.extend(period_params)
+        if after is not None:
+            conditions.append(f"({column}, s.id) > (%s, %s)")
+            params.extend(after)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        rows = self._query(f"""
+        SELECT s.id, e.name, s.period,
+               (SELECT AVG(ss.score) FROM survey_scores ss WHERE ss.survey_id = s.id) AS overall
+        FROM surveys s
+        JOIN employees e ON s.employee_id = e.id
+        {where}
+        ORDER BY {column}, s.id
+        LIMIT %s;
+        """, params + [limit])
+        return [SurveyRow(*row) for row in rows]
+
+    def get_surveys_between(self, start=None, end=None, employee_id=None):
+        where, params = _survey_filters(employee_id, PeriodRange(start, end))
+        rows = self._query(f"""
+        SELECT s.id, e.name, s.period,
+               (SELECT AVG(ss.score) FROM survey_scores ss WHERE ss.survey_id = s.id) AS overall
+        FROM surveys s
+        JOIN employees e ON s.employee_id = e.id
+        {where}
+        ORDER BY s.period_start, s.id;
+        """, params)
+        return [SurveyRow(*row) for row in rows]
+
+    def get_period_summary(self, start=None, end=None, category_id=None):
+        where, params = _survey_filters(None, PeriodRange(start, end))
+        join = "LEFT JOIN survey_scores ss ON ss.survey_id = s.id"
+        if category_id is not None:
+            join += " AND ss.competency_id IN (SELECT id FROM competencies WHERE category_id = %s)"
+            params = [category_id] + params
+        rows = self._query(f"""
+        SELECT s.period, COUNT(DISTINCT s.id), COUNT(DISTINCT s.employee_id), AVG(ss.score)
+        FROM surveys s
+        {join}
+        {where}
+        GROUP BY s.period_start, s.period
+        ORDER BY s.period_start;
+        """, params)
+        return [PeriodSummary(*row) for row in rows]
+
+
+class PostgresStoragePool:
+    """ThreadedConnectionPool, выдающий PostgresStorage вместо голых соединений"""
+
+    def __init__(self, minconn, maxconn, **params):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **params)
+
+    def getconn(self):
+        return PostgresStorage(self._pool.getconn())
+
+    def putconn(self, storage, close=False):
+        self._pool.putconn(storage.conn, close=close)
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class SQLiteStoragePool:
+    """Одно соединение SQLite, которое потоки получают по очереди"""
+
+    def __init__(self, path):
+        self._storage = SQLiteStorage(path)
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        self._lock.acquire()
+        return self._storage
+
+    def putconn(self, storage, close=False):
+        self._lock.release()
+
+    def closeall(self):
+        self._storage.close()
+
+
+def create_storage_pool(spec):
+    # spec: "postgresql" (параметры из load_db_params) или "sqlite:<путь к файлу>" / "sqlite::memory:"
+    if spec.startswith("sqlite:"):
+        return SQLiteStoragePool(spec[len("sqlite:"):] or ":memory:")
+    if spec == "postgresql":
+        return PostgresStoragePool(1, 5, cursor_factory=InstrumentedCursor, **load_db_params())
+    raise ValueError(f"Неизвестное хранилище: {spec}")
+
+
+def sync_offline_surveys(sqlite_storage, conn):
+    # Переносит ещё не синхронизированные опросы из SQLite в PostgreSQL через CSV-импорт.
+    # Сотрудники и каталог сопоставляются по именам; возвращает ScoreImportResult.
+    import tempfile
+
+    local = sqlite_storage.conn
+    survey_ids = [row[0] for row in local.execute("SELECT id FROM surveys WHERE synced = 0;")]
+    if not survey_ids:
+        return ScoreImportResult(0, 0, 0)
+    placeholders = ", ".join("?" * len(survey_ids))
+    exports = [
+        (import_employees_csv, ["name"], f"""
+            SELECT DISTINCT e.name FROM employees e JOIN surveys s ON s.employee_id = e.id
+            WHERE s.id IN ({placeholders});""", survey_ids),
+        (import_catalog_csv, ["category", "competency"], """
+            SELECT cat.name, comp.name FROM categories cat
+            JOIN competencies comp ON comp.category_id = cat.id;""", ()),
+        (import_scores_csv, ["employee", "period", "category", "competency", "score"], f"""
+            SELECT employee_name, period, category, competency, score
+            FROM ({SQLiteStorage.SCORES_SQL.format(where=f"WHERE s.id IN ({placeholders})")});""", survey_ids),
+    ]
+    result = None
+    for func, header, sql, params in exports:
+        with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(local.execute(sql, params))
+            f.seek(0)
+            result = func(conn, f)
+    with local:
+        local.execute(f"UPDATE surveys SET synced = 1 WHERE id IN ({placeholders});", survey_ids)
+    return result
+
+
+# Выполнение запросов вне потока интерфейса
+
+class DeferredPool:
+    """Пул хранилищ, который создаётся в фоновом потоке: окно появляется сразу, а подключение
+    повторяется с удваивающейся задержкой. getconn() ждёт, пока пул будет готов или попытки закончатся.
+    status ("connecting", "ready", "failed"), attempt и error читает интерфейс."""
+
+    def __init__(self, factory, setup=None, attempts=6, delay=0.5, max_delay=8.0):
+        self.factory = factory
+        self.setup = setup
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        self.status = "connecting"
+        self.attempt = 0
+        self.error = None
+        self._pool = None
+        self._ready = threading.Event()
+        self._cancelled = threading.Event()
+
+    def start(self):
+        self.status, self.attempt, self.error = "connecting", 0, None
+        self._ready.clear()
+        threading.Thread(target=self._connect, name="db-connect", daemon=True).start()
+        return self
+
+    def _connect(self):
+        delay = self.delay
+        while not self._cancelled.is_set():
+            self.attempt += 1
+            pool = None
+            try:
+                pool = self.factory()
+                if self.setup is not None:
+                    storage = pool.getconn()
+                    try:
+                        self.setup(storage)
+                    finally:
+                        pool.putconn(storage)
+            except Exception as e:
+                if pool is not None:
+                    pool.closeall()
+                self.error = e
+                # Повторяем только сетевые ошибки; неверная схема или настройки не исправятся сами
+                if not isinstance(e, psycopg2.OperationalError) or self.attempt >= self.attempts:
+                    break
+                logger.warning("Подключение не удалось (попытка %d): %s", self.attempt, e)
+                self._cancelled.wait(delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            if self._cancelled.is_set():
+                pool.closeall()
+                break
+            self._pool, self.error, self.status = pool, None, "ready"
+            self._ready.set()
+            return
+        self.status = "failed"
+        self._ready.set()
+
+    def retry(self):
+        # Повторное подключение после неудачи (кнопка в интерфейсе)
+        if self.status == "failed" and not self._cancelled.is_set():
+            self.start()
+
+    def cancel(self):
+        # Прекратить попытки; ожидающие getconn() сразу получают ошибку
+        self._cancelled.set()
+        if self._pool is None:
+            self.status = "failed"
+            self._ready.set()
+
+    def getconn(self):
+        self._ready.wait()
+        if self._pool is None:
+            raise psycopg2.OperationalError(f"Нет подключения к базе данных: {self.error or 'отменено'}")
+        return self._pool.getconn()
+
+    def putconn(self, storage, close=False):
+        self._pool.putconn(storage, close=close)
+
+    def closeall(self):
+        self.cancel()
+        if self._pool is not None:
+            self._pool.closeall()
+
+
+class DBTask:
+    """Задача для пула потоков; отмена прерывает и выполняющийся запрос"""
+
+    def __init__(self, on_success=None, on_error=None):
+        self.on_success = on_success
+        self.on_error = on_error
+        self.future = None
+        self.cancelled = False
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+            return not self.cancelled
+
+    def detach(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self.future is not None:
+                self.future.cancel()
+            if self._conn is not None:
+                self._conn.cancel()
+
+
+class DBExecutor:
+    """Запускает функции работы с БД в пуле потоков, каждую со своим соединением из пула.
+    Результаты забирает поток интерфейса через process_completed()."""
+
+    def __init__(self, pool, workers=4):
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self._completed = queue.Queue()
+
+    def submit(self, func, *args, on_success=None, on_error=None):
+        task = DBTask(on_success, on_error)
+        task.future = self._executor.submit(self._run, task, func, args)
+        return task
+
+    def _run(self, task, func, args):
+        try:
+            conn = self.pool.getconn()
+        except Exception as e:
+            self._completed.put((task, None, e))
+            return
+        try:
+            if not task.attach(conn):
+                return
+            try:
+                result = func(conn, *args)
+            except Exception as e:
+                if not conn.closed:
+                    conn.rollback()
+                self._completed.put((task, None, e))
+            else:
+                self._completed.put((task, result, None))
+        finally:
+            task.detach()
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def process_completed(self):
+        # Вызывается только из потока интерфейса
+        while True:
+            try:
+                task, result, error = self._completed.get_nowait()
+            except queue.Empty:
+                return
+            if task.cancelled:
+                continue
+            if error is None:
+                if task.on_success:
+                    task.on_success(result)
+            elif task.on_error:
+                task.on_error(error)
+            else:
+                raise error
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.pool.closeall()
+
+
+# Уведомления об изменениях от других клиентов (триггеры notify_change, миграция 4)
+
+CHANGES_CHANNEL = "kurs_changes"
+# ids - id изменённых строк (для survey_scores - id опросов) или None, если изменено неизвестно что
+Change = namedtuple("Change", "table op ids")
+
+
+def parse_change(payload):
+    change = json.loads(payload)
+    return Change(change["table"], change["op"], change["ids"])
+
+
+class ChangeListener:
+    """Слушает канал kurs_changes на отдельном соединении в фоновом потоке; поток интерфейса
+    забирает изменения через drain(). После переподключения приходит Change(None, "RESYNC", None):
+    уведомления за время разрыва потеряны, и открытые окна перечитывают данные целиком."""
+
+    def __init__(self, params, delay=1.0, max_delay=30.0, poll_timeout=0.5):
+        self.params = params
+        self.delay = delay
+        self.max_delay = max_delay
+        self.poll_timeout = poll_timeout
+        self.connected = threading.Event()
+        self._changes = queue.Queue()
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="db-listen", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def drain(self):
+        changes = []
+        while True:
+            try:
+                changes.append(self._changes.get_nowait())
+            except queue.Empty:
+                return changes
+
+    def _run(self):
+        delay = self.delay
+        reconnect = False
+        while not self._stop.is_set():
+            try:
+                conn = psycopg2.connect(**self.params)
+            except psycopg2.OperationalError as e:
+                logger.warning("Нет подключения для уведомлений: %s", e)
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            delay = self.delay
+            try:
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANGES_CHANNEL};")
+                if reconnect:
+                    self._changes.put(Change(None, "RESYNC", None))
+                reconnect = True
+                self.connected.set()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_timeout)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._changes.put(parse_change(conn.notifies.pop(0).payload))
+            except psycopg2.Error as e:
+                logger.warning("Соединение для уведомлений потеряно: %s", e)
+            finally:
+                self.connected.clear()
+                conn.close()
+
+
+# Отложенная запись из интерфейса: операция дописывается в журнал на диске и сразу подтверждается,
+# а фоновый поток переносит журнал в PostgreSQL пачками, по транзакции на пачку
+
+def _write_employee(conn, name):
+    return prepared_statements.execute(conn, "add_employee", (name,)).fetchone()[0]
+
+
+def _write_category(conn, name):
+    # Окно проверяет имена до записи, но одинаковые могут оказаться в очереди вместе или прийти
+    # от другого клиента: повтор не пишется, возвращается None, и WriteBehind сообщает о нём как об ошибке
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM employees;")
-    return cursor.fetchall()
+    cursor.execute("INSERT INTO categories (name) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id;", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
 
 
-def add_category(conn, name):
+def _write_competency(conn, name, category_id):
     cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO categories (name) VALUES (%s) RETURNING id;", (name,))
-        cat_id = cursor.fetchone()[0]
-        conn.commit()
-        return cat_id
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        return None
+    cursor.execute("INSERT INTO competencies (name, category_id) VALUES (%s, %s) ON CONFLICT DO NOTHING "
+                   "RETURNING id;", (name, category_id))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _write_survey_score(conn, survey_id, competency_id, score):
+    prepared_statements.execute(conn, "add_survey_score", (survey_id, competency_id, score))
+
+
+def _write_survey(conn, employee_id, period, scores):
+    survey_id = prepared_statements.execute(conn, "add_survey", (employee_id, period_start(period))).fetchone()[0]
+    if scores:
+        prepared_statements.execute(conn, "add_survey_scores",
+                                    ([survey_id] * len(scores), [comp_id for comp_id, _ in scores],
+                                     [score for _, score in scores]))
+    return survey_id
+
+
+# Операции журнала: имя -> (проверка аргументов при постановке в очередь, запись без commit).
+# Проверка возвращает аргументы в виде, который сохраняется в JSON.
+WRITE_OPERATIONS = {
+    "add_employee": (lambda name: [name], _write_employee),
+    "add_category": (lambda name: [name], _write_category),
+    "add_competency": (lambda name, category_id: [name, category_id], _write_competency),
+    "add_survey_score": (lambda survey_id, competency_id, score:
+                         [survey_id, competency_id, validate_scores([(competency_id, score)])[0][1]],
+                         _write_survey_score),
+    "submit_survey": (lambda employee_id, period, scores:
+                      [employee_id, format_period(period_start(period)), validate_scores(scores)], _write_survey),
+}
+
+# at - время постановки в очередь (time.time()); в журналах старых версий его нет
+# Операции, которые при повторе имени ничего не записывают и возвращают None, и текст ошибки для них
+WRITE_DUPLICATE_ERRORS = {
+    "add_category": "Категория с таким именем уже существует",
+    "add_competency": "Компетенция с таким именем уже существует в этой категории",
+}
+
+JournalEntry = namedtuple("JournalEntry", "key op args at", defaults=(None,))
+
+# Горизонт повтора: операция, пролежавшая в журнале дольше WRITE_REPLAY_HORIZON, не отправляется,
+# а выбывает с ошибкой. Ключи идемпотентности хранятся WRITE_KEY_RETENTION - с запасом на расхождение
+# часов клиента и сервера, так что ключ любой операции, которую ещё могут отправить, не удалён
+WRITE_REPLAY_HORIZON = datetime.timedelta(days=7)
+WRITE_KEY_RETENTION = datetime.timedelta(days=30)
+# Как часто фоновый поток удаляет устаревшие ключи, секунд
+WRITE_PRUNE_INTERVAL = 3600
+
 
+def _lock_exclusive(file):
+    # Исключительная блокировка файла без ожидания; снимается при закрытии файла или завершении процесса
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
 
-def get_categories(conn):
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM categories;")
-    return cursor.fetchall()
 
+WriteStats = namedtuple("WriteStats", "depth written batches retries failed flush_p50_ms flush_max_ms")
 
-def add_competency(conn, name, category_id):
+
+@instrumented
+def apply_write_batch(conn, entries):
+    """Записывает операции журнала одной транзакцией, возвращает {ключ: результат (id новой строки)}.
+    Операции, ключ которых уже есть в applied_writes, не повторяются - результат берётся оттуда."""
     cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO competencies (name, category_id) VALUES (%s, %s) RETURNING id;",
-                       (name, category_id))
-        comp_id = cursor.fetchone()[0]
+        cursor.execute("SELECT key::text, result FROM applied_writes WHERE key = ANY(%s::uuid[]);",
+                       ([entry.key for entry in entries],))
+        results = dict(cursor.fetchall())
+        new = [entry for entry in entries if entry.key not in results]
+        for entry in new:
+            results[entry.key] = WRITE_OPERATIONS[entry.op][1](conn, *entry.args)
+        if new:
+            cursor.execute("INSERT INTO applied_writes (key, result) SELECT * FROM unnest(%s::uuid[], %s::integer[]);",
+                           ([entry.key for entry in new], [results[entry.key] for entry in new]))
         conn.commit()
-        return comp_id
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        return None
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    for entry in new:
+        if entry.op == "add_category" and results[entry.key]:
+            catalog_cache.category_added(conn, results[entry.key], *entry.args)
+        elif entry.op == "add_competency" and results[entry.key]:
+            catalog_cache.competency_added(conn, results[entry.key], *entry.args)
+    return results
 
 
-def get_competencies_by_category(conn, category_id):
+@instrumented
+def prune_applied_writes(conn, retention=WRITE_KEY_RETENTION):
+    """Удаляет ключи идемпотентности старше retention, возвращает число удалённых"""
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM competencies WHERE category_id=%s;", (category_id,))
-    return cursor.fetchall()
+    cursor.execute("DELETE FROM applied_writes WHERE created_at < now() - %s;", (retention,))
+    conn.commit()
+    return cursor.rowcount
 
 
-def add_survey(conn, employee_id, period):
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO surveys (employee_id, period) VALUES (%s, %s) RETURNING id;", (employee_id, period))
-    survey_id = cursor.fetchone()[0]
-    conn.commit()
-    return survey_id
+class WriteBehind:
+    """Очередь отложенной записи в PostgreSQL. submit() дописывает операцию в журнал (JSON Lines, fsync)
+    и сразу возвращает её ключ; фоновый поток пишет очередь пачками до batch_size операций и при ошибке
+    подключения повторяет попытку с удваивающейся задержкой. Операция с ошибкой в данных выбывает
+    из очереди, интерфейс получает её через drain_failed(). Неподтверждённые операции журнала
+    отправляются заново при следующем запуске, если пролежали не дольше WRITE_REPLAY_HORIZON.
+    Журналом владеет один процесс: если его уже открыл другой экземпляр программы, конструктор
+    выбрасывает RuntimeError."""
 
+    # Журнал переписывается только оставшимися операциями, когда в нём накопилось столько отметок
+    COMPACT_AFTER = 1000
 
-def add_survey_score(conn, survey_id, competency_id, score):
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO survey_scores (survey_id, competency_id, score) VALUES (%s, %s, %s);",
-                   (survey_id, competency_id, score))
-    conn.commit()
+    def __init__(self, path, params, batch_size=100, interval=0.2, delay=0.5, max_delay=30.0):
+        self.path = path
+        self.params = params
+        self.batch_size = batch_size
+        self.interval = interval
+        self.delay = delay
+        self.max_delay = max_delay
+        # status ("connecting", "ready", "retrying") и error читает интерфейс
+        self.status = "connecting"
+        self.error = None
+        self.written = self.batches = self.retries = self.failed = 0
+        self.flush_latencies = deque(maxlen=200)
+        self._pending = OrderedDict()
+        self._failed = queue.Queue()
+        self._marks = 0
+        self._file = None
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Иначе второй экземпляр отправил бы чужие записи ещё раз, а его сжатие журнала стёрло бы
+        # дописанное первым. Блокируется отдельный файл: сам журнал при сжатии заменяется новым
+        self._lock_file = open(path + ".lock", "a")
+        if not _lock_exclusive(self._lock_file):
+            self._lock_file.close()
+            raise RuntimeError(f"Журнал {path} уже открыт другим экземпляром программы")
+        self._replay()
+        with self._cond:
+            self._compact()
 
+    @property
+    def depth(self):
+        return len(self._pending)
 
-def get_survey_results(conn):
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT s.id, e.name, s.period, cat.name, comp.name, ss.score
-    FROM surveys s
-    JOIN employees e ON s.employee_id = e.id
-    JOIN survey_scores ss ON ss.survey_id = s.id
-    JOIN competencies comp ON ss.competency_id = comp.id
-    JOIN categories cat ON comp.category_id = cat.id
-    ORDER BY s.id;
-    """)
-    rows = cursor.fetchall()
-    if not rows:
-        return "Нет данных об опросах."
+    def _replay(self):
+        # Журнал: строки операций и отметки {"done": [ключи]} / {"failed": [ключи], "error": ...}.
+        # Строку, оборванную при сбое, пропускаем
+        try:
+            f = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "op" in record:
+                    self._pending[record["key"]] = JournalEntry(**record)
+                for key in record.get("done", []) + record.get("failed", []):
+                    self._pending.pop(key, None)
 
-    results = ""
-    surveys = {}
-    for row in rows:
-        survey_id, employee_name, period, cat_name, comp_name, score = row
-        if survey_id not in surveys:
-            surveys[survey_id] = {
-                'employee_name': employee_name,
-                'period': period,
-                'scores': []
-            }
-        surveys[survey_id]['scores'].append((cat_name, comp_name, score))
-    for survey_id, data in surveys.items():
-        results += f"\nОпрос ID: {survey_id} | Сотрудник: {data['employee_name']} | Период: {data['period']}\n"
-        cat_totals = {}
-        cat_counts = {}
-        for cat_name, comp_name, score in data['scores']:
-            results += f"  {cat_name} - {comp_name}: {score}\n"
-            cat_totals[cat_name] = cat_totals.get(cat_name, 0) + score
-            cat_counts[cat_name] = cat_counts.get(cat_name, 0) + 1
-        results += "Средние оценки по категориям:\n"
-        overall_total = 0
-        overall_count = 0
-        for cat, total in cat_totals.items():
-            avg = total / cat_counts[cat]
-            results += f"  {cat}: {avg:.2f}\n"
-            overall_total += total
-            overall_count += cat_counts[cat]
-        overall_avg = overall_total / overall_count if overall_count else 0
-        results += f"Общая оценка: {overall_avg:.2f}\n"
-    return results
+    def _append(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _compact(self):
+        # Новый журнал из оставшихся операций заменяет старый атомарно
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for entry in self._pending.values():
+                f.write(json.dumps(entry._asdict(), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._marks = 0
+
+    def submit(self, op, *args):
+        """Ставит операцию в очередь и возвращает её ключ. ValueError - если аргументы неверны"""
+        check, _ = WRITE_OPERATIONS[op]
+        entry = JournalEntry(str(uuid.uuid4()), op, check(*args), time.time())
+        with self._cond:
+            self._append(entry._asdict())
+            self._pending[entry.key] = entry
+        self._wake.set()
+        return entry.key
+
+    def drain_failed(self):
+        # [(JournalEntry, текст ошибки), ...] - операции, которые записать не удалось
+        failed = []
+        while True:
+            try:
+                failed.append(self._failed.get_nowait())
+            except queue.Empty:
+                return failed
+
+    def stats(self):
+        latencies = sorted(self.flush_latencies)
+        return WriteStats(self.depth, self.written, self.batches, self.retries, self.failed,
+                          latencies[len(latencies) // 2] * 1000 if latencies else None,
+                          latencies[-1] * 1000 if latencies else None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="db-write", daemon=True)
+        self._thread.start()
+        self._wake.set()
+        return self
+
+    def flush(self, timeout=None):
+        """Ждёт, пока очередь опустеет; False, если за timeout секунд не успела"""
+        self._wake.set()
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def stop(self, timeout=5.0):
+        # Даём дописать очередь; то, что не успело, останется в журнале до следующего запуска
+        if self._thread is not None:
+            self.flush(timeout)
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout)
+        with self._cond:
+            self._file.close()
+        self._lock_file.close()
+
+    def _run(self):
+        delay = self.delay
+        conn = None
+        prune_at = 0
+        try:
+            while not self._stop.is_set():
+                self._wake.wait()
+                self._wake.clear()
+                # Короткая пауза собирает в одну пачку операции, поставленные подряд
+                if self.depth < self.batch_size:
+                    self._stop.wait(self.interval)
+                while self._pending and not self._stop.is_set():
+                    try:
+                        if conn is None:
+                            conn = psycopg2.connect(cursor_factory=InstrumentedCursor, **self.params)
+                            init_db(conn)
+                        if time.monotonic() >= prune_at:
+                            prune_applied_writes(conn)
+                            prune_at = time.monotonic() + WRITE_PRUNE_INTERVAL
+                        self._write_batch(conn)
+                    except Exception as e:
+                        # Журнал цел: пачка будет отправлена снова, уже записанное отсеют ключи
+                        logger.warning("Отложенная запись не удалась, повтор через %.1f с: %s", delay, e)
+                        if conn is not None:
+                            conn.close()
+                            conn = None
+                        self.status, self.error = "retrying", e
+                        self.retries += 1
+                        self._stop.wait(delay)
+                        delay = min(delay * 2, self.max_delay)
+                    else:
+                        delay = self.delay
+                        self.status, self.error = "ready", None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _write_batch(self, conn):
+        with self._cond:
+            batch = list(islice(self._pending.values(), self.batch_size))
+        # Ключ такой операции мог быть уже удалён: повтор записал бы её второй раз
+        horizon = time.time() - WRITE_REPLAY_HORIZON.total_seconds()
+        expired = [entry.key for entry in batch if entry.at is not None and entry.at < horizon]
+        if expired:
+            logger.error("Операций старше горизонта повтора: %d, не записаны", len(expired))
+            self._settle(expired, f"Операция пролежала в журнале дольше {WRITE_REPLAY_HORIZON.days} дн.")
+            batch = [entry for entry in batch if entry.at is None or entry.at >= horizon]
+            if not batch:
+                return
+        start = time.perf_counter()
+        try:
+            results = apply_write_batch(conn, batch)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except Exception:
+            # Ошибка в данных одной из операций: пишем пачку по одной, чтобы отсеять только её
+            results = {}
+            for entry in batch:
+                try:
+                    results.update(apply_write_batch(conn, [entry]))
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    raise
+                except Exception as e:
+                    logger.error("Операция %s %s не записана: %s", entry.op, entry.args, e)
+                    self._settle([entry.key], e)
+        self.flush_latencies.append(time.perf_counter() - start)
+        self.batches += 1
+        for entry in batch:
+            if entry.op in WRITE_DUPLICATE_ERRORS and entry.key in results and results[entry.key] is None:
+                del results[entry.key]
+                self._settle([entry.key], WRITE_DUPLICATE_ERRORS[entry.op])
+        self._settle(list(results))
+
+    def _settle(self, keys, error=None):
+        with self._cond:
+            for key in keys:
+                entry = self._pending.pop(key, None)
+                if entry is not None and error is not None:
+                    self._failed.put((entry, str(error)))
+            if error is None:
+                self.written += len(keys)
+            else:
+                self.failed += len(keys)
+            if not self._file.closed:
+                if not self._pending or self._marks >= self.COMPACT_AFTER:
+                    self._compact()
+                else:
+                    self._append({"done": keys} if error is None else {"failed": keys, "error": str(error)})
+                    self._marks += 1
+            self._cond.notify_all()
 
 
 # Графический интерфейс на основе Tkinter
 
 class App(tk.Tk):
-    def __init__(self, conn):
+    POLL_INTERVAL_MS = 50
+    # Поиск сотрудника: пауза после ввода перед запросом и число строк в выдаче
+    SEARCH_DEBOUNCE_MS = 250
+    SEARCH_LIMIT = 20
+
+    def __init__(self, db, listener=None, writes=None):
         super().__init__()
-        self.conn = conn
+        self.db = db
+        # Очередь отложенной записи (WriteBehind); без неё окна пишут в базу сразу
+        self.writes = writes
+        # Изменения от других клиентов (ChangeListener) раздаются открытым окнам через subscribe()
+        self.listener = listener
+        self._subscribers = []
+        self.employee_search = PrefixCache()
+        self.subscribe(self, ("employees",), lambda changes: self.employee_search.clear())
+        # Матрица оценок для аналитики: загружается при первом открытии окна, дальше в ней перечитываются
+        # опросы из уведомлений об изменениях. Матрица не меняется на месте - готовая новая подменяет старую.
+        # score_matrix_changes - id изменённых с тех пор опросов, None - перечитать всё
+        self.score_matrix = None
+        self.score_matrix_lock = threading.Lock()
+        self.score_matrix_changes = None
+        self.subscribe(self, ("surveys", "survey_scores"), self._score_matrix_changed)
         self.title("Оценка компетенций сотрудников")
-        self.geometry("400x300")
+        self.geometry("400x400")
 
         # Основное меню
         btn_add_employee = tk.Button(self, text="Добавить сотрудника", command=self.open_add_employee)
@@ -182,9 +2876,161 @@ class App(tk.Tk):
                                           command=self.open_manage_categories)
         btn_manage_categories.pack(pady=10)
 
+        btn_analytics = tk.Button(self, text="Аналитика по периодам", command=self.open_analytics)
+        btn_analytics.pack(pady=10)
+
+        btn_diagnostics = tk.Button(self, text="Диагностика запросов", command=self.open_diagnostics)
+        btn_diagnostics.pack(pady=10)
+
         btn_exit = tk.Button(self, text="Выход", command=self.quit)
         btn_exit.pack(pady=10)
 
+        # Строка состояния подключения (пул создаётся в фоне, см. DeferredPool)
+        self.status_frame = tk.Frame(self)
+        self.status_label = tk.Label(self.status_frame, fg="gray", wraplength=300, justify="left")
+        self.status_label.pack(side="left")
+        self.btn_reconnect = tk.Button(self.status_frame, text="Повторить", command=lambda: self.db.pool.retry())
+        self._connection_state = None
+        self.write_status_label = tk.Label(self, fg="gray", wraplength=300, justify="left")
+        self._write_state = None
+
+        self._poll_db()
+
+    def _poll_db(self):
+        self.db.process_completed()
+        self._show_connection_status()
+        if self.writes is not None:
+            self._show_write_status()
+        if self.listener is not None:
+            changes = self.listener.drain()
+            if changes:
+                self._dispatch_changes(changes)
+        self.after(self.POLL_INTERVAL_MS, self._poll_db)
+
+    def _score_matrix_changed(self, changes):
+        for change in changes:
+            if change.ids is None:
+                self.score_matrix_changes = None
+            elif self.score_matrix_changes is not None:
+                self.score_matrix_changes.update(change.ids)
+
+    def subscribe(self, win, tables, callback):
+        """callback(changes) вызывается при изменении таблиц tables, пока окно win открыто"""
+        self._subscribers.append((win, set(tables), callback))
+
+    def _dispatch_changes(self, changes):
+        # Сначала обновляется кэш каталога, затем окна - чтобы они читали уже свежий кэш
+        catalog_changes = [change for change in changes if change.table in ("categories", "competencies", None)]
+        if not catalog_changes:
+            self._notify_subscribers(changes)
+            return
+
+        def apply(storage):
+            catalog_cache.apply_changes(storage.conn, catalog_changes)
+
+        def failed(error):
+            catalog_cache.invalidate()
+            self._notify_subscribers(changes)
+
+        self.db.submit(apply, on_success=lambda _: self._notify_subscribers(changes), on_error=failed)
+
+    def _notify_subscribers(self, changes):
+        self._subscribers = [entry for entry in self._subscribers if entry[0].winfo_exists()]
+        for win, tables, callback in list(self._subscribers):
+            relevant = [change for change in changes if change.table is None or change.table in tables]
+            if relevant:
+                callback(relevant)
+
+    def _show_connection_status(self):
+        pool = self.db.pool
+        state = (getattr(pool, "status", "ready"), getattr(pool, "attempt", 0))
+        if state == self._connection_state:
+            return
+        self._connection_state = state
+        status, attempt = state
+        if status == "ready":
+            self.status_frame.pack_forget()
+            return
+        if status == "connecting":
+            text = "Подключение к базе данных..." + (f" (попытка {attempt})" if attempt > 1 else "")
+            self.btn_reconnect.pack_forget()
+        else:
+            text = f"Нет подключения к базе данных: {pool.error}"
+            self.btn_reconnect.pack(side="left", padx=5)
+        self.status_label.config(text=text, fg="gray" if status == "connecting" else "red")
+        self.status_frame.pack(side="bottom", fill="x", padx=10, pady=5)
+
+    def _show_write_status(self):
+        for entry, error in self.writes.drain_failed():
+            messagebox.showerror("Ошибка", f"Не удалось записать в базу ({entry.op}, {entry.args}): {error}")
+        state = (self.writes.depth, self.writes.status)
+        if state == self._write_state:
+            return
+        self._write_state = state
+        depth, status = state
+        if not depth:
+            self.write_status_label.pack_forget()
+            return
+        text = f"Ожидают записи в базу: {depth}"
+        if status == "retrying":
+            text += f" (нет подключения: {self.writes.error})"
+        self.write_status_label.config(text=text, fg="red" if status == "retrying" else "gray")
+        self.write_status_label.pack(side="bottom", fill="x", padx=10)
+
+    def write(self, win, op, *args, on_success=None):
+        """Запись из окна win: через очередь отложенной записи, если она есть, иначе сразу в базу (run_db).
+        on_success получает id новой строки, а при отложенной записи - ключ операции в журнале"""
+        if self.writes is None:
+            return self.run_db(win, op, *args, on_success=on_success)
+        try:
+            key = self.writes.submit(op, *args)
+        except (ValueError, OSError) as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить: {e}", parent=win)
+            return
+        if on_success:
+            on_success(key)
+
+    def run_db(self, win, func, *args, on_success=None, on_error=None, loading=True):
+        """Запускает запрос в фоне; при закрытии окна win запрос отменяется.
+        func - имя метода хранилища (Storage) или функция, принимающая хранилище"""
+        if isinstance(func, str):
+            func = methodcaller(func, *args)
+            args = ()
+        indicator = None
+        if loading:
+            indicator = tk.Label(win, text="Загрузка...", fg="gray")
+            indicator.pack(side="bottom", pady=2)
+
+        def finish():
+            if indicator is not None and indicator.winfo_exists():
+                indicator.destroy()
+
+        def success(result):
+            finish()
+            if on_success:
+                on_success(result)
+
+        def error(e):
+            finish()
+            if on_error:
+                on_error(e)
+            else:
+                messagebox.showerror("Ошибка", f"Ошибка базы данных: {e}", parent=win)
+
+        task = self.db.submit(func, *args, on_success=success, on_error=error)
+        if not hasattr(win, "db_tasks"):
+            win.db_tasks = []
+
+            def cancel_tasks(event):
+                # <Destroy> приходит и от дочерних виджетов, реагируем только на само окно
+                if event.widget is win:
+                    for t in win.db_tasks:
+                        t.cancel()
+
+            win.bind("<Destroy>", cancel_tasks, add="+")
+        win.db_tasks = [t for t in win.db_tasks if not t.future.done()] + [task]
+        return task
+
     def open_add_employee(self):
         win = tk.Toplevel(self)
         win.title("Добавить сотрудника")
@@ -192,12 +3038,15 @@ class App(tk.Tk):
         entry_name = tk.Entry(win)
         entry_name.pack(pady=5)
 
+        def added(emp_id):
+            self.employee_search.clear()
+            messagebox.showinfo("Успех", "Сотрудник добавлен.")
+            win.destroy()
+
         def add_emp():
             name = entry_name.get().strip()
             if name:
-                add_employee(self.conn, name)
-                messagebox.showinfo("Успех", "Сотрудник добавлен.")
-                win.destroy()
+                self.write(win, "add_employee", name, on_success=added)
             else:
                 messagebox.showerror("Ошибка", "Имя не может быть пустым.")
 
@@ -206,85 +3055,299 @@ class App(tk.Tk):
     def open_conduct_survey(self):
         win = tk.Toplevel(self)
         win.title("Провести опрос")
-        # Выбор сотрудника
-        tk.Label(win, text="Выберите сотрудника:").pack(pady=5)
-        employees = get_employees(self.conn)
-        if not employees:
-            messagebox.showerror("Ошибка", "Нет сотрудников. Сначала добавьте сотрудника.")
-            win.destroy()
-            return
-        emp_names = [f"{emp[1]} (ID: {emp[0]})" for emp in employees]
-        emp_ids = [emp[0] for emp in employees]
-        selected_emp = tk.StringVar()
-        combo_emp = ttk.Combobox(win, textvariable=selected_emp, values=emp_names, state="readonly")
-        combo_emp.pack(pady=5)
-        combo_emp.current(0)
-
-        # Ввод года и выбор квартала
-        tk.Label(win, text="Введите год опроса (например, 2025):").pack(pady=5)
-        entry_year = tk.Entry(win)
-        entry_year.pack(pady=5)
-
-        tk.Label(win, text="Выберите квартал:").pack(pady=5)
-        quarter_var = tk.StringVar()
-        quarter_combo = ttk.Combobox(win, textvariable=quarter_var, values=["Q1", "Q2", "Q3", "Q4"], state="readonly")
-        quarter_combo.pack(pady=5)
-        quarter_combo.current(0)
-
-        # Фрейм для ввода оценок
-        frame_scores = tk.Frame(win)
-        frame_scores.pack(pady=10, fill="both", expand=True)
-
-        # Получаем категории и компетенции
-        categories = get_categories(self.conn)
-        self.score_entries = {}  # {id компетенции: виджет Entry}
-        for cat in categories:
-            competencies = get_competencies_by_category(self.conn, cat[0])
-            if competencies:
-                lbl_cat = tk.Label(frame_scores, text=f"Категория: {cat[1]}", font=("Arial", 10, "bold"))
-                lbl_cat.pack(anchor="w", pady=(5, 0))
-                for comp in competencies:
-                    frame_comp = tk.Frame(frame_scores)
-                    frame_comp.pack(anchor="w", pady=2, fill="x")
-                    tk.Label(frame_comp, text=f"{comp[1]}:").pack(side="left")
-                    entry_score = tk.Entry(frame_comp, width=5)
-                    entry_score.pack(side="left", padx=5)
-                    self.score_entries[comp[0]] = entry_score
-
-        def submit_survey():
-            year = entry_year.get().strip()
-            if not (year.isdigit() and len(year) == 4):
-                messagebox.showerror("Ошибка", "Введите корректный год (4 цифры).")
+
+        def load(storage):
+            return storage.search_employees("", self.SEARCH_LIMIT), storage.get_catalog()
+
+        self.run_db(win, load, on_success=lambda data: build_form(*data))
+
+        def build_form(employees, categories):
+            if not employees:
+                messagebox.showerror("Ошибка", "Нет сотрудников. Сначала добавьте сотрудника.")
+                win.destroy()
                 return
-            period = f"{year}-{quarter_var.get().strip()}"
-            emp_index = combo_emp.current()
-            employee_id = emp_ids[emp_index]
-            survey_id = add_survey(self.conn, employee_id, period)
-            # Сохраняем оценки
-            for comp_id, entry in self.score_entries.items():
+            self.employee_search.put("", self.SEARCH_LIMIT, employees)
+
+            # Выбор сотрудника: поиск по началу имени, запрос уходит после паузы во вводе
+            tk.Label(win, text="Сотрудник (начните вводить имя):").pack(pady=5)
+            entry_emp = tk.Entry(win, width=40)
+            entry_emp.pack(pady=5)
+            list_emp = tk.Listbox(win, width=40, height=6, exportselection=False)
+            list_emp.pack(pady=5)
+            lbl_emp = tk.Label(win, text="Сотрудник не выбран", fg="gray")
+            lbl_emp.pack()
+            search = {"rows": [], "after": None, "employee_id": None}
+
+            def show_matches(rows):
+                search["rows"] = rows
+                list_emp.delete(0, tk.END)
+                for emp_id, name in rows:
+                    list_emp.insert(tk.END, f"{name} (ID: {emp_id})")
+
+            def run_search():
+                search["after"] = None
+                prefix = entry_emp.get()
+                cached = self.employee_search.get(prefix, self.SEARCH_LIMIT)
+                if cached is not None:
+                    show_matches(cached)
+                    return
+
+                def found(rows):
+                    self.employee_search.put(prefix, self.SEARCH_LIMIT, rows)
+                    # Ответ на устаревший запрос не показываем
+                    if entry_emp.get() == prefix:
+                        show_matches(rows)
+
+                self.run_db(win, "search_employees", prefix, self.SEARCH_LIMIT, on_success=found, loading=False)
+
+            def typed(event):
+                if search["after"] is not None:
+                    win.after_cancel(search["after"])
+                search["after"] = win.after(self.SEARCH_DEBOUNCE_MS, run_search)
+
+            def choose(event):
+                selection = list_emp.curselection()
+                if selection:
+                    emp_id, name = search["rows"][selection[0]]
+                    search["employee_id"] = emp_id
+                    lbl_emp.config(text=f"Выбран: {name} (ID: {emp_id})", fg="black")
+
+            entry_emp.bind("<KeyRelease>", typed)
+            list_emp.bind("<<ListboxSelect>>", choose)
+            show_matches(employees)
+
+            # Ввод года и выбор квартала
+            tk.Label(win, text="Введите год опроса (например, 2025):").pack(pady=5)
+            entry_year = tk.Entry(win)
+            entry_year.pack(pady=5)
+
+            tk.Label(win, text="Выберите квартал:").pack(pady=5)
+            quarter_var = tk.StringVar()
+            quarter_combo = ttk.Combobox(win, textvariable=quarter_var, values=["Q1", "Q2", "Q3", "Q4"],
+                                         state="readonly")
+            quarter_combo.pack(pady=5)
+            quarter_combo.current(0)
+
+            # Фрейм для ввода оценок
+            frame_scores = tk.Frame(win)
+            frame_scores.pack(pady=10, fill="both", expand=True)
+
+            score_entries = {}  # {id компетенции: виджет Entry}
+            for cat, competencies in categories:
+                if competencies:
+                    lbl_cat = tk.Label(frame_scores, text=f"Категория: {cat[1]}", font=("Arial", 10, "bold"))
+                    lbl_cat.pack(anchor="w", pady=(5, 0))
+                    for comp in competencies:
+                        frame_comp = tk.Frame(frame_scores)
+                        frame_comp.pack(anchor="w", pady=2, fill="x")
+                        tk.Label(frame_comp, text=f"{comp[1]}:").pack(side="left")
+                        entry_score = tk.Entry(frame_comp, width=5)
+                        entry_score.pack(side="left", padx=5)
+                        score_entries[comp[0]] = entry_score
+
+            def submitted(survey_id):
+                messagebox.showinfo("Успех", "Опрос проведён.")
+                win.destroy()
+
+            def submit():
+                year = entry_year.get().strip()
+                if not (year.isdigit() and len(year) == 4):
+                    messagebox.showerror("Ошибка", "Введите корректный год (4 цифры).")
+                    return
+                period = f"{year}-{quarter_var.get().strip()}"
+                employee_id = search["employee_id"]
+                if employee_id is None:
+                    messagebox.showerror("Ошибка", "Выберите сотрудника из списка.")
+                    return
+                # Проверяем оценки до отправки, сохраняем опрос одной транзакцией
+                scores = {comp_id: entry.get().strip() for comp_id, entry in score_entries.items()}
                 try:
-                    score = float(entry.get().strip())
-                    if 1 <= score <= 5:
-                        add_survey_score(self.conn, survey_id, comp_id, score)
-                    else:
-                        messagebox.showerror("Ошибка", "Оценка должна быть от 1 до 5.")
-                        return
-                except ValueError:
-                    messagebox.showerror("Ошибка", "Введите числовое значение для оценки.")
+                    validate_scores(scores)
+                except ValueError as e:
+                    messagebox.showerror("Ошибка", str(e))
                     return
-            messagebox.showinfo("Успех", "Опрос проведён.")
-            win.destroy()
+                self.write(win, "submit_survey", employee_id, period, scores, on_success=submitted)
 
-        tk.Button(win, text="Провести опрос", command=submit_survey).pack(pady=10)
+            tk.Button(win, text="Провести опрос", command=submit).pack(pady=10)
 
     def open_show_results(self):
         win = tk.Toplevel(self)
         win.title("Результаты опросов")
-        text = tk.Text(win, wrap="word", width=80, height=20)
+        page_size = 50
+
+        # Фильтры и сортировка выполняются базой данных
+        frame_filter = tk.Frame(win)
+        frame_filter.pack(padx=10, pady=5, fill="x")
+        tk.Label(frame_filter, text="Сотрудник:").pack(side="left")
+        entry_employee = tk.Entry(frame_filter, width=20)
+        entry_employee.pack(side="left", padx=5)
+        # Один квартал (2025-Q1) или диапазон включительно (2023-Q2:2025-Q1)
+        tk.Label(frame_filter, text="Период:").pack(side="left")
+        entry_period = tk.Entry(frame_filter, width=17)
+        entry_period.pack(side="left", padx=5)
+
+        columns = {"id": "ID", "employee": "Сотрудник", "period": "Период", "overall": "Общая оценка"}
+        tree = ttk.Treeview(win, columns=list(columns), show="headings", height=15)
+        for column, title in columns.items():
+            tree.heading(column, text=title)
+            tree.column(column, width=60 if column in ("id", "overall") else 160)
+        tree.pack(padx=10, fill="both", expand=True)
+
+        frame_nav = tk.Frame(win)
+        frame_nav.pack(pady=5)
+        btn_prev = tk.Button(frame_nav, text="< Назад")
+        btn_prev.pack(side="left", padx=5)
+        lbl_page = tk.Label(frame_nav)
+        lbl_page.pack(side="left", padx=5)
+        btn_next = tk.Button(frame_nav, text="Вперёд >")
+        btn_next.pack(side="left", padx=5)
+
+        text = tk.Text(win, wrap="word", width=80, height=10, state="disabled")
         text.pack(padx=10, pady=10)
-        results = get_survey_results(self.conn)
-        text.insert("1.0", results)
-        text.config(state="disabled")
+
+        # starts - ключи начала просмотренных страниц; в памяти только текущая и следующая страницы
+        state = {"sort": "id", "employee": None, "period": None, "starts": [None], "rows": [],
+                 "prefetch": {}, "generation": 0, "detail": None}
+
+        def fetch(after, on_success, loading=True):
+            generation = state["generation"]
+
+            def done(rows):
+                if generation == state["generation"]:
+                    on_success(rows)
+
+            self.run_db(win, "get_survey_page", state["sort"], after, page_size, state["employee"],
+                        state["period"], on_success=done, loading=loading)
+
+        def values(row):
+            overall = f"{row.overall:.2f}" if row.overall is not None else ""
+            return row.survey_id, row.employee_name, row.period, overall
+
+        def show(rows, prefetch=True):
+            # Строки обновляются на месте, чтобы изменения из уведомлений не сбрасывали выделение
+            state["rows"] = rows
+            keep = {str(row.survey_id) for row in rows}
+            stale = [iid for iid in tree.get_children() if iid not in keep]
+            if stale:
+                tree.delete(*stale)
+            for index, row in enumerate(rows):
+                iid = str(row.survey_id)
+                if tree.exists(iid):
+                    tree.item(iid, values=values(row))
+                    tree.move(iid, "", index)
+                else:
+                    tree.insert("", index, iid=iid, values=values(row))
+            lbl_page.config(text=f"Страница {len(state['starts'])}")
+            btn_prev.config(state="normal" if len(state["starts"]) > 1 else "disabled")
+            btn_next.config(state="normal" if len(rows) == page_size else "disabled")
+            state["prefetch"] = {}
+            if prefetch and len(rows) == page_size:
+                after = survey_page_key(rows[-1], state["sort"])
+                fetch(after, lambda next_rows: state["prefetch"].update({after: next_rows}), loading=False)
+
+        def load_page(after):
+            if after in state["prefetch"]:
+                show(state["prefetch"].pop(after))
+            else:
+                fetch(after, show)
+
+        def next_page():
+            after = survey_page_key(state["rows"][-1], state["sort"])
+            state["starts"].append(after)
+            load_page(after)
+
+        def prev_page():
+            state["starts"].pop()
+            load_page(state["starts"][-1])
+
+        def reload(sort=None):
+            try:
+                period = parse_period_filter(entry_period.get()) if entry_period.get().strip() else None
+            except ValueError as e:
+                messagebox.showerror("Ошибка", str(e), parent=win)
+                return
+            state["generation"] += 1
+            state["sort"] = sort or state["sort"]
+            state["employee"] = entry_employee.get().strip() or None
+            state["period"] = period
+            state["starts"] = [None]
+            state["prefetch"] = {}
+            load_page(None)
+
+        def render_details(results):
+            text.config(state="normal")
+            text.delete("1.0", tk.END)
+            text.insert("1.0", results)
+            text.config(state="disabled")
+
+        def show_details(event):
+            selection = tree.selection()
+            if not selection:
+                return
+            state["detail"] = int(selection[0])
+            self.run_db(win, "get_survey_results", None, None, None, state["detail"], on_success=render_details)
+
+        # Изменения от других клиентов: перечитываются только затронутые опросы текущей страницы
+
+        def merge(fetched, survey_ids):
+            sort = state["sort"]
+            rows = state["rows"]
+            start = state["starts"][-1]
+            full = len(rows) == page_size
+            end = survey_page_key(rows[-1], sort) if full else None
+
+            def on_page(row):
+                key = survey_page_key(row, sort)
+                return (start is None or key > start) and (end is None or key < end)
+
+            merged = [row for row in rows if row.survey_id not in survey_ids]
+            merged += [row for row in fetched if on_page(row)]
+            merged.sort(key=lambda row: survey_page_key(row, sort))
+            if full and len(merged) < page_size:
+                # Строки ушли со страницы, добираем её из базы
+                load_page(start)
+            else:
+                show(merged[:page_size], prefetch=False)
+
+        def apply_changes(changes):
+            if any(change.ids is None or (change.table == "employees" and change.op == "UPDATE")
+                   for change in changes):
+                # Неизвестно, какие строки затронуты (импорт, переименование сотрудника)
+                load_page(state["starts"][-1])
+                changed = None
+            else:
+                removed = {i for change in changes if change.table == "surveys" and change.op == "DELETE"
+                           for i in change.ids}
+                changed = {i for change in changes if change.table in ("surveys", "survey_scores")
+                           for i in change.ids} - removed
+                if removed:
+                    merge([], removed)
+                if changed:
+                    generation = state["generation"]
+
+                    def fetched(rows, survey_ids=changed):
+                        if generation == state["generation"]:
+                            merge(rows, survey_ids)
+
+                    self.run_db(win, "get_survey_page", state["sort"], None, len(changed), state["employee"],
+                                state["period"], list(changed), on_success=fetched, loading=False)
+                if state["detail"] in removed:
+                    state["detail"] = None
+                    render_details("")
+                if any(change.table in ("categories", "competencies") for change in changes):
+                    changed = None
+            if state["detail"] is not None and (changed is None or state["detail"] in changed):
+                self.run_db(win, "get_survey_results", None, None, None, state["detail"],
+                            on_success=render_details, loading=False)
+
+        for column in ("id", "employee", "period"):
+            tree.heading(column, command=lambda column=column: reload(column))
+        tree.bind("<<TreeviewSelect>>", show_details)
+        btn_prev.config(command=prev_page)
+        btn_next.config(command=next_page)
+        tk.Button(frame_filter, text="Применить", command=reload).pack(side="left", padx=5)
+        reload()
+        self.subscribe(win, ("employees", "categories", "competencies", "surveys", "survey_scores"), apply_changes)
 
     def open_manage_categories(self):
         win = tk.Toplevel(self)
@@ -293,22 +3356,29 @@ class App(tk.Tk):
         text = tk.Text(win, wrap="word", width=60, height=15)
         text.pack(padx=10, pady=10)
 
-        def refresh_data():
+        # Показанный каталог: по нему проверяются имена до отложенной записи, которая повтор не сообщает
+        shown = {"catalog": []}
+
+        def show(catalog):
+            shown["catalog"] = catalog
             text.delete("1.0", tk.END)
-            cats = get_categories(self.conn)
-            if not cats:
+            if not catalog:
                 text.insert(tk.END, "Нет категорий.\n")
             else:
-                for cat in cats:
+                for cat, comps in catalog:
                     text.insert(tk.END, f"Категория: {cat[1]} (ID: {cat[0]})\n")
-                    comps = get_competencies_by_category(self.conn, cat[0])
                     if comps:
                         for comp in comps:
                             text.insert(tk.END, f"    - {comp[1]} (ID: {comp[0]})\n")
                     else:
                         text.insert(tk.END, "    (нет компетенций)\n")
 
+        def refresh_data():
+            self.run_db(win, "get_catalog", on_success=show)
+
         refresh_data()
+        # Каталог читается из кэша, который к этому моменту уже обновлён (см. _dispatch_changes)
+        self.subscribe(win, ("categories", "competencies"), lambda changes: refresh_data())
 
         def add_cat():
             win_cat = tk.Toplevel(win)
@@ -317,15 +3387,20 @@ class App(tk.Tk):
             entry_cat = tk.Entry(win_cat)
             entry_cat.pack(pady=5)
 
+            def added(cat_id):
+                if cat_id:
+                    messagebox.showinfo("Успех", "Категория добавлена.")
+                    win_cat.destroy()
+                    refresh_data()
+                else:
+                    messagebox.showerror("Ошибка", "Категория с таким именем уже существует.")
+
             def submit_cat():
                 name = entry_cat.get().strip()
-                if name:
-                    if add_category(self.conn, name):
-                        messagebox.showinfo("Успех", "Категория добавлена.")
-                        win_cat.destroy()
-                        refresh_data()
-                    else:
-                        messagebox.showerror("Ошибка", "Категория с таким именем уже существует.")
+                if any(cat[1] == name for cat, _ in shown["catalog"]):
+                    added(None)
+                elif name:
+                    self.write(win_cat, "add_category", name, on_success=added)
                 else:
                     messagebox.showerror("Ошибка", "Название не может быть пустым.")
 
@@ -334,62 +3409,515 @@ class App(tk.Tk):
         def add_comp():
             win_comp = tk.Toplevel(win)
             win_comp.title("Добавить компетенцию")
-            tk.Label(win_comp, text="Выберите категорию:").pack(pady=5)
-            cats = get_categories(self.conn)
-            if not cats:
-                messagebox.showerror("Ошибка", "Сначала добавьте категорию.")
-                win_comp.destroy()
-                return
-            cat_names = [f"{cat[1]} (ID: {cat[0]})" for cat in cats]
-            selected_cat = tk.StringVar()
-            combo_cat = ttk.Combobox(win_comp, textvariable=selected_cat, values=cat_names, state="readonly")
-            combo_cat.pack(pady=5)
-            combo_cat.current(0)
-            tk.Label(win_comp, text="Название компетенции:").pack(pady=5)
-            entry_comp = tk.Entry(win_comp)
-            entry_comp.pack(pady=5)
-
-            def submit_comp():
-                name = entry_comp.get().strip()
-                if name:
-                    cat_index = combo_cat.current()
-                    category_id = cats[cat_index][0]
-                    if add_competency(self.conn, name, category_id):
+            self.run_db(win_comp, "get_catalog", on_success=lambda catalog: build_form(catalog))
+
+            def build_form(catalog):
+                cats = [cat for cat, _ in catalog]
+                if not cats:
+                    messagebox.showerror("Ошибка", "Сначала добавьте категорию.")
+                    win_comp.destroy()
+                    return
+                tk.Label(win_comp, text="Выберите категорию:").pack(pady=5)
+                cat_names = [f"{cat[1]} (ID: {cat[0]})" for cat in cats]
+                selected_cat = tk.StringVar()
+                combo_cat = ttk.Combobox(win_comp, textvariable=selected_cat, values=cat_names, state="readonly")
+                combo_cat.pack(pady=5)
+                combo_cat.current(0)
+                tk.Label(win_comp, text="Название компетенции:").pack(pady=5)
+                entry_comp = tk.Entry(win_comp)
+                entry_comp.pack(pady=5)
+
+                def added(comp_id):
+                    if comp_id:
                         messagebox.showinfo("Успех", "Компетенция добавлена.")
                         win_comp.destroy()
                         refresh_data()
                     else:
                         messagebox.showerror("Ошибка", "Компетенция с таким именем уже существует в этой категории.")
-                else:
-                    messagebox.showerror("Ошибка", "Название не может быть пустым.")
 
-            tk.Button(win_comp, text="Добавить", command=submit_comp).pack(pady=10)
+                def submit_comp():
+                    name = entry_comp.get().strip()
+                    cat_index = combo_cat.current()
+                    if any(comp[1] == name for comp in catalog[cat_index][1]):
+                        added(None)
+                    elif name:
+                        category_id = cats[cat_index][0]
+                        self.write(win_comp, "add_competency", name, category_id, on_success=added)
+                    else:
+                        messagebox.showerror("Ошибка", "Название не может быть пустым.")
+
+                tk.Button(win_comp, text="Добавить", command=submit_comp).pack(pady=10)
 
         btn_frame = tk.Frame(win)
         btn_frame.pack(pady=10)
         tk.Button(btn_frame, text="Добавить категорию", command=add_cat).pack(side="left", padx=5)
         tk.Button(btn_frame, text="Добавить компетенцию", command=add_comp).pack(side="left", padx=5)
 
+    def open_analytics(self):
+        try:
+            import analytics
+        except ImportError:
+            messagebox.showerror("Ошибка", "Для аналитики нужен пакет numpy (pip install numpy).")
+            return
+
+        win = tk.Toplevel(self)
+        win.title("Аналитика по периодам")
+
+        controls = tk.Frame(win)
+        controls.pack(fill="x", padx=10, pady=5)
+        tk.Label(controls, text="Категория:").pack(side="left")
+        category_var = tk.StringVar(value="Все")
+        category_box = ttk.Combobox(controls, textvariable=category_var, state="readonly", width=20)
+        category_box.pack(side="left", padx=5)
+        tk.Label(controls, text="Период:").pack(side="left")
+        period_var = tk.StringVar(value="Все")
+        period_box = ttk.Combobox(controls, textvariable=period_var, state="readonly", width=10)
+        period_box.pack(side="left", padx=5)
+        tk.Label(controls, text="Цель:").pack(side="left")
+        target_var = tk.StringVar(value="4.0")
+        tk.Entry(controls, textvariable=target_var, width=5).pack(side="left", padx=5)
+
+        notebook = ttk.Notebook(win)
+        notebook.pack(fill="both", expand=True, padx=10, pady=5)
+
+        def make_tree(title, columns):
+            frame = tk.Frame(notebook)
+            notebook.add(frame, text=title)
+            tree = ttk.Treeview(frame, columns=list(columns), show="headings", height=15)
+            for column, heading in columns.items():
+                tree.heading(column, text=heading)
+                tree.column(column, width=110, anchor="w")
+            scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            tree.pack(side="left", fill="both", expand=True)
+            scrollbar.pack(side="right", fill="y")
+            return tree
+
+        trends_tree = make_tree("Динамика", {"employee": "Сотрудник", "period": "Период", "average": "Средняя",
+                                             "previous": "Предыдущая", "change": "Изменение"})
+        percentiles_tree = make_tree("Процентили", {"employee": "Сотрудник", "category": "Категория",
+                                                    "average": "Средняя", "percentile": "Процентиль"})
+        gaps_tree = make_tree("Разрывы", {"competency": "Компетенция", "category": "Категория",
+                                          "average": "Средняя", "gap": "Разрыв", "below": "Ниже цели, %"})
+        distribution_text = tk.Text(notebook, wrap="none", width=70, height=15)
+        notebook.add(distribution_text, text="Распределение")
+
+        names = {"employees": {}, "categories": {}, "competencies": {}}
+
+        def fmt(value):
+            return "" if value is None else f"{value:.2f}"
+
+        # Матрица, которую показывает окно: фоновая загрузка её не меняет, а подменяет
+        shown = {"matrix": None}
+
+        def load(storage, survey_ids):
+            with self.score_matrix_lock:
+                if self.score_matrix is None or survey_ids is None:
+                    self.score_matrix = analytics.ScoreMatrix.load(storage.conn)
+                else:
+                    self.score_matrix = self.score_matrix.refresh(storage.conn, survey_ids)
+                matrix = self.score_matrix
+            return matrix, storage.get_employees(), storage.get_catalog()
+
+        def reload():
+            # Изменения, пришедшие до этого момента, попадут в новую матрицу, следующие - в следующую.
+            # Без уведомлений (SQLite, разрыв соединения) изменённые опросы неизвестны, читаем всё
+            survey_ids, self.score_matrix_changes = self.score_matrix_changes, set()
+            if self.listener is None or not self.listener.connected.is_set():
+                survey_ids = None
+            self.run_db(win, load, survey_ids, on_success=loaded, on_error=load_failed)
+
+        def load_failed(error):
+            self.score_matrix_changes = None
+            messagebox.showerror("Ошибка", f"Ошибка базы данных: {error}", parent=win)
+
+        def loaded(data):
+            shown["matrix"], employees, catalog = data
+            names["employees"] = dict(employees)
+            names["categories"] = {cat_id: cat_name for (cat_id, cat_name), _ in catalog}
+            names["competencies"] = {comp_id: comp_name for _, comps in catalog for comp_id, comp_name in comps}
+            category_box["values"] = ["Все"] + [f"{cat_id}: {cat_name}" for cat_id, cat_name in
+                                                names["categories"].items()]
+            period_box["values"] = ["Все"] + shown["matrix"].periods
+            render()
+
+        def render():
+            category_id = None if category_var.get() == "Все" else int(category_var.get().split(":")[0])
+            period = None if period_var.get() == "Все" else period_var.get()
+            try:
+                target = float(target_var.get())
+            except ValueError:
+                messagebox.showerror("Ошибка", "Цель должна быть числом.", parent=win)
+                return
+            matrix = shown["matrix"]
+            if matrix is None:
+                return
+            employee = names["employees"].get
+            category = names["categories"].get
+
+            trends_tree.delete(*trends_tree.get_children())
+            for row in matrix.trends(category_id):
+                if period is None or row.period == period:
+                    trends_tree.insert("", tk.END, values=(employee(row.employee_id, row.employee_id), row.period,
+                                                           fmt(row.average), fmt(row.previous), fmt(row.change)))
+
+            percentiles_tree.delete(*percentiles_tree.get_children())
+            for row in sorted(matrix.percentile_ranks(period), key=lambda r: (r.category_id, -r.percentile)):
+                if category_id is None or row.category_id == category_id:
+                    percentiles_tree.insert("", tk.END, values=(employee(row.employee_id, row.employee_id),
+                                                                category(row.category_id, row.category_id),
+                                                                fmt(row.average), f"{row.percentile:.0f}"))
+
+            gaps_tree.delete(*gaps_tree.get_children())
+            for row in matrix.gap_analysis(target, period):
+                if category_id is None or row.category_id == category_id:
+                    competency = names["competencies"].get(row.competency_id, row.competency_id)
+                    gaps_tree.insert("", tk.END, values=(competency, category(row.category_id, row.category_id),
+                                                         fmt(row.average), fmt(row.gap), f"{row.below_target:.0%}"))
+
+            distribution = matrix.distribution(category_id, period)
+            distribution_text.delete("1.0", tk.END)
+            if not distribution.count:
+                distribution_text.insert(tk.END, "Нет оценок.\n")
+                return
+            distribution_text.insert(tk.END, f"Оценок: {distribution.count}\n"
+                                             f"Среднее: {distribution.mean:.2f}, отклонение: {distribution.std:.2f}\n"
+                                             f"Квартили: {', '.join(fmt(q) for q in distribution.quartiles)}\n\n")
+            widest = max(distribution.counts) or 1
+            for low, high, count in zip(distribution.bins, distribution.bins[1:], distribution.counts):
+                bar = "#" * round(40 * count / widest)
+                distribution_text.insert(tk.END, f"{(low + high) / 2:4.1f} | {bar} {count}\n")
+
+        category_box.bind("<<ComboboxSelected>>", lambda event: render())
+        period_box.bind("<<ComboboxSelected>>", lambda event: render())
+
+        btn_frame = tk.Frame(win)
+        btn_frame.pack(pady=5)
+        tk.Button(btn_frame, text="Применить", command=render).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Обновить данные", command=reload).pack(side="left", padx=5)
+        reload()
+
+    def open_diagnostics(self):
+        win = tk.Toplevel(self)
+        win.title("Диагностика запросов")
+
+        enabled = tk.BooleanVar(value=query_stats.enabled)
+
+        def toggle():
+            query_stats.enabled = enabled.get()
+
+        tk.Checkbutton(win, text="Собирать статистику", variable=enabled, command=toggle).pack(anchor="w", padx=10)
+
+        columns = {"function": "Функция", "calls": "Вызовы", "errors": "Ошибки", "queries": "Запросы",
+                   "rows": "Строки", "avg_ms": "Среднее, мс", "p95_ms": "p95, мс", "max_ms": "Макс., мс"}
+        tree = ttk.Treeview(win, columns=list(columns), show="headings", height=12)
+        for column, title in columns.items():
+            tree.heading(column, text=title)
+            tree.column(column, width=200 if column == "function" else 80, anchor="w" if column == "function" else "e")
+        tree.pack(padx=10, pady=5, fill="both", expand=True)
+
+        tk.Label(win, text="Медленные запросы:").pack(anchor="w", padx=10)
+        text = tk.Text(win, wrap="none", width=100, height=12, state="disabled")
+        text.pack(padx=10, pady=5, fill="both", expand=True)
+        label_writes = tk.Label(win, justify="left")
+        if self.writes is not None:
+            label_writes.pack(anchor="w", padx=10)
+
+        def refresh():
+            if self.writes is not None:
+                writes = self.writes.stats()
+                latency = (f"{writes.flush_p50_ms:.1f} / {writes.flush_max_ms:.1f} мс"
+                           if writes.flush_p50_ms is not None else "-")
+                label_writes.config(text=f"Отложенная запись: в очереди {writes.depth}, записано {writes.written}, "
+                                         f"пачек {writes.batches}, повторов {writes.retries}, ошибок {writes.failed}, "
+                                         f"пачка (медиана / макс.) {latency}")
+            stats = query_stats.snapshot()
+            tree.delete(*tree.get_children())
+            for name, entry in stats["functions"].items():
+                tree.insert("", tk.END, values=(name, entry["calls"], entry["errors"], entry["queries"], entry["rows"],
+                                                f"{entry['avg_ms']:.1f}", entry["p95_ms"], f"{entry['max_ms']:.1f}"))
+            text.config(state="normal")
+            text.delete("1.0", tk.END)
+            for slow in reversed(stats["slow_queries"]):
+                text.insert(tk.END, f"[{slow['at']}] {slow['function']}: {slow['ms']:.1f} мс, строк {slow['rows']}\n"
+                                    f"{slow['query']}\nПараметры: {slow['params']}\n{slow['plan'] or ''}\n\n")
+            text.config(state="disabled")
+
+        def auto_refresh():
+            if win.winfo_exists():
+                refresh()
+                win.after(1000, auto_refresh)
+
+        def reset():
+            query_stats.reset()
+            refresh()
+
+        def save():
+            path = filedialog.asksaveasfilename(parent=win, defaultextension=".json",
+                                                filetypes=[("JSON", "*.json")])
+            if path:
+                query_stats.dump(path)
+
+        btn_frame = tk.Frame(win)
+        btn_frame.pack(pady=5)
+        tk.Button(btn_frame, text="Сбросить", command=reset).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Сохранить JSON", command=save).pack(side="left", padx=5)
+        auto_refresh()
+
+
+# Параметры подключения к базе данных (по умолчанию; см. load_db_params)
+DB_PARAMS = dict(
+    host="localhost",
+    port=5432,
+    database="competencies",  # имя базы данных, указанное при запуске Docker-контейнера
+    user="user1",  # замените на ваше имя пользователя (POSTGRES_USER)
+    password="admin1",  # замените на ваш пароль (POSTGRES_PASSWORD)
+    connect_timeout=5  # секунд на одну попытку подключения
+)
+
+# Файл настроек подключения: JSON с ключами как в DB_PARAMS
+CONFIG_PATH = os.environ.get("KURS_CONFIG", os.path.join(os.path.expanduser("~"), ".config", "kurs", "db.json"))
+# Переменные окружения libpq, имеющие приоритет над файлом настроек
+DB_PARAMS_ENV = dict(host="PGHOST", port="PGPORT", database="PGDATABASE", user="PGUSER", password="PGPASSWORD",
+                     connect_timeout="PGCONNECT_TIMEOUT")
+
+
+def load_db_params(path=None, environ=None):
+    path = CONFIG_PATH if path is None else path
+    environ = os.environ if environ is None else environ
+    params = dict(DB_PARAMS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            params.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    params.update({key: environ[name] for key, name in DB_PARAMS_ENV.items() if environ.get(name)})
+    return params
+
+
+# Кэш проверенной версии схемы по базам; пустое значение отключает кэш
+SCHEMA_CACHE_PATH = os.environ.get("KURS_SCHEMA_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "kurs", "schema.json"))
+
+
+def init_db_cached(storage, path=None):
+    """init_db, который не обращается к серверу, если для этой базы в кэше уже записана SCHEMA_VERSION.
+    Возвращает True, если схема проверялась. Если базу пересоздали, кэш нужно удалить (или отключить)."""
+    path = SCHEMA_CACHE_PATH if path is None else path
+    key = storage.schema_cache_key()
+    cache = {}
+    if path and key:
+        try:
+            with open(path, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        if cache.get(key) == SCHEMA_VERSION:
+            return False
+    storage.init_db()
+    if path and key:
+        cache[key] = SCHEMA_VERSION
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning("Не удалось записать кэш схемы %s: %s", path, e)
+    return True
+
+
+# Журнал отложенной записи из интерфейса (WriteBehind); пустое значение - писать в базу сразу
+JOURNAL_PATH = os.environ.get("KURS_JOURNAL",
+                              os.path.join(os.path.expanduser("~"), ".local", "state", "kurs", "journal.jsonl"))
+
+# Хранилище: "postgresql" или "sqlite:<путь к файлу>" для работы без сервера
+STORAGE = os.environ.get("KURS_STORAGE", "postgresql")
+
 
 def main():
+    # Окно показывается сразу, подключение и проверка схемы идут в фоне
+    pool = DeferredPool(lambda: create_storage_pool(STORAGE), setup=init_db_cached).start()
+    db = DBExecutor(pool)
+    # Уведомления об изменениях есть только у PostgreSQL
+    listener = ChangeListener(load_db_params()).start() if STORAGE == "postgresql" else None
+    # Записи из окон идут через журнал на диске: интерфейс не ждёт базу и не теряет данные при разрыве
+    writes = None
+    if STORAGE == "postgresql" and JOURNAL_PATH:
+        try:
+            writes = WriteBehind(JOURNAL_PATH, load_db_params()).start()
+        except RuntimeError as e:
+            # Журнал занят вторым окном программы: это окно пишет в базу сразу
+            logger.warning("%s, запись без журнала", e)
+    app = App(db, listener, writes)
+    app.mainloop()
+    if listener is not None:
+        listener.stop()
+    if writes is not None:
+        writes.stop()
+    pool.cancel()
+    db.shutdown()
+
+
+# Командная строка без графического интерфейса
+
+def _open_with_progress(path, label):
+    return ProgressReader(open(path, "rb"), label, total=os.path.getsize(path))
+
+
+def cmd_import(conn, args):
+    # Порядок важен: оценки ссылаются на сотрудников и компетенции
+    if args.employees:
+        reader = _open_with_progress(args.employees, "Сотрудники")
+        with reader.file:
+            added = import_employees_csv(conn, reader)
+        print(f"Сотрудники: добавлено {added}")
+    if args.catalog:
+        reader = _open_with_progress(args.catalog, "Каталог")
+        with reader.file:
+            categories_added, competencies_added = import_catalog_csv(conn, reader)
+        print(f"Каталог: добавлено категорий {categories_added}, компетенций {competencies_added}")
+    if args.scores:
+        reader = _open_with_progress(args.scores, "Оценки")
+        with reader.file:
+            result = import_scores_csv(conn, reader, skip_invalid=args.skip_invalid)
+        print(f"Оценки: опросов {result.surveys}, оценок {result.scores}, пропущено строк {result.skipped}")
+
+
+def cmd_export(conn, args):
+    employee_id = resolve_employee(conn, args.employee) if args.employee else args.employee_id
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as out:
+            export_survey_data(conn, out, args.kind, args.format, employee_id, args.period)
+    else:
+        export_survey_data(conn, sys.stdout, args.kind, args.format, employee_id, args.period)
+
+
+def cmd_search(conn, args):
+    for emp_id, name in search_employees(conn, args.prefix, args.limit):
+        print(f"{emp_id}\t{name}")
+
+
+def cmd_periods(conn, args):
+    partitions = {partition.period: partition for partition in get_period_partitions(conn)}
+    for row in get_period_summary(conn, args.start, args.end):
+        partition = partitions.get(row.period)
+        average = f"{row.average:.2f}" if row.average is not None else "-"
+        size = f"{partition.size_bytes // 1024} КБ" if partition else "-"
+        print(f"{row.period}\tопросов: {row.surveys}\tсотрудников: {row.employees}\tсредняя: {average}\t"
+              f"оценки: {size}")
+
+
+def cmd_drop_period(conn, args):
+    deleted = drop_period(conn, args.period, args.archive)
+    archived = f" (перенесены в схему {ARCHIVE_SCHEMA})" if args.archive else ""
+    print(f"Удалено опросов за {args.period}: {deleted}{archived}")
+
+
+def cmd_reports(conn, args):
+    def progress(done, total):
+        print(f"\rОтчёты: {done} из {total}", end="", file=sys.stderr, flush=True)
+
+    result = generate_reports(conn, load_db_params(), args.out_dir, args.period, args.workers, args.chunk_size,
+                              args.format, progress)
+    if result.employees:
+        print(file=sys.stderr)
+    print(f"Отчётов: {result.employees}, опросов: {result.surveys}, время: {result.seconds:.1f} с")
+    for worker in result.workers:
+        rate = worker.employees / worker.seconds if worker.seconds else 0
+        print(f"  процесс {worker.pid}: порций {worker.chunks}, отчётов {worker.employees}, "
+              f"{rate:.0f} отчётов/с")
+
+
+def cmd_sync(conn, args):
+    storage = SQLiteStorage(args.sqlite)
     try:
-        conn = psycopg2.connect(
-            host="localhost",
-            port=5432,
-            database="competencies",  # имя базы данных, указанное при запуске Docker-контейнера
-            user="user1",  # замените на ваше имя пользователя (POSTGRES_USER)
-            password="admin1"  # замените на ваш пароль (POSTGRES_PASSWORD)
-        )
+        result = sync_offline_surveys(storage, conn)
+    finally:
+        storage.close()
+    print(f"Синхронизация: опросов {result.surveys}, оценок {result.scores}")
+
+
+def cli(argv=None):
+    # argparse нужен только командной строке, при запуске интерфейса не загружается
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Оценка компетенций сотрудников: работа без интерфейса")
+    parser.add_argument("--stats", metavar="FILE", help="собрать статистику запросов и записать её в JSON-файл")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_import = commands.add_parser("import", help="загрузить данные из CSV-файлов (UTF-8, с заголовком)")
+    parser_import.add_argument("--employees", help="CSV: name")
+    parser_import.add_argument("--catalog", help="CSV: category,competency")
+    parser_import.add_argument("--scores", help="CSV: employee,period,category,competency,score")
+    parser_import.add_argument("--skip-invalid", action="store_true",
+                               help="пропускать ошибочные строки оценок вместо отмены импорта")
+    parser_import.set_defaults(handler=cmd_import)
+
+    parser_export = commands.add_parser("export", help="выгрузить результаты опросов")
+    parser_export.add_argument("kind", choices=list(EXPORT_KINDS),
+                               help="scores - все оценки, averages - средние по категориям")
+    parser_export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    employee = parser_export.add_mutually_exclusive_group()
+    employee.add_argument("--employee-id", type=int)
+    employee.add_argument("--employee", help="имя сотрудника или его начало (должно подходить одному сотруднику)")
+    parser_export.add_argument("--period", type=parse_period_filter,
+                               help="квартал (2025-Q1) или диапазон включительно (2023-Q2:2025-Q1)")
+    parser_export.add_argument("--output", "-o", help="файл для записи (по умолчанию стандартный вывод)")
+    parser_export.set_defaults(handler=cmd_export)
+
+    parser_search = commands.add_parser("search", help="найти сотрудников по началу имени")
+    parser_search.add_argument("prefix", help="начало имени, без учёта регистра")
+    parser_search.add_argument("--limit", type=int, default=20)
+    parser_search.set_defaults(handler=cmd_search)
+
+    parser_periods = commands.add_parser("periods", help="сводка по кварталам и размер их секций оценок")
+    parser_periods.add_argument("--from", dest="start", help="первый квартал, например 2023-Q2")
+    parser_periods.add_argument("--to", dest="end", help="последний квартал включительно")
+    parser_periods.set_defaults(handler=cmd_periods)
+
+    parser_drop = commands.add_parser("drop-period", help="удалить опросы квартала вместе с секцией оценок")
+    parser_drop.add_argument("period", help="квартал, например 2023-Q1")
+    parser_drop.add_argument("--archive", action="store_true",
+                             help=f"не удалять данные, а перенести их в схему {ARCHIVE_SCHEMA}")
+    parser_drop.set_defaults(handler=cmd_drop_period)
+
+    parser_reports = commands.add_parser("reports", help="записать отчёт по каждому сотруднику в отдельный файл")
+    parser_reports.add_argument("out_dir", help="каталог для отчётов (создаётся при необходимости)")
+    parser_reports.add_argument("--period", type=parse_period_filter,
+                                help="квартал (2025-Q1) или диапазон включительно (2023-Q2:2025-Q1)")
+    parser_reports.add_argument("--format", choices=REPORT_FORMATS, default="txt")
+    parser_reports.add_argument("--workers", type=int, help="число процессов (по умолчанию по числу ядер)")
+    parser_reports.add_argument("--chunk-size", type=int, default=200, help="сотрудников в одной порции")
+    parser_reports.set_defaults(handler=cmd_reports)
+
+    parser_sync = commands.add_parser("sync", help="перенести опросы из локального файла SQLite в PostgreSQL")
+    parser_sync.add_argument("sqlite", help="путь к файлу SQLite, с которым работали без сервера")
+    parser_sync.set_defaults(handler=cmd_sync)
+
+    args = parser.parse_args(argv)
+    if args.stats:
+        query_stats.enabled = True
+    try:
+        conn = psycopg2.connect(cursor_factory=InstrumentedCursor, **load_db_params())
     except Exception as e:
         print("Ошибка подключения к базе данных:", e)
         sys.exit(1)
-
-    init_db(conn)
-
-    app = App(conn)
-    app.mainloop()
-    conn.close()
+    try:
+        init_db(conn)
+        args.handler(conn, args)
+    except (ValueError, psycopg2.DataError) as e:
+        print("Ошибка:", e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        conn.close()
+        if args.stats:
+            query_stats.dump(args.stats)
 
 
 if __name__ == '__main__':
-    main()
+    # Без аргументов запускается графический интерфейс
+    if len(sys.argv) > 1:
+        cli()
+    else:
+        main()
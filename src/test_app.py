@@ -1,8 +1,18 @@
 # test_app.py
+import datetime
+import io
+import json
+import tempfile
+import tracemalloc
 import unittest
+import uuid
+from unittest import mock
+import numpy as np
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 import os
 import sys
+import time
 
 # Импортируем coverage ПЕРЕД импортом тестируемых модулей
 import coverage
@@ -20,16 +30,67 @@ cov.start()
 # Теперь импортируем тестируемые модули
 from kurwithGUI import (
     init_db,
+    migrate,
+    SCHEMA_MIGRATIONS,
+    SCHEMA_VERSION,
+    get_schema_version,
     add_employee,
+    add_employees,
     get_employees,
+    search_employees,
+    resolve_employee,
+    PrefixCache,
     add_category,
     get_categories,
     add_competency,
     get_competencies_by_category,
+    get_competencies_by_categories,
+    get_catalog,
+    load_catalog,
+    CatalogCache,
+    catalog_cache,
     add_survey,
     add_survey_score,
-    get_survey_results
+    add_survey_scores,
+    prepared_statements,
+    submit_survey,
+    ScoreRow,
+    SURVEY_SCORES_SQL,
+    get_survey_scores,
+    get_survey_averages,
+    get_survey_overall,
+    check_survey_totals,
+    get_survey_results,
+    get_survey_page,
+    survey_page_key,
+    PeriodRange,
+    parse_period_filter,
+    get_surveys_between,
+    get_period_summary,
+    get_period_partitions,
+    drop_period,
+    generate_reports,
+    import_employees_csv,
+    import_catalog_csv,
+    import_scores_csv,
+    export_survey_data,
+    DBExecutor,
+    Change,
+    ChangeListener,
+    DeferredPool,
+    load_db_params,
+    init_db_cached,
+    PostgresStorage,
+    SQLiteStorage,
+    SQLiteStoragePool,
+    create_storage_pool,
+    sync_offline_surveys,
+    WriteBehind,
+    query_stats,
+    InstrumentedCursor
 )
+from analytics import ScoreMatrix
+from benchmarks import CommitCounter, generate_dataset
 
 
 class TestDBFunctions(unittest.TestCase):
@@ -71,6 +132,7 @@ class TestDBFunctions(unittest.TestCase):
                     employees RESTART IDENTITY CASCADE;
             """)
             self.conn.commit()
+        catalog_cache.invalidate()
 
     def test_add_employee(self):
         """Тест добавления сотрудника"""
@@ -90,6 +152,213 @@ class TestDBFunctions(unittest.TestCase):
         comps = get_competencies_by_category(self.conn, cat_id)
         self.assertEqual(comps[0][1], "Python")
 
+    def test_prepared_statements(self):
+        """Тест подготовленных запросов: PREPARE один раз на соединение, повторная подготовка после потери"""
+        def prepared():
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT name FROM pg_prepared_statements ORDER BY name;")
+                names = [row[0] for row in cursor.fetchall()]
+            self.conn.commit()
+            return names
+
+        prepared_statements.reset(self.conn)
+        add_employee(self.conn, "Ann")
+        add_employee(self.conn, "Bob")
+        self.assertEqual(prepared(), ["kurs_add_employee"])
+
+        # Сервер забыл запросы (DEALLOCATE, пул соединений) - запрос готовится заново и выполняется
+        with self.conn.cursor() as cursor:
+            cursor.execute("DEALLOCATE ALL;")
+        self.conn.commit()
+        add_employee(self.conn, "Cid")
+        self.assertEqual(prepared(), ["kurs_add_employee"])
+        self.assertEqual([name for _, name in get_employees(self.conn)], ["Ann", "Bob", "Cid"])
+
+        # Другая обёртка того же соединения: запрос уже подготовлен в сеансе и только выполняется
+        add_employee(CommitCounter(self.conn), "Eve")
+        self.assertEqual(prepared(), ["kurs_add_employee"])
+
+        prepared_statements.enabled = False
+        try:
+            self.assertEqual(len(get_competencies_by_category(self.conn, 1)), 0)
+            add_employee(self.conn, "Dan")
+            # Запрос, где параметр встречается дважды
+            comp_id = add_competency(self.conn, "Pytest", add_category(self.conn, "Testing"))
+            survey_id = add_survey(self.conn, 1, "2024-Q1")
+            add_survey_score(self.conn, survey_id, comp_id, 4)
+            self.assertEqual([row.score for row in get_survey_scores(self.conn, survey_id=survey_id)], [4.0])
+        finally:
+            prepared_statements.enabled = True
+        self.assertEqual(prepared(), ["kurs_add_employee"])
+
+    def test_batch_variants(self):
+        """Тест пакетных вариантов: сотрудники, оценки и компетенции нескольких категорий одним запросом"""
+        self.assertEqual(add_employees(self.conn, ["Ann", "Bob", "Cid"]), [1, 2, 3])
+        self.assertEqual(add_employees(self.conn, []), [])
+        hard_id = add_category(self.conn, "Hard skills")
+        soft_id = add_category(self.conn, "Soft skills")
+        sql_id = add_competency(self.conn, "SQL", hard_id)
+        git_id = add_competency(self.conn, "Git", hard_id)
+        self.assertEqual(get_competencies_by_categories(self.conn, [hard_id, soft_id]),
+                         {hard_id: [(sql_id, "SQL"), (git_id, "Git")], soft_id: []})
+
+        survey_id = add_survey(self.conn, 1, "2025-Q1")
+        self.assertEqual(add_survey_scores(self.conn, [(survey_id, sql_id, 4), (survey_id, git_id, 2.5)]), 2)
+        self.assertEqual(get_survey_overall(self.conn, [survey_id]), {survey_id: 3.25})
+        # Повтор оценки нарушает уникальность - откатывается весь пакет
+        with self.assertRaises(psycopg2.IntegrityError):
+            add_survey_scores(self.conn, [(survey_id, sql_id, 5)])
+        self.assertEqual(get_survey_overall(self.conn, [survey_id]), {survey_id: 3.25})
+
+    def test_search_employees(self):
+        """Тест поиска сотрудников по началу имени"""
+        ids = add_employees(self.conn, ["Иван Петров", "иван Сидоров", "Ирина Котова", "Ivan Smith", "Иванов Олег"])
+        self.assertEqual(search_employees(self.conn, "ИВАН"), [(ids[0], "Иван Петров"), (ids[1], "иван Сидоров"),
+                                                               (ids[4], "Иванов Олег")])
+        self.assertEqual(search_employees(self.conn, "  иван п"), [(ids[0], "Иван Петров")])
+        self.assertEqual(len(search_employees(self.conn, "И", limit=2)), 2)
+        self.assertEqual(search_employees(self.conn, "iv"), [(ids[3], "Ivan Smith")])
+        self.assertEqual(search_employees(self.conn, "Юрий"), [])
+        self.assertEqual(len(search_employees(self.conn, "")), 5)
+        # Спецсимволы LIKE в префиксе не работают как шаблон
+        self.assertEqual(search_employees(self.conn, "%"), [])
+
+        self.assertEqual(resolve_employee(self.conn, "ирина"), ids[2])
+        self.assertEqual(resolve_employee(self.conn, "Иван Петров"), ids[0])
+        with self.assertRaises(ValueError):
+            resolve_employee(self.conn, "Иван")
+        with self.assertRaises(ValueError):
+            resolve_employee(self.conn, "Юрий")
+
+    def test_prefix_cache(self):
+        """Тест кэша префиксов: сужение полного результата и вытеснение старых записей"""
+        cache = PrefixCache(size=2)
+        cache.put("Ив", 3, [(1, "Иван"), (2, "Ивлев")])
+        self.assertEqual(cache.get("ИВА", 3), [(1, "Иван")])
+        self.assertEqual(cache.get("ив", 3), [(1, "Иван"), (2, "Ивлев")])
+        self.assertIsNone(cache.get("Ив", 5))
+        # Результат, упёршийся в limit, неполон: сужать его нельзя
+        cache.put("А", 2, [(3, "Анна"), (4, "Антон")])
+        self.assertIsNone(cache.get("Ан", 2))
+        cache.put("Б", 2, [])
+        self.assertIsNone(cache.get("Ив", 3))
+        self.assertEqual(cache.get("Бо", 2), [])
+
+    def test_catalog_cache(self):
+        """Тест каталога: один запрос, обновление кэша при добавлении"""
+        cat_id = add_category(self.conn, "Programming")
+        add_competency(self.conn, "Python", cat_id)
+        empty_id = add_category(self.conn, "Empty")
+        self.assertEqual(get_catalog(self.conn),
+                         [((cat_id, "Programming"), [(1, "Python")]), ((empty_id, "Empty"), [])])
+
+        # Кэш дополняется функциями добавления, а изменения в обход них видны только после сброса
+        comp_id = add_competency(self.conn, "SQL", empty_id)
+        with self.conn.cursor() as cursor:
+            cursor.execute("INSERT INTO categories (name) VALUES ('External');")
+        self.conn.commit()
+        catalog = get_catalog(self.conn)
+        self.assertEqual(catalog[1], ((empty_id, "Empty"), [(comp_id, "SQL")]))
+        self.assertEqual(len(catalog), 2)
+        catalog_cache.invalidate(self.conn)
+        self.assertEqual(len(get_catalog(self.conn)), 3)
+
+    def test_catalog_cache_ttl(self):
+        """Тест: по истечении ttl каталог перечитывается из базы"""
+        self.assertIsNotNone(catalog_cache.ttl)
+        cache = CatalogCache(ttl=60)
+        add_category(self.conn, "Programming")
+        with mock.patch("kurwithGUI.time.monotonic", return_value=1000.0) as monotonic:
+            self.assertEqual(len(cache.get(self.conn)), 1)
+            with self.conn.cursor() as cursor:
+                cursor.execute("INSERT INTO categories (name) VALUES ('External');")
+            self.conn.commit()
+            monotonic.return_value = 1059.0
+            self.assertEqual(len(cache.get(self.conn)), 1)
+            monotonic.return_value = 1060.0
+            self.assertEqual(len(cache.get(self.conn)), 2)
+
+    def test_catalog_cache_apply_changes(self):
+        """Тест: уведомления об изменениях каталога другим клиентом применяются к кэшу построчно"""
+        hard_id = add_category(self.conn, "Hard skills")
+        soft_id = add_category(self.conn, "Soft skills")
+        sql_id = add_competency(self.conn, "SQL", hard_id)
+        git_id = add_competency(self.conn, "Git", hard_id)
+        get_catalog(self.conn)
+
+        with self.conn.cursor() as cursor:
+            cursor.execute("UPDATE categories SET name = 'Engineering' WHERE id = %s;", (hard_id,))
+            cursor.execute("DELETE FROM competencies WHERE id = %s;", (sql_id,))
+            cursor.execute("UPDATE competencies SET category_id = %s WHERE id = %s;", (soft_id, git_id))
+            cursor.execute("INSERT INTO categories (name) VALUES ('Management') RETURNING id;")
+            new_cat_id = cursor.fetchone()[0]
+            cursor.execute("INSERT INTO competencies (name, category_id) VALUES ('Planning', %s) RETURNING id;",
+                           (new_cat_id,))
+            new_comp_id = cursor.fetchone()[0]
+        self.conn.commit()
+        catalog_cache.apply_changes(self.conn, [Change("categories", "UPDATE", [hard_id]),
+                                                Change("competencies", "DELETE", [sql_id]),
+                                                Change("competencies", "UPDATE", [git_id]),
+                                                Change("categories", "INSERT", [new_cat_id]),
+                                                Change("competencies", "INSERT", [new_comp_id])])
+        self.assertEqual(get_catalog(self.conn), load_catalog(self.conn))
+        self.assertEqual(get_catalog(self.conn)[0], ((hard_id, "Engineering"), []))
+
+        # Изменение без списка id (импорт, TRUNCATE) сбрасывает кэш
+        catalog_cache.apply_changes(self.conn, [Change("categories", "TRUNCATE", None)])
+        with self.conn.cursor() as cursor:
+            cursor.execute("DELETE FROM categories WHERE id = %s;", (soft_id,))
+        self.conn.commit()
+        self.assertEqual(get_catalog(self.conn), load_catalog(self.conn))
+
+    def test_change_notifications(self):
+        """Тест триггеров NOTIFY: одно уведомление на оператор с id изменённых строк"""
+        listener = ChangeListener(dict(host="localhost", port=5432, database="competencies",
+                                       user="user1", password="admin1"), delay=0.05, poll_timeout=0.05).start()
+        try:
+            self.assertTrue(listener.connected.wait(5))
+
+            def received(count):
+                changes = []
+                deadline = time.monotonic() + 5
+                while len(changes) < count and time.monotonic() < deadline:
+                    changes += listener.drain()
+                    time.sleep(0.02)
+                return changes
+
+            emp_id = add_employee(self.conn, "Ann")
+            cat_id = add_category(self.conn, "Hard skills")
+            comp_id = add_competency(self.conn, "SQL", cat_id)
+            self.assertEqual(received(3), [Change("employees", "INSERT", [emp_id]),
+                                           Change("categories", "INSERT", [cat_id]),
+                                           Change("competencies", "INSERT", [comp_id])])
+
+            survey_id = submit_survey(self.conn, emp_id, "2025-Q1", {comp_id: 4})
+            with self.conn.cursor() as cursor:
+                cursor.execute("UPDATE survey_scores SET score = 5;")
+            self.conn.commit()
+            self.assertEqual(received(3), [Change("surveys", "INSERT", [survey_id]),
+                                           Change("survey_scores", "INSERT", [survey_id]),
+                                           Change("survey_scores", "UPDATE", [survey_id])])
+
+            # Массовые изменения приходят без списка id
+            add_employees(self.conn, [f"Employee {i}" for i in range(600)])
+            with self.conn.cursor() as cursor:
+                cursor.execute("TRUNCATE categories CASCADE;")
+            self.conn.commit()
+            changes = received(3)
+            self.assertEqual(changes[0], Change("employees", "INSERT", None))
+            self.assertIn(Change("categories", "TRUNCATE", None), changes)
+
+            # После разрыва соединения окна получают сигнал перечитать данные
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                               "WHERE query = 'LISTEN kurs_changes;' AND pid <> pg_backend_pid();")
+            self.conn.commit()
+            self.assertIn(Change(None, "RESYNC", None), received(1))
+        finally:
+            listener.stop()
+
     def test_full_workflow(self):
         """Полный тест рабочего процесса"""
         # Добавляем данные
@@ -107,6 +376,1052 @@ class TestDBFunctions(unittest.TestCase):
         self.assertIn("Pytest", results)
         self.assertIn("4.5", results)
 
+    def test_submit_survey(self):
+        """Тест записи опроса одной транзакцией"""
+        emp_id = add_employee(self.conn, "Bob Brown")
+        cat_id = add_category(self.conn, "Soft skills")
+        comp1 = add_competency(self.conn, "Communication", cat_id)
+        comp2 = add_competency(self.conn, "Teamwork", cat_id)
+
+        survey_id = submit_survey(self.conn, emp_id, "2024-Q2", {comp1: "4", comp2: 5})
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT competency_id, score FROM survey_scores WHERE survey_id=%s ORDER BY competency_id;",
+                           (survey_id,))
+            self.assertEqual(cursor.fetchall(), [(comp1, 4.0), (comp2, 5.0)])
+
+    def test_submit_survey_invalid_score(self):
+        """Тест: некорректная оценка не оставляет половину опроса"""
+        emp_id = add_employee(self.conn, "Bob Brown")
+        cat_id = add_category(self.conn, "Soft skills")
+        comp1 = add_competency(self.conn, "Communication", cat_id)
+        comp2 = add_competency(self.conn, "Teamwork", cat_id)
+
+        with self.assertRaises(ValueError):
+            submit_survey(self.conn, emp_id, "2024-Q2", {comp1: 4, comp2: 7})
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM surveys;")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_survey_averages(self):
+        """Тест средних оценок по категориям, посчитанных в SQL"""
+        emp_id = add_employee(self.conn, "Carol White")
+        other_id = add_employee(self.conn, "Dan Black")
+        hard_id = add_category(self.conn, "Hard skills")
+        soft_id = add_category(self.conn, "Soft skills")
+        sql_id = add_competency(self.conn, "SQL", hard_id)
+        git_id = add_competency(self.conn, "Git", hard_id)
+        talk_id = add_competency(self.conn, "Communication", soft_id)
+        survey_id = submit_survey(self.conn, emp_id, "2024-Q3", {sql_id: 4, git_id: 5, talk_id: 3})
+        submit_survey(self.conn, other_id, "2024-Q4", {sql_id: 1, git_id: 1, talk_id: 1})
+
+        averages = get_survey_averages(self.conn, employee_id=emp_id)
+        self.assertEqual([(a.survey_id, a.category, a.average) for a in averages],
+                         [(survey_id, "Hard skills", 4.5), (survey_id, "Soft skills", 3.0)])
+        self.assertAlmostEqual(averages[0].overall, 4.0)
+
+        self.assertEqual(len(get_survey_averages(self.conn, period="2024-Q4", category_id=soft_id)), 1)
+        results = get_survey_results(self.conn, employee_id=emp_id)
+        self.assertIn("Общая оценка: 4.00", results)
+        self.assertNotIn("Dan Black", results)
+
+        # Оценки опроса идут по категории, затем по компетенции - в том же порядке, что и в выгрузке
+        scores = get_survey_scores(self.conn)
+        self.assertEqual([(row.category, row.competency) for row in scores[:3]],
+                         [("Hard skills", "Git"), ("Hard skills", "SQL"), ("Soft skills", "Communication")])
+        with self.conn.cursor() as cursor:
+            cursor.execute(SURVEY_SCORES_SQL.format(where=""))
+            self.assertEqual(scores, [ScoreRow(*row) for row in cursor.fetchall()])
+        self.assertLess(results.index("Hard skills - Git"), results.index("Hard skills - SQL"))
+
+    def test_survey_category_totals(self):
+        """Тест агрегатной таблицы: поддержка триггерами и проверка согласованности"""
+        emp_id = add_employee(self.conn, "Carol White")
+        cat_id = add_category(self.conn, "Hard skills")
+        sql_id = add_competency(self.conn, "SQL", cat_id)
+        git_id = add_competency(self.conn, "Git", cat_id)
+        survey_id = submit_survey(self.conn, emp_id, "2024-Q3", {sql_id: 4, git_id: 2})
+        add_survey_score(self.conn, add_survey(self.conn, emp_id, "2024-Q4"), sql_id, 5)
+        self.assertEqual(get_survey_overall(self.conn, [survey_id]), {survey_id: 3.0})
+
+        # Каскадное удаление компетенции пересчитывает затронутые опросы
+        with self.conn.cursor() as cursor:
+            cursor.execute("DELETE FROM competencies WHERE id=%s;", (git_id,))
+        self.conn.commit()
+        self.assertEqual(get_survey_overall(self.conn, [survey_id]), {survey_id: 4.0})
+        self.assertEqual(check_survey_totals(self.conn), [])
+
+        with self.conn.cursor() as cursor:
+            cursor.execute("UPDATE survey_category_totals SET total = 100;")
+        self.conn.commit()
+        self.assertEqual(len(check_survey_totals(self.conn, repair=True)), 2)
+        self.assertEqual(check_survey_totals(self.conn), [])
+
+    def test_totals_follow_competency_category(self):
+        """Тест: перенос компетенции в другую категорию пересчитывает итоги затронутых опросов"""
+        emp_id = add_employee(self.conn, "Carol White")
+        hard_id = add_category(self.conn, "Hard skills")
+        soft_id = add_category(self.conn, "Soft skills")
+        sql_id = add_competency(self.conn, "SQL", hard_id)
+        talk_id = add_competency(self.conn, "Talks", hard_id)
+        submit_survey(self.conn, emp_id, "2024-Q3", {sql_id: 4, talk_id: 2})
+        submit_survey(self.conn, emp_id, "2024-Q4", {talk_id: 5})
+        with self.conn.cursor() as cursor:
+            cursor.execute("UPDATE competencies SET category_id = %s WHERE id = %s;", (soft_id, talk_id))
+            # Те же средние, посчитанные по сырым оценкам
+            cursor.execute("""
+                SELECT s.id, cat.name, AVG(ss.score)
+                FROM surveys s
+                JOIN survey_scores ss ON ss.survey_id = s.id
+                JOIN competencies comp ON comp.id = ss.competency_id
+                JOIN categories cat ON cat.id = comp.category_id
+                GROUP BY s.id, cat.name
+                ORDER BY s.id, cat.name;
+            """)
+            expected = cursor.fetchall()
+        self.conn.commit()
+        self.assertEqual([(row.survey_id, row.category, row.average) for row in get_survey_averages(self.conn)],
+                         expected)
+        self.assertEqual(check_survey_totals(self.conn), [])
+
+    def test_import_csv(self):
+        """Тест загрузки сотрудников, каталога и оценок из CSV через COPY"""
+        add_employee(self.conn, "Alice Smith")
+        employees = io.StringIO("name\nAlice Smith\nBob Brown\nBob Brown\n")
+        self.assertEqual(import_employees_csv(self.conn, employees), 1)
+        catalog = io.StringIO("category,competency\nTesting,Pytest\nTesting,Unittest\nSoft,Talk\n")
+        self.assertEqual(import_catalog_csv(self.conn, catalog), (2, 3))
+
+        scores = (
+            "employee,period,category,competency,score\n"
+            "Alice Smith,2023-Q1,Testing,Pytest,4\n"
+            "Alice Smith,2023-Q1,Soft,Talk,\"3,5\"\n"
+            "Bob Brown,2023-Q1,Testing,Unittest,5\n"
+            "Bob Brown,2023-Q1,Testing,Unknown,5\n"
+            "Nobody,2023-Q1,Testing,Pytest,6\n"
+        )
+        with self.assertRaises(ValueError) as ctx:
+            import_scores_csv(self.conn, io.StringIO(scores))
+        self.assertIn("строка 5: неизвестная компетенция", str(ctx.exception))
+        self.assertEqual(get_survey_averages(self.conn), [])
+
+        result = import_scores_csv(self.conn, io.StringIO(scores), skip_invalid=True)
+        self.assertEqual(tuple(result), (2, 3, 2))
+        averages = get_survey_averages(self.conn)
+        self.assertEqual([(a.employee_name, a.category, a.average) for a in averages],
+                         [("Alice Smith", "Soft", 3.5), ("Alice Smith", "Testing", 4.0),
+                          ("Bob Brown", "Testing", 5.0)])
+
+    def test_export(self):
+        """Тест выгрузки в CSV и JSON Lines с фильтрами"""
+        emp_id = add_employee(self.conn, "Alice Smith")
+        cat_id = add_category(self.conn, "Testing")
+        comp_id = add_competency(self.conn, "Pytest", cat_id)
+        submit_survey(self.conn, emp_id, "2024-Q1", {comp_id: 4.5})
+        submit_survey(self.conn, emp_id, "2024-Q2", {comp_id: 3})
+
+        out = io.StringIO()
+        export_survey_data(self.conn, out, "scores", "csv", period="2024-Q1")
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["survey_id,employee_name,period,category,competency,score",
+                          "1,Alice Smith,2024-Q1,Testing,Pytest,4.5"])
+
+        out = io.StringIO()
+        export_survey_data(self.conn, out, "averages", "jsonl", employee_id=emp_id)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(row["period"], row["average"]) for row in rows], [("2024-Q1", 4.5), ("2024-Q2", 3.0)])
+
+    def test_export_constant_memory(self):
+        """Тест: пиковая память выгрузки не растёт вместе с объёмом данных"""
+        class NullWriter:
+            def write(self, data):
+                return len(data)
+
+        peaks = []
+        for surveys in (20, 1000):
+            self.setUp()
+            generate_dataset(self.conn, employees=10, categories=5, competencies=50, surveys=surveys)
+            for fmt in ("csv", "jsonl"):
+                tracemalloc.start()
+                export_survey_data(self.conn, NullWriter(), "scores", fmt)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        # 1 000 строк против 50 000: пик памяти не должен расти пропорционально
+        small_csv, small_jsonl, large_csv, large_jsonl = peaks
+        self.assertLess(large_csv, small_csv * 2 + 256 * 1024)
+        self.assertLess(large_jsonl, small_jsonl * 2 + 256 * 1024)
+
+    def test_survey_page_keyset(self):
+        """Тест keyset-пагинации опросов с сортировкой и фильтрами в базе"""
+        cat_id = add_category(self.conn, "Paging")
+        comp_id = add_competency(self.conn, "Paging", cat_id)
+        for name in ["Eve", "Adam", "Bea", "Adam"]:
+            submit_survey(self.conn, add_employee(self.conn, name), "2025-Q1", {comp_id: 3})
+        submit_survey(self.conn, add_employee(self.conn, "Zed"), "2025-Q2", {comp_id: 5})
+        for name in ["Яна", "bea", "Ёж"]:
+            submit_survey(self.conn, add_employee(self.conn, name), "2025-Q3", {comp_id: 4})
+
+        names = []
+        after = None
+        while True:
+            page = get_survey_page(self.conn, sort="employee", after=after, limit=2)
+            if not page:
+                break
+            names += [row.employee_name for row in page]
+            after = survey_page_key(page[-1], "employee")
+        # Порядок базы совпадает с порядком survey_page_key: по нему окно вставляет изменённые строки
+        self.assertEqual(names, ["Adam", "Adam", "Bea", "Eve", "Zed", "bea", "Ёж", "Яна"])
+        self.assertEqual(names, sorted(names))
+
+        page = get_survey_page(self.conn, employee_name="ze", period="2025-Q2")
+        self.assertEqual([(row.employee_name, row.overall) for row in page], [("Zed", 5.0)])
+        page = get_survey_page(self.conn, sort="employee", survey_ids=[1, 2, 5], period="2025-Q1")
+        self.assertEqual([row.employee_name for row in page], ["Adam", "Eve"])
+
+    def test_periods(self):
+        """Тест типизированных периодов и запросов по диапазону кварталов"""
+        emp_id = add_employee(self.conn, "Alice Smith")
+        cat_id = add_category(self.conn, "Testing")
+        comp_id = add_competency(self.conn, "Pytest", cat_id)
+        ids = [submit_survey(self.conn, emp_id, period, {comp_id: score})
+               for period, score in [("2023-Q1", 2), ("2023-q2 ", 3), ("2024-Q4", 4), ("2025-Q1", 5)]]
+        with self.assertRaises(ValueError):
+            submit_survey(self.conn, emp_id, "2025-Q5", {comp_id: 3})
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT period, period_start FROM surveys WHERE id = %s;", (ids[1],))
+            self.assertEqual(cursor.fetchone(), ("2023-Q2", datetime.date(2023, 4, 1)))
+        self.conn.commit()
+
+        self.assertEqual(parse_period_filter("2023-q2:2025-Q1"), PeriodRange("2023-Q2", "2025-Q1"))
+        self.assertEqual(parse_period_filter(" 2024-Q1: "), PeriodRange("2024-Q1", None))
+        self.assertEqual([row.survey_id for row in get_surveys_between(self.conn, "2023-Q2", "2025-Q1")], ids[1:])
+        self.assertEqual([row.survey_id for row in get_surveys_between(self.conn, end="2023-Q2")], ids[:2])
+        self.assertEqual([(row.period, row.surveys, row.average) for row in get_period_summary(self.conn, "2024-Q1")],
+                         [("2024-Q4", 1, 4.0), ("2025-Q1", 1, 5.0)])
+        self.assertEqual([row.score for row in get_survey_scores(self.conn, period=PeriodRange("2023-Q2", "2024-Q4"))],
+                         [3.0, 4.0])
+        self.assertEqual([row.survey_id for row in get_survey_page(self.conn, period=PeriodRange(None, "2023-Q1"))],
+                         ids[:1])
+        # Каждый квартал - своя секция оценок
+        partitions = {partition.period: partition.table for partition in get_period_partitions(self.conn)}
+        self.assertEqual(partitions["2023-Q2"], "survey_scores_2023_q2")
+        self.assertIn("2025-Q1", partitions)
+
+    def test_drop_period(self):
+        """Тест удаления и архивирования квартала вместе с его секцией оценок"""
+        emp_id = add_employee(self.conn, "Alice Smith")
+        cat_id = add_category(self.conn, "Testing")
+        comp_id = add_competency(self.conn, "Pytest", cat_id)
+        old_id = submit_survey(self.conn, emp_id, "2019-Q3", {comp_id: 2})
+        archived_id = submit_survey(self.conn, emp_id, "2019-Q4", {comp_id: 3})
+        kept_id = submit_survey(self.conn, emp_id, "2020-Q1", {comp_id: 4})
+        try:
+            self.assertEqual(drop_period(self.conn, "2019-Q3"), 1)
+            self.assertEqual(drop_period(self.conn, "2019-Q4", archive=True), 1)
+            periods = [partition.period for partition in get_period_partitions(self.conn)]
+            self.assertNotIn("2019-Q3", periods)
+            self.assertNotIn("2019-Q4", periods)
+            self.assertEqual([row.survey_id for row in get_survey_page(self.conn)], [kept_id])
+            self.assertEqual(check_survey_totals(self.conn), [])
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT survey_id, score FROM archive.survey_scores_2019_q4;")
+                self.assertEqual(cursor.fetchall(), [(archived_id, 3.0)])
+                cursor.execute("SELECT id, employee_name, period FROM archive.surveys_2019_q4;")
+                self.assertEqual(cursor.fetchall(), [(archived_id, "Alice Smith", "2019-Q4")])
+            self.conn.commit()
+            # Квартал можно заполнить заново: секция создаётся с первым опросом
+            self.assertNotEqual(submit_survey(self.conn, emp_id, "2019-Q3", {comp_id: 5}), old_id)
+            self.assertEqual(len(get_survey_scores(self.conn, period="2019-Q3")), 1)
+        finally:
+            self.conn.rollback()
+            with self.conn.cursor() as cursor:
+                cursor.execute("DROP SCHEMA IF EXISTS archive CASCADE;")
+            self.conn.commit()
+
+    def test_drop_period_archive_twice(self):
+        """Тест повторного архивирования квартала: строки дописываются в существующие архивные таблицы"""
+        emp_id = add_employee(self.conn, "Alice Smith")
+        cat_id = add_category(self.conn, "Testing")
+        comp_id = add_competency(self.conn, "Pytest", cat_id)
+        first_id = submit_survey(self.conn, emp_id, "2019-Q4", {comp_id: 3})
+        try:
+            self.assertEqual(drop_period(self.conn, "2019-Q4", archive=True), 1)
+            second_id = submit_survey(self.conn, emp_id, "2019-Q4", {comp_id: 5})
+            self.assertEqual(drop_period(self.conn, "2019-Q4", archive=True), 1)
+            self.assertNotIn("2019-Q4", [partition.period for partition in get_period_partitions(self.conn)])
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT survey_id, score FROM archive.survey_scores_2019_q4 ORDER BY survey_id;")
+                self.assertEqual(cursor.fetchall(), [(first_id, 3.0), (second_id, 5.0)])
+                cursor.execute("SELECT id, period FROM archive.surveys_2019_q4 ORDER BY id;")
+                self.assertEqual(cursor.fetchall(), [(first_id, "2019-Q4"), (second_id, "2019-Q4")])
+                cursor.execute("SELECT count(*) FROM pg_tables WHERE tablename = 'survey_scores_2019_q4';")
+                self.assertEqual(cursor.fetchone(), (1,))
+        finally:
+            self.conn.rollback()
+            with self.conn.cursor() as cursor:
+                cursor.execute("DROP SCHEMA IF EXISTS archive CASCADE;")
+            self.conn.commit()
+
+    def test_move_survey_to_new_quarter(self):
+        """Тест: опрос переносится в квартал, для которого ещё нет секции оценок"""
+        emp_id = add_employee(self.conn, "Alice Smith")
+        cat_id = add_category(self.conn, "Testing")
+        comp_id = add_competency(self.conn, "Pytest", cat_id)
+        survey_id = submit_survey(self.conn, emp_id, "2019-Q3", {comp_id: 4})
+        with self.conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS survey_scores_1995_q2;")
+        self.conn.commit()
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("UPDATE surveys SET period_start = '1995-04-01' WHERE id = %s;", (survey_id,))
+                cursor.execute("SELECT survey_id, score FROM survey_scores_1995_q2;")
+                self.assertEqual(cursor.fetchall(), [(survey_id, 4.0)])
+                cursor.execute("SELECT period FROM surveys WHERE id = %s;", (survey_id,))
+                self.assertEqual(cursor.fetchone(), ("1995-Q2",))
+            self.assertEqual([row.score for row in get_survey_scores(self.conn, period="1995-Q2")], [4.0])
+            self.assertEqual(get_survey_scores(self.conn, period="2019-Q3"), [])
+            self.assertEqual(check_survey_totals(self.conn), [])
+        finally:
+            self.conn.rollback()
+
+    def test_generate_reports(self):
+        """Тест пакетных отчётов: по файлу на сотрудника, текст совпадает с окном результатов"""
+        cat_id = add_category(self.conn, "Testing")
+        comp_id = add_competency(self.conn, "Pytest", cat_id)
+        emp_ids = [add_employee(self.conn, name) for name in ["Alice Smith", "Bob Jones", "Carol", "Dave"]]
+        for emp_id, score in zip(emp_ids[:3], [3, 4, 5]):
+            submit_survey(self.conn, emp_id, "2025-Q1", {comp_id: score})
+            submit_survey(self.conn, emp_id, "2025-Q2", {comp_id: score - 1})
+        params = dict(host="localhost", port=5432, database="competencies", user="user1", password="admin1")
+        progress = []
+        with tempfile.TemporaryDirectory() as out_dir:
+            result = generate_reports(self.conn, params, out_dir, period="2025-Q1", workers=2, chunk_size=2,
+                                      progress=lambda done, total: progress.append((done, total)))
+            self.assertEqual((result.employees, result.surveys), (3, 3))
+            self.assertEqual(sum(worker.chunks for worker in result.workers), 2)
+            self.assertEqual(sum(worker.employees for worker in result.workers), 3)
+            self.assertEqual(progress[-1], (3, 3))
+            # У Dave нет опросов - отчёта для него нет
+            self.assertEqual(sorted(os.listdir(out_dir)), [f"{emp_ids[0]}_Alice_Smith.txt",
+                                                           f"{emp_ids[1]}_Bob_Jones.txt", f"{emp_ids[2]}_Carol.txt"])
+            with open(os.path.join(out_dir, f"{emp_ids[1]}_Bob_Jones.txt"), encoding="utf-8") as report:
+                title, text = report.read().split("\n", 1)
+            self.assertIn("Bob Jones, 2025-Q1", title)
+            self.assertEqual(text, get_survey_results(self.conn, emp_ids[1], "2025-Q1"))
+
+            generate_reports(self.conn, params, out_dir, period=PeriodRange("2025-Q1", None), workers=1, fmt="html")
+            with open(os.path.join(out_dir, f"{emp_ids[2]}_Carol.html"), encoding="utf-8") as report:
+                page = report.read()
+            self.assertIn("<pre>", page)
+            self.assertIn("Период: 2025-Q2", page)
+
+    def test_analytics_matrix(self):
+        """Тест векторной аналитики: динамика, процентили, разрывы и догрузка новых опросов"""
+        ann_id = add_employee(self.conn, "Ann")
+        bob_id = add_employee(self.conn, "Bob")
+        hard_id = add_category(self.conn, "Hard skills")
+        soft_id = add_category(self.conn, "Soft skills")
+        sql_id = add_competency(self.conn, "SQL", hard_id)
+        git_id = add_competency(self.conn, "Git", hard_id)
+        talk_id = add_competency(self.conn, "Communication", soft_id)
+        submit_survey(self.conn, ann_id, "2024-Q3", {sql_id: 3, git_id: 3, talk_id: 2})
+        submit_survey(self.conn, ann_id, "2024-Q4", {sql_id: 4, git_id: 5, talk_id: 4})
+        submit_survey(self.conn, bob_id, "2024-Q4", {sql_id: 2, git_id: 2, talk_id: 5})
+
+        matrix = ScoreMatrix.load(self.conn)
+        self.assertEqual(matrix.scores.shape, (3, 3))
+        trends = {(t.employee_id, t.period): t for t in matrix.trends(hard_id)}
+        self.assertIsNone(trends[ann_id, "2024-Q3"].change)
+        self.assertAlmostEqual(trends[ann_id, "2024-Q4"].change, 1.5)
+        self.assertIsNone(trends[bob_id, "2024-Q4"].previous)
+
+        ranks = {(r.employee_id, r.category_id): r.percentile for r in matrix.percentile_ranks("2024-Q4")}
+        self.assertEqual(ranks, {(ann_id, hard_id): 75.0, (bob_id, hard_id): 25.0,
+                                 (ann_id, soft_id): 25.0, (bob_id, soft_id): 75.0})
+
+        gaps = matrix.gap_analysis(target=4.0)
+        self.assertEqual(gaps[0].competency_id, sql_id)
+        self.assertAlmostEqual(gaps[0].gap, 1.0)
+        self.assertAlmostEqual(gaps[0].below_target, 2 / 3)
+        distribution = matrix.distribution(category_id=soft_id)
+        self.assertEqual((distribution.count, distribution.mean), (3, 11 / 3))
+
+        # Новый сотрудник, новый (более ранний) период и новая компетенция догружаются без полной перезагрузки
+        cid_id = add_employee(self.conn, "Cid")
+        docker_id = add_competency(self.conn, "Docker", hard_id)
+        new_ids = [submit_survey(self.conn, cid_id, "2024-Q1", {docker_id: 1, talk_id: 3}),
+                   submit_survey(self.conn, bob_id, "2025-Q1", {sql_id: 4, git_id: 4})]
+        refreshed = matrix.refresh(self.conn, new_ids)
+        # Прежняя матрица не меняется: её может читать окно, пока строится новая
+        self.assertEqual(matrix.scores.shape, (3, 3))
+        matrix = refreshed.refresh(self.conn, [])
+        self.assertEqual(matrix.scores.shape, (5, 4))
+        self.assertEqual(matrix.periods, ["2024-Q1", "2024-Q3", "2024-Q4", "2025-Q1"])
+        trends = {(t.employee_id, t.period): t for t in matrix.trends(hard_id)}
+        self.assertAlmostEqual(trends[bob_id, "2025-Q1"].change, 2.0)
+        self.assertAlmostEqual(trends[cid_id, "2024-Q1"].average, 1.0)
+        self.assertAlmostEqual(trends[ann_id, "2024-Q4"].change, 1.5)
+
+        fresh = ScoreMatrix.load(self.conn)
+        self.assertEqual(fresh.trends(), matrix.trends())
+        self.assertEqual(fresh.percentile_ranks(), matrix.percentile_ranks())
+
+    def test_analytics_refresh_changes(self):
+        """Тест: перечитываются опросы, записанные не по порядку id, изменённые и удалённые после загрузки"""
+        ann_id = add_employee(self.conn, "Ann")
+        cat_id = add_category(self.conn, "Hard skills")
+        sql_id = add_competency(self.conn, "SQL", cat_id)
+        git_id = add_competency(self.conn, "Git", cat_id)
+        old_id = submit_survey(self.conn, ann_id, "2017-Q2", {sql_id: 2})
+        kept_id = submit_survey(self.conn, ann_id, "2017-Q3", {sql_id: 3})
+        matrix = ScoreMatrix.load(self.conn)
+
+        def assertMatchesDatabase(matrix):
+            fresh = ScoreMatrix.load(self.conn)
+            self.assertEqual(sorted(matrix.survey_ids.tolist()), fresh.survey_ids.tolist())
+            self.assertEqual(matrix.periods, fresh.periods)
+            self.assertEqual(matrix.trends(), fresh.trends())
+            self.assertEqual(matrix.gap_analysis(), fresh.gap_analysis())
+
+        # Опрос с меньшим id фиксируется позже опроса с большим (секция квартала уже есть, иначе её создание
+        # ждало бы первую транзакцию)
+        other = psycopg2.connect(host="localhost", port=5432, database="competencies", user="user1",
+                                 password="admin1")
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("INSERT INTO surveys (employee_id, period_start) VALUES (%s, '2017-07-01') "
+                               "RETURNING id;", (ann_id,))
+                late_id = cursor.fetchone()[0]
+                cursor.execute("INSERT INTO survey_scores (survey_id, competency_id, score, period_start) "
+                               "VALUES (%s, %s, 5, '2017-07-01');", (late_id, sql_id))
+            early_id = submit_survey(self.conn, ann_id, "2017-Q3", {sql_id: 4})
+            self.assertGreater(early_id, late_id)
+            matrix = matrix.refresh(self.conn, [early_id])
+            other.commit()
+        finally:
+            other.close()
+        matrix = matrix.refresh(self.conn, [late_id])
+        assertMatchesDatabase(matrix)
+
+        # Новая оценка уже загруженного опроса и компетенция, получившая категорию после загрузки
+        add_survey_score(self.conn, kept_id, git_id, 1)
+        with self.conn.cursor() as cursor:
+            cursor.execute("INSERT INTO competencies (name) VALUES ('Talks') RETURNING id;")
+            talk_id = cursor.fetchone()[0]
+        self.conn.commit()
+        add_survey_score(self.conn, old_id, talk_id, 4)
+        matrix = matrix.refresh(self.conn, [kept_id, old_id])
+        with self.conn.cursor() as cursor:
+            cursor.execute("UPDATE competencies SET category_id = %s WHERE id = %s;", (cat_id, talk_id))
+        self.conn.commit()
+        matrix = matrix.refresh(self.conn, [])
+        self.assertEqual(matrix.scores.shape, (4, 3))
+        assertMatchesDatabase(matrix)
+
+        # Удалённый квартал исчезает вместе с периодом
+        drop_period(self.conn, "2017-Q2")
+        matrix = matrix.refresh(self.conn, [old_id])
+        self.assertNotIn("2017-Q2", matrix.periods)
+        assertMatchesDatabase(matrix)
+
+    def test_analytics_matches_sql(self):
+        """Тест: средние по категориям из матрицы совпадают с посчитанными в базе"""
+        generate_dataset(self.conn, employees=20, categories=3, competencies=12, surveys=60)
+        matrix = ScoreMatrix.load(self.conn)
+        averages = matrix.category_averages()
+        names = dict(get_categories(self.conn))
+        expected = {(a.survey_id, a.category): a.average for a in get_survey_averages(self.conn)}
+        actual = {(int(matrix.survey_ids[i]), names[int(matrix.category_ids[c])]): averages[i, c]
+                  for i, c in zip(*(~np.isnan(averages)).nonzero())}
+        self.assertEqual(expected.keys(), actual.keys())
+        for key, value in expected.items():
+            self.assertAlmostEqual(value, actual[key])
+
+
+class TestSchema(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg2.connect(host="localhost", port=5432, database="competencies",
+                                    user="user1", password="admin1")
+        init_db(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def tearDown(self):
+        self.conn.rollback()
+
+    def test_migrate_is_idempotent(self):
+        """Тест: при актуальной схеме миграции не применяются повторно"""
+        self.assertEqual(get_schema_version(self.conn), SCHEMA_VERSION)
+        self.assertEqual(migrate(self.conn), [])
+
+    def test_duplicate_scores_are_kept(self):
+        """Тест: миграция 2 переносит повторные оценки в survey_scores_duplicates, а не просто удаляет"""
+        with self.conn.cursor() as cursor:
+            # Миграции 1-2 на пустой схеме; откатывается вместе с транзакцией теста
+            cursor.execute("CREATE SCHEMA migration_test; SET LOCAL search_path TO migration_test;")
+            for statement in SCHEMA_MIGRATIONS[0][1]:
+                cursor.execute(statement)
+            cursor.execute("""
+            INSERT INTO employees (name) VALUES ('Alice');
+            INSERT INTO categories (name) VALUES ('Testing');
+            INSERT INTO competencies (name, category_id) VALUES ('Pytest', 1), ('Mock', 1);
+            INSERT INTO surveys (employee_id, period) VALUES (1, '2023-Q1');
+            INSERT INTO survey_scores (survey_id, competency_id, score) VALUES (1, 1, 3), (1, 2, 4), (1, 1, 5);
+            """)
+            for statement in SCHEMA_MIGRATIONS[1][1]:
+                cursor.execute(statement)
+            cursor.execute("SELECT competency_id, score FROM survey_scores ORDER BY id;")
+            self.assertEqual(cursor.fetchall(), [(1, 3.0), (2, 4.0)])
+            cursor.execute("SELECT id, survey_id, competency_id, score FROM survey_scores_duplicates;")
+            self.assertEqual(cursor.fetchall(), [(3, 1, 1, 5.0)])
+
+    def test_malformed_periods_are_quarantined(self):
+        """Тест: миграция 6 распознаёт варианты записи квартала, а нераспознанные опросы откладывает в сторону"""
+        with self.conn.cursor() as cursor:
+            cursor.execute("CREATE SCHEMA migration_test; SET LOCAL search_path TO migration_test;")
+            for _, statements in SCHEMA_MIGRATIONS[:5]:
+                for statement in statements:
+                    cursor.execute(statement)
+            cursor.execute("""
+            INSERT INTO employees (name) VALUES ('Alice');
+            INSERT INTO categories (name) VALUES ('Testing');
+            INSERT INTO competencies (name, category_id) VALUES ('Pytest', 1);
+            INSERT INTO surveys (employee_id, period) VALUES
+                (1, '2023-Q1'), (1, ' 2023 q2 '), (1, 'Q3 2023'), (1, '2023/4'), (1, 'весна 2023'), (1, '2023-Q5');
+            INSERT INTO survey_scores (survey_id, competency_id, score) SELECT id, 1, id FROM surveys;
+            """)
+            for statement in SCHEMA_MIGRATIONS[5][1]:
+                cursor.execute(statement)
+            cursor.execute("SELECT id, period FROM surveys ORDER BY id;")
+            self.assertEqual(cursor.fetchall(), [(1, "2023-Q1"), (2, "2023-Q2"), (3, "2023-Q3"), (4, "2023-Q4")])
+            cursor.execute("SELECT id, period FROM surveys_invalid_period ORDER BY id;")
+            self.assertEqual(cursor.fetchall(), [(5, "весна 2023"), (6, "2023-Q5")])
+            cursor.execute("SELECT survey_id, score FROM survey_scores_invalid_period ORDER BY survey_id;")
+            self.assertEqual(cursor.fetchall(), [(5, 5.0), (6, 6.0)])
+            cursor.execute("SELECT survey_id, score FROM survey_scores ORDER BY survey_id;")
+            self.assertEqual(cursor.fetchall(), [(1, 1.0), (2, 2.0), (3, 3.0), (4, 4.0)])
+
+    def assertUsesIndex(self, query, params, index):
+        with self.conn.cursor() as cursor:
+            # На маленькой тестовой таблице планировщик выбрал бы seq scan, запрещаем его
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            cursor.execute("EXPLAIN " + query, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn(index, plan)
+
+    def test_hot_queries_use_indexes(self):
+        """Тест: горячие запросы используют индексы (EXPLAIN)"""
+        with self.conn.cursor() as cursor:
+            # Секция откатывается вместе с транзакцией теста
+            cursor.execute("SELECT create_survey_scores_partition('2031-01-01');")
+        self.assertUsesIndex("SELECT id, name FROM competencies WHERE category_id=%s;", (1,),
+                             "competencies_category_id_idx")
+        self.assertUsesIndex("SELECT * FROM survey_scores WHERE survey_id=%s AND period_start=%s;",
+                             (1, "2031-01-01"), "survey_scores_2031_q1_pkey")
+        self.assertUsesIndex("SELECT * FROM survey_scores WHERE competency_id=%s AND period_start=%s;",
+                             (1, "2031-01-01"), "survey_scores_2031_q1_competency_id_idx")
+        self.assertUsesIndex("SELECT id FROM surveys WHERE employee_id=%s;", (1,), "surveys_employee_id_idx")
+        self.assertUsesIndex("SELECT id FROM surveys WHERE period_start BETWEEN %s AND %s;",
+                             ("2023-04-01", "2025-01-01"), "surveys_period_start_idx")
+        self.assertUsesIndex("SELECT id, name FROM employees WHERE lower(name) ~>=~ %s AND lower(name) ~<~ %s "
+                             "ORDER BY lower(name) USING ~<~, id LIMIT 20;", ("ив", "иг"), "employees_name_prefix_idx")
+
+    def test_period_range_reads_only_its_partitions(self):
+        """Тест: запрос по диапазону кварталов читает только секции этих кварталов"""
+        with self.conn.cursor() as cursor:
+            for month in (1, 4, 7, 10):
+                cursor.execute("SELECT create_survey_scores_partition(make_date(2031, %s, 1));", (month,))
+            cursor.execute("EXPLAIN SELECT * FROM survey_scores WHERE period_start >= %s AND period_start <= %s;",
+                           ("2031-04-01", "2031-07-01"))
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn("survey_scores_2031_q2", plan)
+        self.assertIn("survey_scores_2031_q3", plan)
+        self.assertNotIn("survey_scores_2031_q1", plan)
+        self.assertNotIn("survey_scores_2031_q4", plan)
+
+
+class TestDBExecutor(unittest.TestCase):
+    def setUp(self):
+        pool = ThreadedConnectionPool(1, 3, host="localhost", port=5432, database="competencies",
+                                      user="user1", password="admin1")
+        self.db = DBExecutor(pool, workers=2)
+
+    def tearDown(self):
+        self.db.shutdown()
+
+    def test_submit_delivers_result(self):
+        """Тест: результат запроса из пула потоков доставляется через process_completed"""
+        results = []
+        task = self.db.submit(lambda conn, x: x * 2, 21, on_success=results.append)
+        task.future.result(timeout=5)
+        self.db.process_completed()
+        self.assertEqual(results, [42])
+
+    def test_cancel_running_query(self):
+        """Тест: отмена прерывает запрос, обработчики не вызываются, соединение возвращается в пул"""
+        def slow_query(conn):
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_sleep(10);")
+
+        called = []
+        task = self.db.submit(slow_query, on_success=called.append, on_error=called.append)
+        # Отмена может прийти раньше, чем запрос дошёл до сервера, поэтому повторяем её
+        deadline = time.monotonic() + 5
+        while not task.future.done() and time.monotonic() < deadline:
+            task.cancel()
+            time.sleep(0.05)
+        self.assertTrue(task.future.done())
+        self.db.process_completed()
+        self.assertEqual(called, [])
+
+        results = []
+        self.db.submit(lambda conn: conn.closed, on_success=results.append).future.result(timeout=5)
+        self.db.process_completed()
+        self.assertEqual(results, [0])
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_db_params(self):
+        """Тест настроек подключения: файл поверх значений по умолчанию, переменные окружения поверх файла"""
+        path = os.path.join(self.tmp.name, "db.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"host": "db.local", "port": 6543}, f)
+        params = load_db_params(path, environ={"PGHOST": "vpn.example", "PGPASSWORD": ""})
+        self.assertEqual((params["host"], params["port"], params["password"]), ("vpn.example", 6543, "admin1"))
+        self.assertEqual(load_db_params(os.path.join(self.tmp.name, "missing.json"), environ={})["port"], 5432)
+
+    def test_init_db_cached(self):
+        """Тест: при совпадении версии в кэше схема на сервере не проверяется"""
+        path = os.path.join(self.tmp.name, "schema.json")
+        conn = psycopg2.connect(host="localhost", port=5432, database="competencies",
+                                user="user1", password="admin1")
+        try:
+            storage = PostgresStorage(conn)
+            self.assertTrue(init_db_cached(storage, path))
+            self.assertFalse(init_db_cached(storage, path))
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), {storage.schema_cache_key(): SCHEMA_VERSION})
+        finally:
+            conn.close()
+        # Для SQLite кэш не используется: схема создаётся локально
+        self.assertTrue(init_db_cached(SQLiteStorage(), path))
+
+    def test_deferred_pool_retries(self):
+        """Тест фонового подключения: повторы с задержкой, запросы ждут готовности пула"""
+        failures = [psycopg2.OperationalError("сервер недоступен")] * 2
+
+        def factory():
+            if failures:
+                raise failures.pop()
+            return SQLiteStoragePool(":memory:")
+
+        pool = DeferredPool(factory, setup=lambda storage: storage.init_db(), delay=0.01).start()
+        db = DBExecutor(pool, workers=1)
+        try:
+            results = []
+            db.submit(lambda storage: storage.add_employee("Ann"), on_success=results.append).future.result(5)
+            db.process_completed()
+            self.assertEqual((pool.status, pool.attempt, results), ("ready", 3, [1]))
+        finally:
+            db.shutdown()
+
+    def test_deferred_pool_gives_up(self):
+        """Тест: после исчерпания попыток запросы получают ошибку, а не зависают"""
+        def factory():
+            raise psycopg2.OperationalError("сервер недоступен")
+
+        pool = DeferredPool(factory, attempts=3, delay=0.01).start()
+        db = DBExecutor(pool, workers=1)
+        try:
+            errors = []
+            db.submit(lambda storage: None, on_error=errors.append).future.result(5)
+            db.process_completed()
+            self.assertEqual((pool.status, pool.attempt), ("failed", 3))
+            self.assertIsInstance(errors[0], psycopg2.OperationalError)
+        finally:
+            db.shutdown()
+
+        # Ошибки, не связанные с сетью, не повторяются
+        pool = DeferredPool(lambda: create_storage_pool("mysql"), delay=0.01).start()
+        self.assertRaises(psycopg2.OperationalError, pool.getconn)
+        self.assertEqual(pool.attempt, 1)
+        self.assertIsInstance(pool.error, ValueError)
+
+
+class TestWriteBehind(unittest.TestCase):
+    """Отложенная запись на отдельной базе, которую тест отключает и включает снова"""
+    DATABASE = "competencies_write_behind"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.admin = psycopg2.connect(host="localhost", port=5432, database="competencies",
+                                     user="user1", password="admin1")
+        cls.admin.autocommit = True
+        with cls.admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {cls.DATABASE} WITH (FORCE);")
+            cursor.execute(f"CREATE DATABASE {cls.DATABASE} TEMPLATE template0 ENCODING 'UTF8';")
+        cls.params = dict(host="localhost", port=5432, database=cls.DATABASE, user="user1", password="admin1")
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {cls.DATABASE} WITH (FORCE);")
+        cls.admin.close()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "journal.jsonl")
+        conn = psycopg2.connect(**self.params)
+        try:
+            init_db(conn)
+            with conn.cursor() as cursor:
+                cursor.execute("TRUNCATE survey_scores, surveys, competencies, categories, employees, applied_writes "
+                               "RESTART IDENTITY CASCADE;")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def tearDown(self):
+        self.set_database_online(True)
+        self.tmp.cleanup()
+
+    def set_database_online(self, online):
+        # Для клиентов это выглядит как остановка сервера: соединения обрываются, новые не принимаются
+        with self.admin.cursor() as cursor:
+            cursor.execute(f"ALTER DATABASE {self.DATABASE} ALLOW_CONNECTIONS {str(online).lower()};")
+            if not online:
+                cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s;",
+                               (self.DATABASE,))
+
+    def writer(self):
+        return WriteBehind(self.path, self.params, batch_size=10, interval=0.01, delay=0.05, max_delay=0.2)
+
+    def query(self, sql, params=()):
+        # Своё соединение на каждую проверку: отключение базы обрывает все соединения
+        conn = psycopg2.connect(**self.params)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchone()
+        finally:
+            conn.close()
+
+    def count(self, table):
+        return self.query(f"SELECT count(*), count(DISTINCT name) FROM {table};")
+
+    def test_survives_database_restart(self):
+        """Тест: записи при недоступной базе копятся в журнале и после её возврата пишутся по одному разу"""
+        writes = self.writer().start()
+        writes.submit("add_employee", "Before")
+        self.assertTrue(writes.flush(10))
+
+        self.set_database_online(False)
+        for i in range(25):
+            writes.submit("add_employee", f"Employee {i}")
+        writes.submit("add_category", "Soft skills")
+        deadline = time.monotonic() + 10
+        while writes.retries < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual((writes.depth, writes.status), (26, "retrying"))
+        # Приложение закрыли, не дождавшись базы: очередь остаётся в журнале
+        self.assertFalse(writes.flush(0.2))
+        writes.stop(timeout=0)
+
+        writes = self.writer()
+        self.assertEqual(writes.depth, 26)
+        self.set_database_online(True)
+        writes.start()
+        try:
+            self.assertTrue(writes.flush(10))
+            stats = writes.stats()
+        finally:
+            writes.stop()
+        self.assertEqual(self.count("employees"), (26, 26))
+        self.assertEqual(self.count("categories"), (1, 1))
+        self.assertEqual((stats.depth, stats.written, stats.batches), (0, 26, 3))
+        self.assertIsNotNone(stats.flush_max_ms)
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "")
+
+    def test_journal_is_locked(self):
+        """Тест: второй экземпляр не открывает журнал, пока его держит первый"""
+        writes = self.writer()
+        writes.submit("add_employee", "Alice")
+        with self.assertRaises(RuntimeError):
+            self.writer()
+        writes.stop()
+        writes = self.writer()
+        self.assertEqual(writes.depth, 1)
+        writes.stop()
+
+    def test_replay_is_idempotent(self):
+        """Тест: повтор уже записанных операций (отметка в журнале потеряна) ничего не дублирует"""
+        writes = self.writer()
+        emp_key = writes.submit("add_employee", "Alice")
+        writes.submit("add_category", "Testing")
+        writes.submit("add_competency", "Pytest", 999)
+        with self.assertRaises(ValueError):
+            writes.submit("submit_survey", 1, "2025-Q5", {1: 3})
+        with open(self.path, encoding="utf-8") as f:
+            journal = f.read()
+        writes.start()
+        try:
+            self.assertTrue(writes.flush(10))
+            # Компетенция без категории не записывается, остальная пачка - записывается
+            failed = writes.drain_failed()
+        finally:
+            writes.stop()
+        self.assertEqual([entry.args for entry, _ in failed], [["Pytest", 999]])
+        self.assertEqual(writes.stats().written, 2)
+
+        # Сбой между COMMIT и отметкой в журнале, к тому же с оборванной последней строкой
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(journal + '{"key": "')
+        writes = self.writer()
+        self.assertEqual(writes.depth, 3)
+        writes.start()
+        try:
+            self.assertTrue(writes.flush(10))
+        finally:
+            writes.stop()
+        self.assertEqual(self.count("employees"), (1, 1))
+        self.assertEqual(self.count("categories"), (1, 1))
+        self.assertEqual(self.query("SELECT result FROM applied_writes WHERE key = %s;", (emp_key,)),
+                         self.query("SELECT id FROM employees WHERE name = 'Alice';"))
+
+    def test_duplicates_are_reported(self):
+        """Тест: повтор имени категории или компетенции в очереди выбывает с ошибкой, а не молча"""
+        writes = self.writer()
+        writes.submit("add_category", "Testing")
+        writes.submit("add_category", "Testing")
+        writes.start()
+        try:
+            self.assertTrue(writes.flush(10))
+            category_id = self.query("SELECT id FROM categories WHERE name = 'Testing';")[0]
+            writes.submit("add_competency", "Pytest", category_id)
+            writes.submit("add_competency", "Pytest", category_id)
+            self.assertTrue(writes.flush(10))
+            failed = writes.drain_failed()
+        finally:
+            writes.stop()
+        self.assertEqual([(entry.op, error) for entry, error in failed],
+                         [("add_category", "Категория с таким именем уже существует"),
+                          ("add_competency", "Компетенция с таким именем уже существует в этой категории")])
+        self.assertEqual((writes.stats().written, writes.stats().failed), (2, 2))
+        self.assertEqual(self.count("competencies"), (1, 1))
+
+    def test_replay_horizon(self):
+        """Тест: операции старше горизонта повтора не отправляются, устаревшие ключи удаляются"""
+        old_key, fresh_key = str(uuid.uuid4()), str(uuid.uuid4())
+        conn = psycopg2.connect(**self.params)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("INSERT INTO applied_writes (key, result, created_at) VALUES "
+                               "(%s, 1, now() - interval '40 days'), (%s, 2, now());", (old_key, fresh_key))
+            conn.commit()
+        finally:
+            conn.close()
+        # Журнал старой версии без времени постановки и операция, пролежавшая восемь дней
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"key": str(uuid.uuid4()), "op": "add_employee", "args": ["Alice"]}) + "\n")
+            f.write(json.dumps({"key": str(uuid.uuid4()), "op": "add_employee", "args": ["Bob"],
+                                "at": time.time() - 8 * 86400}) + "\n")
+        writes = self.writer().start()
+        try:
+            self.assertTrue(writes.flush(10))
+            failed = writes.drain_failed()
+        finally:
+            writes.stop()
+        self.assertEqual([entry.args for entry, _ in failed], [["Bob"]])
+        self.assertEqual(self.count("employees"), (1, 1))
+        self.assertEqual(self.query("SELECT count(*) FROM applied_writes WHERE key IN (%s, %s);",
+                                    (old_key, fresh_key)), (1,))
+
+
+class TestQueryStats(unittest.TestCase):
+    def setUp(self):
+        self.conn = psycopg2.connect(host="localhost", port=5432, database="competencies",
+                                     user="user1", password="admin1", cursor_factory=InstrumentedCursor)
+        init_db(self.conn)
+        query_stats.reset()
+
+    def tearDown(self):
+        query_stats.enabled = False
+        query_stats.slow_threshold_ms = 200
+        query_stats.reset()
+        self.conn.close()
+
+    def test_disabled_collects_nothing(self):
+        """Тест: выключенный сбор ничего не записывает"""
+        get_employees(self.conn)
+        self.assertEqual(query_stats.snapshot()["functions"], {})
+
+    def test_function_stats_and_slow_log(self):
+        """Тест статистики по функциям и журнала медленных запросов с планом"""
+        query_stats.enabled = True
+        query_stats.slow_threshold_ms = 0
+        get_employees(self.conn)
+        get_competencies_by_category(self.conn, 1)
+        get_competencies_by_category(self.conn, 2)
+
+        stats = query_stats.snapshot()
+        entry = stats["functions"]["get_competencies_by_category"]
+        # Первый вызов на соединении дополнительно читает pg_prepared_statements и выполняет PREPARE
+        self.assertEqual((entry["calls"], entry["queries"], entry["errors"]), (2, 4, 0))
+        self.assertEqual(sum(entry["histogram"].values()), 2)
+        self.assertEqual(stats["functions"]["get_employees"]["rows"], len(get_employees(self.conn)))
+        slow = stats["slow_queries"][-1]
+        self.assertEqual(slow["function"], "get_competencies_by_category")
+        self.assertIn("competencies", slow["plan"])
+        json.dumps(stats)
+
+
+class StorageContract:
+    """Общие тесты для всех реализаций хранилища"""
+
+    def fill(self):
+        emp_id = self.storage.add_employee("Alice Smith")
+        cat_id = self.storage.add_category("Testing")
+        pytest_id = self.storage.add_competency("Pytest", cat_id)
+        mock_id = self.storage.add_competency("Mock", cat_id)
+        survey_id = self.storage.submit_survey(emp_id, "2024-Q1", {pytest_id: 4, mock_id: 5})
+        return emp_id, cat_id, pytest_id, mock_id, survey_id
+
+    def test_storage_workflow(self):
+        """Тест основного сценария через интерфейс хранилища"""
+        emp_id, cat_id, pytest_id, mock_id, survey_id = self.fill()
+        self.assertIsNone(self.storage.add_category("Testing"))
+        self.assertIsNone(self.storage.add_competency("Pytest", cat_id))
+        self.assertEqual(self.storage.get_employees(), [(emp_id, "Alice Smith")])
+        self.assertEqual(self.storage.get_catalog(),
+                         [((cat_id, "Testing"), [(pytest_id, "Pytest"), (mock_id, "Mock")])])
+
+        averages = self.storage.get_survey_averages(employee_id=emp_id)
+        self.assertEqual([(a.category, a.average, a.overall) for a in averages], [("Testing", 4.5, 4.5)])
+        self.assertEqual(self.storage.get_survey_overall([survey_id]), {survey_id: 4.5})
+        self.assertEqual([row.survey_id for row in self.storage.get_survey_page(sort="employee")], [survey_id])
+        self.assertEqual(self.storage.get_survey_page(survey_ids=[survey_id + 1]), [])
+        results = self.storage.get_survey_results()
+        self.assertIn("Testing - Pytest: 4.0", results)
+        self.assertIn("Общая оценка: 4.50", results)
+
+    def test_storage_search_employees(self):
+        """Тест поиска сотрудников по префиксу через интерфейс хранилища"""
+        ids = self.storage.add_employees(["Борис", "анна", "Антон", "Алла"])
+        self.assertEqual(self.storage.search_employees("А"), [(ids[3], "Алла"), (ids[1], "анна"), (ids[2], "Антон")])
+        self.assertEqual(self.storage.search_employees("ан", limit=1), [(ids[1], "анна")])
+        self.assertEqual(self.storage.search_employees("в"), [])
+
+    def test_storage_periods(self):
+        """Тест фильтров по кварталу и диапазону кварталов через интерфейс хранилища"""
+        emp_id, cat_id, pytest_id, mock_id, survey_id = self.fill()
+        later_id = self.storage.submit_survey(emp_id, "2025-q2", {pytest_id: 2})
+        first = self.storage.get_survey_page(sort="period", limit=1)
+        self.assertEqual(self.storage.get_survey_page(sort="period", after=survey_page_key(first[0], "period")),
+                         self.storage.get_surveys_between("2024-Q2"))
+        self.assertEqual([row.survey_id for row in self.storage.get_surveys_between("2024-Q1", "2025-Q2")],
+                         [survey_id, later_id])
+        self.assertEqual([row.period for row in self.storage.get_survey_page(period="2025-Q2")], ["2025-Q2"])
+        self.assertEqual([(row.period, row.surveys, row.average) for row in self.storage.get_period_summary()],
+                         [("2024-Q1", 1, 4.5), ("2025-Q2", 1, 2.0)])
+        self.assertEqual(len(self.storage.get_survey_scores(period=PeriodRange("2024-Q2", None))), 1)
+        with self.assertRaises(ValueError):
+            self.storage.add_survey(emp_id, "весна 2025")
+
+    def test_storage_batch_variants(self):
+        """Тест пакетных методов хранилища"""
+        emp_id, cat_id, pytest_id, mock_id, survey_id = self.fill()
+        self.assertEqual(len(self.storage.add_employees(["Bob", "Cid"])), 2)
+        self.assertEqual(self.storage.get_competencies_by_categories([cat_id]),
+                         {cat_id: [(pytest_id, "Pytest"), (mock_id, "Mock")]})
+        other_id = self.storage.add_survey(emp_id, "2024-Q2")
+        self.assertEqual(self.storage.add_survey_scores([(other_id, pytest_id, 2), (other_id, mock_id, 3)]), 2)
+        self.assertEqual(self.storage.get_survey_overall([other_id]), {other_id: 2.5})
+
+    def test_storage_invalid_score(self):
+        """Тест: некорректная оценка не записывает опрос ни в одно хранилище"""
+        emp_id, cat_id, pytest_id, mock_id, survey_id = self.fill()
+        with self.assertRaises(ValueError):
+            self.storage.submit_survey(emp_id, "2024-Q2", {pytest_id: 4, mock_id: 0})
+        self.assertEqual(len(self.storage.get_survey_page()), 1)
+
+
+class TestSQLiteStorage(StorageContract, unittest.TestCase):
+    def setUp(self):
+        self.storage = SQLiteStorage(":memory:")
+        self.storage.init_db()
+
+    def tearDown(self):
+        self.storage.close()
+
+    def test_legacy_file_gets_period_start(self):
+        """Тест: файл SQLite, созданный до появления period_start, дополняется при init_db"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "offline.db")
+            legacy = SQLiteStorage(path)
+            legacy.conn.executescript(SQLiteStorage.SCHEMA.replace(",\n        period_start TEXT GENERATED ALWAYS AS "
+                                                                   "({period_start}) VIRTUAL", ""))
+            legacy.conn.execute("INSERT INTO employees (name) VALUES ('Alice');")
+            legacy.conn.execute("INSERT INTO surveys (employee_id, period) VALUES (1, '2024-Q3');")
+            legacy.conn.commit()
+            legacy.close()
+            storage = SQLiteStorage(path)
+            storage.init_db()
+            self.assertEqual([row.period for row in storage.get_surveys_between("2024-Q3", "2024-Q3")], ["2024-Q3"])
+            storage.close()
+
+    def test_executor_with_sqlite_pool(self):
+        """Тест: DBExecutor работает с SQLite так же, как с пулом PostgreSQL"""
+        db = DBExecutor(SQLiteStoragePool(":memory:"), workers=2)
+        results = []
+        db.submit(lambda storage: storage.init_db()).future.result(timeout=5)
+        db.submit(lambda storage: storage.add_category("Offline"), on_success=results.append).future.result(timeout=5)
+        db.process_completed()
+        db.shutdown()
+        self.assertEqual(results, [1])
+
+
+class TestPostgresStorage(StorageContract, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = psycopg2.connect(host="localhost", port=5432, database="competencies",
+                                    user="user1", password="admin1")
+        init_db(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def setUp(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("TRUNCATE survey_scores, surveys, competencies, categories, employees "
+                           "RESTART IDENTITY CASCADE;")
+        self.conn.commit()
+        catalog_cache.invalidate()
+        self.storage = PostgresStorage(self.conn)
+
+    def test_sync_offline_surveys(self):
+        """Тест переноса опросов из SQLite в PostgreSQL без повторов"""
+        offline = SQLiteStorage(":memory:")
+        offline.init_db()
+        self.storage = offline
+        self.fill()
+        self.storage = PostgresStorage(self.conn)
+
+        self.assertEqual(tuple(sync_offline_surveys(offline, self.conn)), (1, 2, 0))
+        self.assertEqual(tuple(sync_offline_surveys(offline, self.conn)), (0, 0, 0))
+        offline.close()
+        averages = self.storage.get_survey_averages()
+        self.assertEqual([(a.employee_name, a.period, a.average) for a in averages], [("Alice Smith", "2024-Q1", 4.5)])
+
 
 class CustomTestRunner(unittest.TextTestRunner):
     """Кастомный runner для улучшенного вывода"""